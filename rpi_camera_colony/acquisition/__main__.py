@@ -10,6 +10,7 @@ import time
 import tqdm
 
 import rpi_camera_colony
+from rpi_camera_colony.acquisition.simulation import enable_simulation, simulation_enabled
 from rpi_camera_colony.config.config import (
     get_local_ip_address,
     setup_logging_via_socket,
@@ -31,6 +32,12 @@ def parse_args_for_piacquisitioncontrol():
         type=float,
         help="Print interval [seconds, float]",
     )
+    parser_general.add_argument(
+        "--simulate",
+        default=False,
+        action="store_true",
+        help="Use simulated camera & GPIO (runs on non-RPi machines, e.g. for benchmarks)",
+    )
     parser_general.add_argument(
         "--version",
         "-v",
@@ -157,8 +164,11 @@ def parse_args_for_piacquisitioncontrol():
 def main():
     args = parse_args_for_piacquisitioncontrol()
 
+    if args.simulate:
+        enable_simulation()
+
     # Exit if not on RPi -- makes parser outline available on non-RPi machines
-    if "arm" not in platform.machine().lower():
+    if "arm" not in platform.machine().lower() and not simulation_enabled():
         print("Not on Raspberry Pi. Exiting.")
         sys.exit(0)
 
@@ -3,20 +3,35 @@
 # License: BSD 3-Clause
 import json
 import logging
+import time
+from concurrent.futures import Future
 from pathlib import Path
-from threading import Thread
+from threading import Event, Thread
 
-from rpi_camera_colony.acquisition.streaming import StreamingHandler, StreamingServer
+import zmq
+
+from rpi_camera_colony.acquisition.h264_stream import H264StreamServer
+from rpi_camera_colony.acquisition.status import StatusPublisher
+from rpi_camera_colony.acquisition.streaming import (
+    AsyncStreamingServer,
+    StreamingHandler,
+    StreamingServer,
+)
+from rpi_camera_colony.acquisition.telemetry import TelemetryCollector
+from rpi_camera_colony.clock import wait_until
+from rpi_camera_colony.command_channel import CommandReceiver
 from rpi_camera_colony.config.config import (
     get_interface_mac_address,
     get_local_ip_address,
 )
+from rpi_camera_colony.control import presence
 from rpi_camera_colony.files import (
     DummyFileObject,
     get_datestr,
     make_recording_file_names,
 )
-from rpi_camera_colony.network_communication import ListenerStream, SocketCommunication
+from rpi_camera_colony.network_communication import SocketCommunication, SocketPoller
+from rpi_camera_colony.serialization import available_codecs
 
 try:
     from rpi_camera_colony.acquisition.camera import Camera
@@ -34,10 +49,21 @@ class PiAcquisitionControl:
     resolution = (640, 480)
     framerate = 90
 
+    control_socket = None
     control_stream = None
+    command_receiver = None
     control_stream_ip = None
     control_stream_port = None
 
+    log_ip = None
+    log_port = None
+    status_socket = None  # heartbeats, frame statistics & telemetry, one topic each
+    _status_publisher = None
+    frame_stats_interval = 2.0
+    telemetry_interval = 1.0
+    heartbeat_interval = 0.5
+    state = presence.BOOTED
+
     instance_name = get_local_ip_address()
     data_path = "/home/pi/data/"
     acquisition_name = "test_recording"
@@ -45,17 +71,37 @@ class PiAcquisitionControl:
     acquisition_time = get_datestr()
     acquisition_file_base = None
     acquisition_files = None
+    acquisition_file_dt = None
     acquisition_settings = {}
+    clock_models = None  # camera clock to system clock models, added to metadata at stop
+    start_at = None  # scheduled wall-clock start time
+    start_offset = None  # seconds from scheduled start to the first frame
+    start_duration = None  # seconds in start_recording
+    first_frame_timeout = 1.0  # seconds, start_offset from start_recording return without frame
+    _scheduled_start = None  # thread waiting for start_at
+    _cancel_start = None
+    session_metadata = None  # from Conductor, e.g. start skew of all cameras
     video_quality = 23
     save_data = True
 
     stream_video = False
     stream_ip = ""
     stream_port = 8001
+    stream_server = "asyncio"  # "asyncio" (single fan-out) or "threading" (thread per client)
     _stream_handler_handle = None
     _stream_server = None
     _stream_thread = None
 
+    raw_frames = False
+    raw_frames_ip = "*"
+    raw_frames_port = 8002
+    raw_frames_hwm = 2  # frames queued per subscriber, then frames are dropped
+    raw_frame_socket = None
+
+    # Encoding of status, telemetry, heartbeat & raw frame metadata. JSON until the conductor
+    # sends the codec negotiated from the hello message with the config.
+    message_codec = "json"
+
     def __init__(
         self,
         instance_name=None,
@@ -80,37 +126,92 @@ class PiAcquisitionControl:
                 setattr(self, attr, value)
                 logging.debug(f"Set {self}, attr {attr} to value {value}")
 
+        # Announce state to the Conductor from startup on. Heartbeats, frame statistics and
+        # telemetry are topics on one status socket to the Conductor's logging socket
+        if self.log_ip and self.log_port:
+            self.status_socket = SocketCommunication(
+                address=self.log_ip,
+                port=self.log_port,
+                pattern="PUB",
+                bind=False,
+                codec=self.message_codec,
+            )
+            self._status_publisher = StatusPublisher(
+                socket_wrapper=self.status_socket, instance_name=self.instance_name
+            )
+            self._status_publisher.add_topic(
+                topic="HEARTBEAT",
+                status_callback=self._get_heartbeat,
+                interval=self.heartbeat_interval,
+            )
+            self._status_publisher.start()
+
         self.camera = Camera(**kwargs)
+        self.state = presence.CAMERA_WARMED
         self.camera.preview_static()
+        self.state = presence.PREVIEW_DONE
 
-        # Make command_socket to receive control commands & subscribe to own channel
+        # Receive & acknowledge commands from the Conductor, addressed by instance name
         self.control_socket = SocketCommunication(
             address=self.control_stream_ip,
             port=self.control_stream_port,
-            pattern="SUB",
+            pattern="DEALER",
             bind=False,
-            subscribe_to=self.instance_name,
+            identity=self.instance_name,
         )
-        self.control_stream = ListenerStream(
-            socket_dict={1: self.control_socket.socket},
-            recv_callback_dict=self._received_command,
+        self.command_receiver = CommandReceiver(
+            socket_wrapper=self.control_socket, handler=self._received_command
         )
+        self.command_receiver.say_hello(codecs=available_codecs())
+        self.control_stream = SocketPoller(
+            socket_dict={"control": self.control_socket.socket},
+            recv_callback_dict=self.command_receiver.receive,
+        )
+        self.command_receiver.call_soon = self.control_stream.call_soon  # deferred acks
         self.control_stream.start()
+
+        if self._status_publisher is not None:
+            self._status_publisher.add_topic(
+                topic="FRAMESTATS",
+                status_callback=self._get_frame_stats,
+                interval=self.frame_stats_interval,
+            )
+            self._status_publisher.add_topic(
+                topic="TELEMETRY",
+                status_callback=TelemetryCollector(
+                    camera=self.camera, data_path=self.data_path
+                ).snapshot,
+                interval=self.telemetry_interval,
+            )
+
         logging.debug("PiAcquisitionControl instantiated.")
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.state = presence.CLOSING
         if self.camera is not None:
+            self._cancel_scheduled_start()
             if self.camera.preview is not None:
                 self.camera.stop_preview()
             if self.camera.recording:
                 self.camera.stop_recording()
+        self._stop_raw_frame_publisher()
+
+        if self._status_publisher is not None:
+            self._status_publisher.stop()
+            self._status_publisher.publish(topic="FRAMESTATS")
+            self._status_publisher.publish(topic="HEARTBEAT")  # last heartbeat: closing
+        if self.status_socket is not None:
+            self.status_socket.close()
+
+        if self.camera is not None:
             del self.camera
             self.camera = None
 
         self.control_stream.stop()
+        self.control_socket.close()
         logging.debug("Exiting PiAcquisitionControl.")
 
     def shutdown(self):
@@ -122,8 +223,9 @@ class PiAcquisitionControl:
         metadata = {
             k: v
             for k, v in vars(self).items()
-            if not isinstance(v, SocketCommunication)
-            and not isinstance(v, ListenerStream)
+            if not isinstance(v, (SocketCommunication, CommandReceiver))
+            and not isinstance(v, (Thread, Event))
+            and not isinstance(v, (type, StreamingServer))
             and not isinstance(v, type(self.camera))
         }
         metadata["mac_address"] = get_interface_mac_address()
@@ -135,6 +237,17 @@ class PiAcquisitionControl:
         if not Path(save_path).exists():
             logging.error(f"Could not write metadata file to {save_path}")
 
+    def _get_heartbeat(self):
+        return {"state": self.state, "sys_time": time.time()}
+
+    def _get_frame_stats(self):
+        if self.camera is None or self.camera.frame_gap_monitor is None:
+            return None
+
+        stats = self.camera.frame_gap_monitor.snapshot()
+        stats["recording"] = bool(self.camera.recording)
+        return stats
+
     def _make_acquisition_paths(self):
         # Paths
         file_base = ".".join([self.acquisition_name, self.instance_name])
@@ -150,13 +263,44 @@ class PiAcquisitionControl:
             logging.error(err_msg)
             raise FileNotFoundError(err_msg)
         self.acquisition_file_base = str(acquisition_file_base_path)
+        self.acquisition_file_dt = get_datestr()
         self.acquisition_files = make_recording_file_names(
             path=self.acquisition_file_base,
+            dt=self.acquisition_file_dt,
+            segment_index=0 if self.camera.segmented_recording else None,
         )
         logging.debug(f"Files:\n{json.dumps(self.acquisition_files, sort_keys=True, indent=4)}")
 
+    def _make_segment_files(self, segment_index=0):
+        return make_recording_file_names(
+            path=self.acquisition_file_base,
+            dt=self.acquisition_file_dt,
+            segment_index=segment_index,
+        )
+
     def _start_network_stream(self):
-        if self.stream_video and self.camera.streaming_output is not None:
+        if not self.stream_video:
+            return
+
+        if self.camera.h264_streaming:
+            self._stream_server = H264StreamServer(
+                output=self.camera.h264_stream_output,
+                address=self.stream_ip,
+                port=self.stream_port,
+            )
+            self._stream_server.start()
+            logging.debug(f"Streaming H.264 on tcp://{self.stream_ip}:{self.stream_port}")
+        elif self.camera.streaming_output is None:
+            return
+        elif self.stream_server == "asyncio":
+            self._stream_server = AsyncStreamingServer(
+                output=self.camera.streaming_output,
+                address=self.stream_ip,
+                port=self.stream_port,
+            )
+            self._stream_server.start()
+            logging.debug(f"Streaming video on {self.stream_ip}:{self.stream_port}")
+        else:
             self._stream_handler_handle = StreamingHandler
             self._stream_handler_handle.output_from_camera = self.camera.streaming_output
             self._stream_server = StreamingServer(
@@ -173,18 +317,48 @@ class PiAcquisitionControl:
             self._stream_server.shutdown()
             logging.debug(f"Shutting down video stream on {self.stream_ip}:{self.stream_port}")
 
-    def _received_command(self, command):
-        command = [c.decode() for c in command]
-        recipient, message_dict_str = command
-        message = json.loads(message_dict_str, encoding="utf-8")
+    def _start_raw_frame_publisher(self):
+        if not self.raw_frames or self.camera.raw_frame_output is None:
+            return
+
+        self.raw_frame_socket = SocketCommunication(
+            address=self.raw_frames_ip,
+            port=self.raw_frames_port,
+            pattern="PUB",
+            bind=True,
+            codec=self.message_codec,
+            auto_open=False,
+        )
+        self.raw_frame_socket.open()
+        self.raw_frame_socket.socket.setsockopt(zmq.SNDHWM, self.raw_frames_hwm)
+        self.camera.raw_frame_output.add_frame_callback(self._publish_raw_frame)
+        logging.debug(f"Publishing raw frames on {self.raw_frame_socket.full_address}")
 
+    def _publish_raw_frame(self, array, metadata):
+        # Encoder thread. Arrays are new per frame: send without copy
+        self.raw_frame_socket.send_array(array=array, metadata=metadata, copy=False)
+
+    def _stop_raw_frame_publisher(self):
+        if self.raw_frame_socket is not None:
+            self.raw_frame_socket.close()
+            self.raw_frame_socket = None
+
+    def _received_command(self, message):
         ms = message.get("status", "")
         logging.info(f"Received: {message['type']} {'>' if ms else ''} {ms}")
 
         if message["type"] == "command":
-            self._update_camera_status(new_status=message["status"])
+            return self._update_camera_status(
+                new_status=message["status"], start_at=message.get("start_at")
+            )
         elif message["type"] == "config":
             self._update_settings(config_data=message)
+        elif message["type"] == "metadata":
+            # Session information from the Conductor, e.g. start skew of all cameras
+            self.session_metadata = dict(self.session_metadata or {}, **message)
+            self.session_metadata.pop("type")
+            if self.save_data and self.acquisition_files is not None:
+                self._write_metadata_file()
 
     def _update_settings(self, config_data=None):
         self.acquisition_settings = config_data
@@ -200,11 +374,69 @@ class PiAcquisitionControl:
                 setattr(self, setting_name, setting_value)
                 logging.debug(f"setattr(self, {setting_name}, {setting_value})")
 
-    def _update_camera_status(self, new_status="stop"):
+        if self._status_publisher is not None:
+            for topic, interval in [
+                ("FRAMESTATS", self.frame_stats_interval),
+                ("TELEMETRY", self.telemetry_interval),
+                ("HEARTBEAT", self.heartbeat_interval),
+            ]:
+                self._status_publisher.set_interval(topic=topic, interval=interval)
+        if self.status_socket is not None:
+            self.status_socket.codec = self.message_codec
+
+    def _start_recording(self):
+        call_time = time.time()
+        self.camera.start_recording(
+            output_files=self.acquisition_files,
+            make_segment_files=self._make_segment_files if self.save_data else None,
+            format="h264",
+            quality=self.video_quality,
+        )
+        return_time = time.time()
+        self.start_duration = return_time - call_time
+        self.start_offset = None
+        if self.start_at is not None:
+            first_frame_time = self.camera.wait_for_first_frame(timeout=self.first_frame_timeout)
+            if first_frame_time is None:
+                logging.warning("No frame after start: start offset from start_recording return.")
+                first_frame_time = return_time
+            self.start_offset = first_frame_time - self.start_at
+            logging.debug(f"First frame {1e3 * self.start_offset:.3f}ms after scheduled start.")
+
+        self._start_network_stream()
+        self._start_raw_frame_publisher()
+        self.state = presence.RECORDING
+        return {"start_offset": self.start_offset, "start_duration": self.start_duration}
+
+    def _start_recording_at(self, start_at, result):
+        # Sleep interruptibly by a stop until shortly before start_at, wait_until is precise
+        if self._cancel_start.wait(max(0.0, start_at - time.time() - 0.1)):
+            result.set_exception(RuntimeError("Scheduled start cancelled."))
+            return
+        try:
+            wait_until(start_at)
+            result.set_result(self._start_recording())
+        except Exception as e:
+            result.set_exception(e)
+
+    def _cancel_scheduled_start(self):
+        """Cancel a scheduled start, returns True if it had not started recording yet."""
+        if self._scheduled_start is None:
+            return False
+        self._cancel_start.set()
+        self._scheduled_start.join()
+        self._scheduled_start = None
+        return not self.camera.recording
+
+    def _update_camera_status(self, new_status="stop", start_at=None):
+        """
+        :param start_at: wall-clock time (`time.time`) to start recording at, if status is start
+        """
         logging.debug(f"New status: {new_status} on {self.instance_name}")
 
         if new_status in ["preview", "reset"]:
             self.camera.preview_static()
+            self.state = presence.PREVIEW_DONE
 
         elif new_status in "start":
             if not self.save_data:
@@ -214,17 +446,37 @@ class PiAcquisitionControl:
                 self._make_acquisition_paths()
                 self._write_metadata_file()
 
-            self.camera.start_recording(
-                output_files=self.acquisition_files,
-                format="h264",
-                quality=self.video_quality,
+            self.start_at = start_at
+            if start_at is None:
+                return self._start_recording()
+
+            # Wait in a thread so that other commands are handled meanwhile. The command is
+            # acknowledged with the start offset when the returned future is done.
+            result = Future()
+            self._cancel_start = Event()
+            self._scheduled_start = Thread(
+                target=self._start_recording_at, args=(start_at, result), daemon=True
             )
+            self._scheduled_start.start()
+            return result
 
-            self._start_network_stream()
+        elif new_status == "trigger":
+            self.camera.trigger_clip(source="command")
 
         elif new_status in "stop":
+            if self._cancel_scheduled_start():
+                self.state = presence.STOPPED
+                return
             self._stop_network_stream()
             self.camera.stop_recording()
+            self._stop_raw_frame_publisher()
+
+            self.clock_models = self.camera.clock_models
+            if self.save_data and self.acquisition_files is not None:
+                self._write_metadata_file()
+            self.state = presence.STOPPED
 
         elif new_status in "close":
+            self._cancel_scheduled_start()
+            self.state = presence.CLOSING
             self.shutdown()
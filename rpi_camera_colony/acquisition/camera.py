@@ -3,19 +3,39 @@
 # License: BSD 3-Clause
 import logging
 import time
-from pathlib import Path
-
-try:
-    import picamera
-    import RPi.GPIO as GPIO
-    from picamera import mmal
-except ImportError:
-    raise ImportError(
-        "Can only run camera module on Raspberry Pi "
-        "with RPi.GPIO and picamera packages installed."
-    )
+from threading import Event
+
+from rpi_camera_colony.acquisition.simulation import simulation_enabled
+
+if simulation_enabled():
+    from rpi_camera_colony.acquisition.simulation import gpio as GPIO
+    from rpi_camera_colony.acquisition.simulation import mmal, picamera
+else:
+    try:
+        import picamera
+        import RPi.GPIO as GPIO
+        from picamera import mmal
+    except ImportError:
+        raise ImportError(
+            "Can only run camera module on Raspberry Pi "
+            "with RPi.GPIO and picamera packages installed. "
+            "Set RCC_SIMULATE_HARDWARE=1 to use the simulated camera."
+        )
+from rpi_camera_colony.acquisition.clock_sampler import ClockSampler
+from rpi_camera_colony.acquisition.frame_monitor import FrameGapMonitor
+from rpi_camera_colony.acquisition.h264_stream import H264StreamOutput
+from rpi_camera_colony.acquisition.pretrigger import ClipWriter, PreTriggerBuffer
+from rpi_camera_colony.acquisition.raw_frames import RawFrameOutput
+from rpi_camera_colony.acquisition.segments import RecordingSegmenter
 from rpi_camera_colony.acquisition.streaming import StreamingOutput
-from rpi_camera_colony.files import DummyFileObject, close_file_safe
+from rpi_camera_colony.acquisition.timestamps import TimestampWriter
+from rpi_camera_colony.acquisition.ttl import (
+    RPiGPIOBackend,
+    TTLEdgeFilter,
+    TTLPulseGenerator,
+)
+from rpi_camera_colony.files import TIMESTAMP_FIELDS, DummyFileObject
+from rpi_camera_colony.latency import LatencyRecorder
 
 GPIO.setwarnings(False)
 GPIO.cleanup()
@@ -26,84 +46,176 @@ def _get_realtime():
     return time.clock_gettime(time.CLOCK_REALTIME)
 
 
+def _get_monotonic_us():
+    return time.monotonic_ns() // 1000
+
+
 class VideoEncoder(picamera.PiVideoEncoder):
     """https://picamera.readthedocs.io/en/release-1.13/recipes2.html#custom-encoders"""
 
     frame_count = 0
     ttl_count = 0
+    bytes_written = 0
 
-    _ttl_out_pin = 8  # TODO: set to final value
-    _ttl_out_duration = 0.001  # 1ms
+    ttl_pulse_generator = None
+    callback_latency = None
+    h264_stream_output = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.callback_latency = LatencyRecorder()
 
         for arg, val in kwargs.items():
             if hasattr(self, arg):
                 setattr(self, arg, val)
 
-    @property
-    def ttl_out_pin(self):
-        return self._ttl_out_pin
-
-    @ttl_out_pin.setter
-    def ttl_out_pin(self, value):
-        logging.debug(f"Setting TTL out pin to {value}")
-        self._ttl_out_pin = value
-        if self.ttl_out_pin is not None:
-            GPIO.setup(self.ttl_out_pin, GPIO.OUT, initial=GPIO.LOW)
-            GPIO.output(self.ttl_out_pin, False)
-
-    @property
-    def ttl_out_duration(self):
-        return self._ttl_out_duration
-
-    @ttl_out_duration.setter
-    def ttl_out_duration(self, value):
-        logging.debug(f"Setting TTL out duration to {value}")
-        self._ttl_out_duration = value
-
     def start(self, output, motion_output=None):
         super().start(output, motion_output)
 
     def close(self):
         super().close()
 
-        if self.ttl_count != self.frame_count:
+        if self.ttl_pulse_generator is None:
+            return
+
+        expected_ttl_count = -(-self.frame_count // self.ttl_pulse_generator.every_nth)
+        if self.ttl_count != expected_ttl_count:
             logging.warning(
-                f"Frame count ({self.frame_count}) and TTL count ({self.ttl_count}) "
-                f"do not match."
+                f"Frame count ({self.frame_count}) and TTL count ({self.ttl_count}) do not match."
             )
 
     def _callback_write(self, buf, key=None):
-        if (buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END) and not (
-            buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG
-        ):
-            if self.ttl_out_pin is not None:
-                GPIO.output(self.ttl_out_pin, True)
-                time.sleep(self.ttl_out_duration)
-                GPIO.output(self.ttl_out_pin, False)
-
+        callback_start = time.perf_counter()
+        frame_end = buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END
+        config = buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG
+        if config and self._next_output and self.parent._pending_segment_files is not None:
+            # picamera switches to the split_recording output at this config buffer
+            self.parent._start_timestamp_segment()
+
+        if frame_end and not config:
+            if self.ttl_pulse_generator is not None and self.ttl_pulse_generator.trigger():
                 self.ttl_count += 1
 
-            self.parent._write_timestamps_frame_ttl_out(buf.pts, self.parent.timestamp)
+            self.parent._write_timestamps_frame_ttl_out(buf.pts)
+            self.parent.frame_gap_monitor.update(buf.pts)
             self.frame_count += 1
 
+        result = super()._callback_write(buf)
+
+        if self.parent.pre_trigger_buffer is not None and (frame_end or config):
+            self.parent.pre_trigger_buffer.end_frame(
+                pts=buf.pts,
+                key_frame=bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_KEYFRAME),
+                config=bool(config),
+            )
+
+        if self.h264_stream_output is not None:
+            self.h264_stream_output.write_buffer(
+                buf.data,
+                config=bool(config),
+                key_frame=bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_KEYFRAME),
+                frame_end=bool(frame_end),
+            )
+
+        self.bytes_written += buf.length
+        self.callback_latency.add(time.perf_counter() - callback_start)
+        return result
+
+
+class DecimatingEncoderMixin:
+    """Only pass every n-th frame to the encoder output."""
+
+    every_nth = 1
+    frame_count = 0
+
+    def _write_frame_buffer(self, buf):
         return super()._callback_write(buf)
 
+    def _callback_write(self, buf, key=None):
+        frame_end = buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END
+        if self.frame_count % self.every_nth:
+            result = bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_EOS)
+        else:
+            result = self._write_frame_buffer(buf)
+
+        if frame_end:
+            self.frame_count += 1
+        return result
+
+
+class StreamEncoder(DecimatingEncoderMixin, picamera.PiVideoEncoder):
+    """Encoder for the network stream that only passes every n-th frame to the output."""
+
+
+class RawFrameEncoder(DecimatingEncoderMixin, picamera.PiRawVideoEncoder):
+    """Encoder for raw frames that passes every n-th frame with its index & timestamp."""
+
+    def _write_frame_buffer(self, buf):
+        # Splitter buffers do not reliably carry FRAME_START: frames start by byte count
+        output = self.parent.raw_frame_output
+        output.set_frame_info(frame_index=self.frame_count, pts=buf.pts)
+        result = super()._write_frame_buffer(buf)
+        if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END:
+            output.end_frame()
+        return result
+
 
 class Camera(picamera.PiCamera):
     _ttl_out_pin = 8
     _ttl_in_pin = 16
     _ttl_out_duration = 0.001
-
-    file_timestamps_ttl_out = None
-    file_timestamps_ttl_in = None
+    ttl_out_every_nth = 1  # pulse on every n-th frame
+    ttl_out_pulses_per_trigger = 1  # >1 emits a pulse train per frame
+    ttl_out_pulse_interval = 0.002  # seconds between pulses of a train
+    ttl_pulse_generator = None
+    ttl_in_debounce = 0  # microseconds, ignore TTL-in edges closer to the previous edge
+    ttl_in_every_nth = 1  # record every n-th TTL-in edge
+    ttl_in_filter = None
+
+    clock_sample_interval = 1.0  # seconds between camera/system clock samples
+    frame_clock_queries = False  # True: camera & system clock query per frame
+    clock_sampler = None
+    clock_models = None
+
+    timestamp_writer_ttl_out = None
+    timestamp_writer_ttl_in = None
+    timestamp_format = "csv"  # "csv", "binary" or "both"
+
+    frame_gap_monitor = None
+    first_frame_time = None  # system time of the first frame of the recording
+    _first_frame = None
+    timestamp_buffer_size = 2**16
+    timestamp_flush_interval = 0.5
+
+    recording_mode = "continuous"  # "continuous" or "triggered" (clips around triggers only)
+    pre_trigger_seconds = 5.0
+    post_trigger_seconds = 5.0
+    pre_trigger_buffer = None
+    clip_writer = None
+
+    segment_duration = 0  # seconds per video segment, 0 for no time limit
+    segment_size_mb = 0  # megabytes per video segment, 0 for no size limit
+    recording_segmenter = None
+    _pending_segment_files = None
 
     clock_mode = "raw"
 
     stream_video = False
+    stream_mode = "mjpeg"  # "mjpeg" (second encoder on splitter port 2) or "h264" (recording)
     streaming_output = None
+    h264_stream_output = None
+    stream_resolution = None  # (width, height) or (width,) of the stream, None: recording size
+    stream_framerate = 0  # frames per second of the stream, 0 for recording framerate
+    stream_quality = 0  # MJPEG quality 1-100, 0 for encoder default
+
+    raw_frames = False  # raw frames from splitter port 3 for online analysis
+    raw_frames_resolution = (160, 128)
+    raw_frames_framerate = 0  # 0 for recording framerate
+    raw_frames_format = "grey"  # "grey" (Y plane) or "yuv" (YUV420)
+    raw_frame_output = None
+
+    _recording_splitter_port = 1
+    video_encoder = None
 
     def __init__(
         self,
@@ -122,7 +234,7 @@ class Camera(picamera.PiCamera):
             clock_mode=self.clock_mode,
         )
 
-        if self.stream_video:
+        if self.stream_video and not self.h264_streaming:
             self.streaming_output = StreamingOutput()
 
     @property
@@ -150,67 +262,303 @@ class Camera(picamera.PiCamera):
         self._ttl_in_pin = value
 
     def _get_video_encoder(self, camera_port, output_port, format, resize, **options):
+        if self._recording_splitter_port == 2:
+            stream_encoder = StreamEncoder(
+                self, camera_port, output_port, format, resize, **options
+            )
+            stream_encoder.every_nth = self._every_nth(self.stream_framerate)
+            return stream_encoder
+
+        if self._recording_splitter_port == 3:
+            raw_encoder = RawFrameEncoder(self, camera_port, output_port, format, resize, **options)
+            raw_encoder.every_nth = self._every_nth(self.raw_frames_framerate)
+            return raw_encoder
+
+        if self._recording_splitter_port != 1:
+            # Only the main recording emits TTL and frame timestamps
+            return super()._get_video_encoder(camera_port, output_port, format, resize, **options)
+
         video_encoder = VideoEncoder(self, camera_port, output_port, format, resize, **options)
-        video_encoder.ttl_out_pin = self.ttl_out_pin
-        video_encoder.ttl_out_duration = self.ttl_out_duration
+        video_encoder.ttl_pulse_generator = self.ttl_pulse_generator
+        if self.h264_streaming:
+            video_encoder.h264_stream_output = self.h264_stream_output
+        self.video_encoder = video_encoder
         return video_encoder
 
     def __del__(self):
         GPIO.cleanup()
         del self
 
-    def _write_timestamps_ttl_in(self, x=None):
-        if self.file_timestamps_ttl_in is not None:
-            self.file_timestamps_ttl_in.write(f"{self.timestamp},{_get_realtime()}\n")
-            logging.info(f"TTL-in detected at {self.timestamp}")
+    def _stream_resize(self):
+        """Stream resolution, with the height from the recording aspect ratio if not given."""
+        if not self.stream_resolution or not self.stream_resolution[0]:
+            return None
+        width, height = (list(self.stream_resolution) + [0])[:2]
+        if not height:
+            recording_width, recording_height = self.resolution
+            height = 2 * round(width * recording_height / recording_width / 2)
+        return width, height
+
+    def _every_nth(self, framerate=0):
+        """Decimation of the camera framerate to `framerate` (0 for no decimation)."""
+        if not framerate:
+            return 1
+        return max(1, round(float(self.framerate) / framerate))
 
-    def _write_timestamps_frame_ttl_out(self, cam_ts, frame_ts):
-        if self.file_timestamps_ttl_out is not None:
-            self.file_timestamps_ttl_out.write(f"{cam_ts},{frame_ts},{_get_realtime()}\n")
+    @property
+    def h264_streaming(self):
+        """Stream the H.264 frames of the recording instead of a second MJPEG encoder."""
+        return self.stream_video and self.stream_mode == "h264"
 
-    def start_recording(self, output_files=None, **kwargs):
+    @property
+    def segmented_recording(self):
+        return bool(self.segment_duration or self.segment_size_mb)
+
+    def _timestamp_paths(self, output_files=None, file_key="ttl.out"):
+        use_csv = self.timestamp_format in ["csv", "both"]
+        use_binary = self.timestamp_format in ["binary", "both"]
+        return {
+            "path": output_files[file_key] if use_csv else None,
+            "binary_path": output_files[file_key + ".bin"] if use_binary else None,
+        }
+
+    def _make_timestamp_writer(self, output_files=None, file_key="ttl.out"):
+        writer = TimestampWriter(
+            **self._timestamp_paths(output_files=output_files, file_key=file_key),
+            fields=TIMESTAMP_FIELDS[file_key],
+            buffer_size=self.timestamp_buffer_size,
+            flush_interval=self.timestamp_flush_interval,
+        )
+        writer.start()
+        return writer
+
+    def _start_timestamp_segment(self):
+        """Continue timestamp files of the next segment. Called from the encoder thread."""
+        segment_files = self._pending_segment_files
+        self._pending_segment_files = None
+
+        for writer, file_key in [
+            (self.timestamp_writer_ttl_out, "ttl.out"),
+            (self.timestamp_writer_ttl_in, "ttl.in"),
+        ]:
+            if writer is not None:
+                paths = self._timestamp_paths(output_files=segment_files, file_key=file_key)
+                writer.rollover(**paths)
+
+    def _get_clock_offsets(self):
+        return None if self.clock_sampler is None else self.clock_sampler.offsets
+
+    def _get_camera_time_estimate(self):
+        """Camera clock time from the monotonic clock and the offset of the last clock sample.
+
+        Avoids an MMAL query for each TTL-in edge while recording.
+        """
+        offsets = self._get_clock_offsets()
+        if offsets is None:
+            return self.timestamp
+        return _get_monotonic_us() + offsets[0]
+
+    def _write_timestamps_ttl_in(self, x=None):
+        if self.timestamp_writer_ttl_in is None:
+            return
+
+        timestamp = self._get_camera_time_estimate()
+        if not self.ttl_in_filter.accept(timestamp):
+            return
+
+        self.timestamp_writer_ttl_in.push(timestamp, _get_realtime())
+        if self.clip_writer is not None:
+            self.clip_writer.trigger(trigger_pts=timestamp, source="ttl")
+
+    def trigger_clip(self, source="command"):
+        """Save a clip around the current time when recording in triggered mode."""
+        if self.clip_writer is None:
+            logging.debug("Ignoring clip trigger: not recording in triggered mode.")
+            return
+
+        self.clip_writer.trigger(trigger_pts=self.timestamp, source=source)
+
+    def _write_timestamps_frame_ttl_out(self, cam_ts):
+        offsets = self._get_clock_offsets()
+        if self.frame_clock_queries or offsets is None:
+            frame_ts = self.timestamp
+            sys_time = _get_realtime()
+        else:
+            # One monotonic clock read, camera & system time from the last clock sample
+            monotonic_us = _get_monotonic_us()
+            frame_ts = monotonic_us + offsets[0]
+            sys_time = monotonic_us * 1e-6 + offsets[1]
+
+        if self.timestamp_writer_ttl_out is not None:
+            self.timestamp_writer_ttl_out.push(cam_ts, frame_ts, sys_time)
+        if self.first_frame_time is None:
+            self.first_frame_time = sys_time
+            self._first_frame.set()
+
+    def wait_for_first_frame(self, timeout=None):
+        """System time of the first recorded frame, None if there is none within `timeout`."""
+        if self._first_frame is not None:
+            self._first_frame.wait(timeout)
+        return self.first_frame_time
+
+    def start_recording(self, output_files=None, make_segment_files=None, **kwargs):
+        """
+        :param output_files: Recording file dict, see `make_recording_file_names`
+        :param make_segment_files: Callable(segment_index=...) returning file dicts of segments.
+            Required for segmented recording.
+        """
         if isinstance(output_files["video"], DummyFileObject):
             logging.debug("Not allowed to write output files.")
             self.ttl_out_pin = None
             self.ttl_in_pin = None
 
+        self.first_frame_time = None
+        self._first_frame = Event()
+
         if self.ttl_out_pin is not None:
-            # Open TTL file and write header
-            self.file_timestamps_ttl_out = Path(output_files["ttl.out"]).open("w")
-            self.file_timestamps_ttl_out.write("timestamp_frame,timestamp_ttl,sys_time\n")
+            # Open TTL file(s), write header & start background writer
+            self.timestamp_writer_ttl_out = self._make_timestamp_writer(
+                output_files=output_files, file_key="ttl.out"
+            )
+
+            self.ttl_pulse_generator = TTLPulseGenerator(
+                pin=self.ttl_out_pin,
+                backend=RPiGPIOBackend(gpio_module=GPIO),
+                pulse_duration=self.ttl_out_duration,
+                pulses_per_trigger=self.ttl_out_pulses_per_trigger,
+                pulse_interval=self.ttl_out_pulse_interval,
+                every_nth=self.ttl_out_every_nth,
+            )
+            self.ttl_pulse_generator.start()
+
+        save_files = not isinstance(output_files["video"], DummyFileObject)
+        self.clock_sampler = ClockSampler(
+            camera=self,
+            path=output_files["clock"] if save_files else None,
+            interval=self.clock_sample_interval,
+        )
+        self.clock_sampler.start()
 
         if self.ttl_in_pin is not None:
             logging.debug(f"Setting TTL in pin to {self.ttl_in_pin}")
+            self.ttl_in_filter = TTLEdgeFilter(
+                debounce=self.ttl_in_debounce, every_nth=self.ttl_in_every_nth
+            )
+            # Open TTL file(s), write header & start background writer
+            self.timestamp_writer_ttl_in = self._make_timestamp_writer(
+                output_files=output_files, file_key="ttl.in"
+            )
             # Add event detection callback
             GPIO.setup(self.ttl_in_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
             GPIO.add_event_detect(self.ttl_in_pin, GPIO.RISING, self._write_timestamps_ttl_in)
-            # Open TTL file and write header
-            self.file_timestamps_ttl_in = Path(output_files["ttl.in"]).open("w")
-            self.file_timestamps_ttl_in.write("timestamp_frame,sys_time\n")
 
-        super().start_recording(output=str(output_files["video"]), **kwargs)
-        if self.stream_video:
+        self.frame_gap_monitor = FrameGapMonitor(framerate=float(self.framerate))
+
+        video_output = str(output_files["video"])
+        if self.recording_mode == "triggered" and not isinstance(
+            output_files["video"], DummyFileObject
+        ):
+            # Buffer must cover pre + post window of a clip, plus margin for key frame alignment
+            self.pre_trigger_buffer = PreTriggerBuffer(
+                seconds=2 * (self.pre_trigger_seconds + self.post_trigger_seconds) + 2
+            )
+            self.clip_writer = ClipWriter(
+                buffer=self.pre_trigger_buffer,
+                recording_files=output_files,
+                pre_seconds=self.pre_trigger_seconds,
+                post_seconds=self.post_trigger_seconds,
+            )
+            self.clip_writer.start()
+            video_output = self.pre_trigger_buffer
+
+        if self.h264_streaming and self.h264_stream_output is None:
+            self.h264_stream_output = H264StreamOutput()
+
+        self._recording_splitter_port = 1
+        super().start_recording(output=video_output, **kwargs)
+        if self.stream_video and not self.h264_streaming:
+            # Independent of the recording: resized by the splitter port & decimated by the encoder
             stream_kwargs = kwargs.copy()
             stream_kwargs["format"] = "mjpeg"
+            stream_kwargs["quality"] = self.stream_quality
+            if self._stream_resize():
+                stream_kwargs["resize"] = self._stream_resize()
+            self._recording_splitter_port = 2
             super().start_recording(output=self.streaming_output, splitter_port=2, **stream_kwargs)
+            self._recording_splitter_port = 1
+
+        if self.raw_frames:
+            self.raw_frame_output = RawFrameOutput(
+                resolution=self.raw_frames_resolution, format=self.raw_frames_format
+            )
+            self._recording_splitter_port = 3
+            super().start_recording(
+                output=self.raw_frame_output,
+                format="yuv",
+                resize=self.raw_frame_output.resolution,
+                splitter_port=3,
+            )
+            self._recording_splitter_port = 1
+
+        if (
+            self.segmented_recording
+            and make_segment_files is not None
+            and self.recording_mode == "continuous"
+            and not isinstance(output_files["video"], DummyFileObject)
+        ):
+            self.recording_segmenter = RecordingSegmenter(
+                camera=self,
+                recording_files=output_files,
+                make_segment_files=make_segment_files,
+                segment_duration=self.segment_duration,
+                segment_size_mb=self.segment_size_mb,
+            )
+            self.recording_segmenter.start()
 
     def stop_recording(self):
         if self.ttl_in_pin is not None:
             GPIO.remove_event_detect(self.ttl_in_pin)
 
+        if self.recording_segmenter is not None:
+            self.recording_segmenter.stop()
+
         try:
-            if self.stream_video:
+            if self.stream_video and not self.h264_streaming:
                 super().stop_recording(splitter_port=2)
+            if self.raw_frame_output is not None:
+                super().stop_recording(splitter_port=3)
+                self.raw_frame_output = None
 
             super().stop_recording()
         except BaseException:
             logging.error("CAMERA STOP EXCEPTION")
 
+        if self.clip_writer is not None:
+            self.clip_writer.close()
+            self.clip_writer = None
+            self.pre_trigger_buffer = None
+
+        if self.recording_segmenter is not None:
+            self.recording_segmenter.close()
+            self.recording_segmenter = None
+
+        if self.ttl_pulse_generator is not None:
+            self.ttl_pulse_generator.close()
+            self.ttl_pulse_generator = None
+
+        if self.clock_sampler is not None:
+            self.clock_sampler.close()
+            self.clock_models = self.clock_sampler.to_dict()
+            self.clock_sampler = None
+
         # Close TTL files
-        if self.file_timestamps_ttl_out is not None:
-            close_file_safe(file_handle=self.file_timestamps_ttl_out)
-        if self.file_timestamps_ttl_in is not None:
-            close_file_safe(file_handle=self.file_timestamps_ttl_in)
+        if self.timestamp_writer_ttl_out is not None:
+            self.timestamp_writer_ttl_out.close()
+            self.timestamp_writer_ttl_out = None
+        if self.timestamp_writer_ttl_in is not None:
+            self.timestamp_writer_ttl_in.close()
+            self.timestamp_writer_ttl_in = None
+            logging.info(f"TTL-in edges: {self.ttl_in_filter.stats()}")
 
     def preview_static(self, warmup_delay=3, alpha=255):
         if self.preview is not None:
@@ -230,6 +578,5 @@ class Camera(picamera.PiCamera):
         self.exposure_mode = "off"
 
         logging.debug(
-            f"Camera previewing & updated awb_gains={awb_gains}, "
-            f"shutter_speed={self.shutter_speed}"
+            f"Camera previewing & updated awb_gains={awb_gains}, shutter_speed={self.shutter_speed}"
         )
@@ -0,0 +1,101 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from pathlib import Path
+from threading import Event, Thread
+
+from rpi_camera_colony.clock import ClockDriftModel
+from rpi_camera_colony.files import close_file_safe
+
+
+class ClockSampler(Thread):
+    """Periodically sample the camera clock against CLOCK_REALTIME and CLOCK_MONOTONIC.
+
+    Each sample reads the camera clock between two reads of the system clocks and takes the
+    midpoint. Of `queries_per_sample` tries, the one with the shortest query window is kept.
+    Samples feed one ClockDriftModel per system clock and are written to `path` (CSV) if given.
+    The offsets of the latest sample are kept in `offsets`: (camera - monotonic clock in
+    microseconds, realtime - monotonic clock in seconds), as one tuple for other threads.
+    """
+
+    daemon = True
+
+    interval = 1.0
+    queries_per_sample = 3
+
+    def __init__(self, camera=None, path=None, interval=None):
+        super().__init__()
+
+        self.camera = camera
+        self.interval = interval or self.interval
+        self.models = {
+            "realtime": ClockDriftModel(clock="realtime"),
+            "monotonic": ClockDriftModel(clock="monotonic"),
+        }
+        self.offsets = None
+        self._stop_event = Event()
+
+        self._file = None
+        if path is not None:
+            self._file = Path(path).open("w")
+            self._file.write("camera_time,realtime,monotonic,query_duration\n")
+
+    def sample(self):
+        best = None
+        for _ in range(self.queries_per_sample):
+            realtime_start = time.clock_gettime(time.CLOCK_REALTIME)
+            monotonic_start = time.monotonic()
+            camera_time = self.camera.timestamp
+            monotonic_end = time.monotonic()
+            realtime_end = time.clock_gettime(time.CLOCK_REALTIME)
+
+            query_duration = monotonic_end - monotonic_start
+            if best is None or query_duration < best[3]:
+                best = (
+                    camera_time,
+                    (realtime_start + realtime_end) / 2,
+                    (monotonic_start + monotonic_end) / 2,
+                    query_duration,
+                )
+
+        camera_time, realtime, monotonic, query_duration = best
+        self.models["realtime"].add_sample(camera_time, realtime)
+        self.models["monotonic"].add_sample(camera_time, monotonic)
+        self.offsets = (camera_time - int(monotonic * 1e6), realtime - monotonic)
+
+        if self._file is not None:
+            self._file.write(f"{camera_time},{realtime!r},{monotonic!r},{query_duration!r}\n")
+            self._file.flush()
+        return best
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except BaseException as e:
+                logging.debug(f"Clock sample failed: {e}")
+            if self._stop_event.wait(self.interval):
+                break
+
+    def close(self):
+        """Stop sampling after a last sample at the end of the recording."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        try:
+            self.sample()
+        except BaseException as e:
+            logging.debug(f"Clock sample failed: {e}")
+        if self._file is not None:
+            close_file_safe(file_handle=self._file)
+
+        realtime_model = self.models["realtime"]
+        logging.debug(
+            f"Clock model from {realtime_model.n_samples} samples: "
+            f"drift={realtime_model.drift_ppm:.2f} ppm, residual_std={realtime_model.residual_std}"
+        )
+
+    def to_dict(self):
+        return {clock: model.to_dict() for clock, model in self.models.items()}
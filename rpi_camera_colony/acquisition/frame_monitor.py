@@ -0,0 +1,60 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import bisect
+
+
+class FrameGapMonitor:
+    """Online inter-frame interval check on encoder pts against the expected 1/framerate.
+
+    Gaps are counted in a histogram with bin edges in units of the expected interval.
+    A gap of n intervals counts n-1 dropped frames, a gap above `late_tolerance`
+    (but less than 1.5 intervals) counts as late frame.
+    """
+
+    gap_bin_edges = (0.5, 0.9, 1.1, 1.5, 2.5, 3.5, 5.5)
+    late_tolerance = 0.25
+
+    def __init__(self, framerate=30, late_tolerance=None):
+        self.framerate = float(framerate)
+        self.expected_interval = 1e6 / self.framerate  # pts are in microseconds
+        self.late_tolerance = late_tolerance or self.late_tolerance
+
+        self.frame_count = 0
+        self.dropped_frames = 0
+        self.late_frames = 0
+        self.max_gap = 0
+        self.last_pts = None
+        self.histogram = [0] * (len(self.gap_bin_edges) + 1)
+
+    def update(self, pts):
+        # Skip MMAL_TIME_UNKNOWN / missing pts
+        if pts is None or pts < 0:
+            return
+
+        if self.last_pts is not None:
+            gap = pts - self.last_pts
+            ratio = gap / self.expected_interval
+            self.histogram[bisect.bisect_left(self.gap_bin_edges, ratio)] += 1
+
+            if ratio >= 1.5:
+                self.dropped_frames += int(round(ratio)) - 1
+            elif ratio > 1 + self.late_tolerance:
+                self.late_frames += 1
+
+            if gap > self.max_gap:
+                self.max_gap = gap
+
+        self.last_pts = pts
+        self.frame_count += 1
+
+    def snapshot(self):
+        return {
+            "framerate": self.framerate,
+            "frame_count": self.frame_count,
+            "dropped_frames": self.dropped_frames,
+            "late_frames": self.late_frames,
+            "max_gap_us": self.max_gap,
+            "gap_bin_edges": list(self.gap_bin_edges),
+            "gap_histogram": list(self.histogram),
+        }
@@ -0,0 +1,183 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import asyncio
+import logging
+from threading import Event, Thread
+
+
+class H264StreamOutput:
+    """Collect the H.264 frames of the recording encoder for live streaming.
+
+    Frames are passed to the frame callbacks as `callback(frame, key_frame)` with Annex-B
+    byte stream data. The latest SPS/PPS (config buffer) is cached and put in front of each
+    key frame, so that clients can start decoding at any key frame.
+    """
+
+    def __init__(self):
+        self.config = None
+        self.frame_count = 0
+        self._frame_buffers = []
+        self._key_frame = False
+        self._config_buffers = []
+        self._frame_callbacks = []
+
+    def add_frame_callback(self, callback):
+        """Call `callback(frame, key_frame)` from the encoder thread for each complete frame."""
+        self._frame_callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        if callback in self._frame_callbacks:
+            self._frame_callbacks.remove(callback)
+
+    def write_buffer(self, data, config=False, key_frame=False, frame_end=False):
+        """Called by the encoder for each buffer, with the MMAL buffer flags."""
+        if config:
+            self._config_buffers.append(data)
+            return
+        if self._config_buffers:
+            # SPS/PPS complete at the first frame buffer after the config buffer(s)
+            self.config = b"".join(self._config_buffers)
+            self._config_buffers = []
+
+        self._frame_buffers.append(data)
+        self._key_frame = self._key_frame or key_frame
+        if not frame_end:
+            return
+
+        key_frame = self._key_frame
+        if key_frame and self.config is not None:
+            self._frame_buffers.insert(0, self.config)
+        frame = b"".join(self._frame_buffers)
+        self._frame_buffers = []
+        self._key_frame = False
+        self.frame_count += 1
+
+        for callback in self._frame_callbacks:
+            callback(frame, key_frame)
+
+
+class H264StreamClient:
+    """Connected client of the H.264 stream.
+
+    Starts at the next key frame. If the client does not keep up (more than
+    `max_buffer_size` bytes not sent), frames are dropped until the next key frame,
+    as H.264 frames between key frames can not be dropped individually.
+    """
+
+    max_buffer_size = 2**21
+
+    def __init__(self, writer=None, max_buffer_size=None):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.max_buffer_size = max_buffer_size or self.max_buffer_size
+        self.waiting_for_key_frame = True
+        self.frames_delivered = 0
+        self.frames_skipped = 0
+
+    def offer(self, frame, key_frame):
+        if key_frame:
+            self.waiting_for_key_frame = False
+        elif self.writer.transport.get_write_buffer_size() > self.max_buffer_size:
+            self.waiting_for_key_frame = True
+
+        if self.waiting_for_key_frame:
+            self.frames_skipped += 1
+            return
+
+        self.writer.write(frame)
+        self.frames_delivered += 1
+
+    def stats(self):
+        return {
+            "address": "{}:{}".format(*self.address[:2]) if self.address else None,
+            "delivered": self.frames_delivered,
+            "skipped": self.frames_skipped,
+        }
+
+
+class H264StreamServer(Thread):
+    """Raw H.264 (Annex-B) over TCP from the recording encoder, on an asyncio event loop.
+
+    Every connected client receives the byte stream from the next key frame on,
+    e.g. `ffplay -f h264 tcp://[address]:[port]`.
+    """
+
+    daemon = True
+
+    def __init__(self, output=None, address="", port=8001):
+        super().__init__()
+
+        self.output = output
+        self.address = address
+        self.port = port
+        self.clients = set()
+        self.loop = None
+        self._server = None
+        self._ready = Event()
+
+    def start(self):
+        super().start()
+        self._ready.wait(timeout=5)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(
+                self._handle_client, self.address or None, self.port, reuse_address=True
+            )
+        )
+        self.port = self._server.sockets[0].getsockname()[1]  # port 0: any free port
+        self.output.add_frame_callback(self._frame_callback)
+        self._ready.set()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self.output.remove_frame_callback(self._frame_callback)
+            for client in list(self.clients):
+                client.writer.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._server.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+    def _frame_callback(self, frame, key_frame):
+        # Encoder thread: only schedule sending on the event loop
+        if self.clients:
+            self.loop.call_soon_threadsafe(self._broadcast_frame, frame, key_frame)
+
+    def _broadcast_frame(self, frame, key_frame):
+        for client in list(self.clients):
+            client.offer(frame, key_frame)
+
+    def stats(self):
+        return {
+            "frame_count": self.output.frame_count,
+            "clients": [client.stats() for client in self.clients],
+        }
+
+    async def _handle_client(self, reader, writer):
+        client = H264StreamClient(writer=writer)
+        self.clients.add(client)
+        logging.debug(f"New H.264 streaming client {client.address}")
+
+        try:
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # disconnected or server shutdown
+        finally:
+            self.clients.discard(client)
+            writer.close()
+            logging.debug(f"Removed H.264 streaming client {client.address}: {client.stats()}")
+
+    def shutdown(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.is_alive():
+            self.join()
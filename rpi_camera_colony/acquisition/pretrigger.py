@@ -0,0 +1,198 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+from rpi_camera_colony.files import close_file_safe, make_clip_file_names
+
+
+class PreTriggerBuffer:
+    """In-memory circular buffer of encoded H.264 frames, used as encoder output.
+
+    The encoder writes buffer data with `write` and marks frame boundaries with `end_frame`.
+    SPS/PPS config data is prepended to the following key frame, so that every
+    key frame in the buffer is a valid start point for a clip.
+    """
+
+    seconds = 10.0
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds or self.seconds
+        self._frames = deque()  # (pts, key_frame, data)
+        self._chunks = []
+        self._config = b""
+        self._lock = Lock()
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def end_frame(self, pts=None, key_frame=False, config=False):
+        data = b"".join(self._chunks)
+        self._chunks = []
+
+        if config:
+            self._config += data
+            return
+
+        if self._config:
+            data = self._config + data
+            key_frame = True
+            self._config = b""
+
+        max_age = self.seconds * 1e6
+        with self._lock:
+            self._frames.append((pts, key_frame, data))
+            while self._frames and pts - self._frames[0][0] > max_age:
+                self._frames.popleft()
+
+    def get_frames(self, start_pts=None, end_pts=None):
+        """Frames up to `end_pts`, starting at the last key frame at or before `start_pts`."""
+        with self._lock:
+            frames = [f for f in self._frames if f[0] <= end_pts]
+
+        key_frame_indices = [i for i, f in enumerate(frames) if f[1]]
+        if not key_frame_indices:
+            return []
+
+        start_index = key_frame_indices[0]
+        for i in key_frame_indices:
+            if frames[i][0] <= start_pts:
+                start_index = i
+
+        if frames[start_index][0] > start_pts:
+            logging.warning(
+                f"Pre-trigger buffer does not reach back to {start_pts} "
+                f"(first key frame at {frames[start_index][0]}). Clip is shorter."
+            )
+        return frames[start_index:]
+
+
+class ClipWriter(Thread):
+    """Write clips from a PreTriggerBuffer around trigger times.
+
+    A trigger at camera time t produces a clip with frames from t - pre_seconds to
+    t + post_seconds, written once the post-trigger window has passed. Triggers that arrive
+    before the pending clip is written extend that clip instead of starting a new one.
+    Clip frame timestamps are camera pts, i.e. the `timestamp_frame` column of the ttl.out file.
+    """
+
+    daemon = True
+
+    pre_seconds = 5.0
+    post_seconds = 5.0
+
+    def __init__(self, buffer=None, recording_files=None, pre_seconds=None, post_seconds=None):
+        super().__init__()
+
+        self.buffer = buffer
+        self.recording_files = recording_files
+        self.pre_seconds = pre_seconds if pre_seconds is not None else self.pre_seconds
+        self.post_seconds = post_seconds if post_seconds is not None else self.post_seconds
+
+        self.clip_count = 0
+        self.trigger_count = 0
+        self._pending = None  # [start_pts, end_pts, due_time, trigger_pts, source]
+        self._ready = deque()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop_event = Event()
+
+        # Written for each clip until close
+        self._clip_index_file = Path(self.recording_files["clips"]).open("w")
+        self._clip_index_file.write(
+            "clip_index,trigger_source,trigger_timestamp,"
+            "first_frame_timestamp,last_frame_timestamp,n_frames\n"
+        )
+
+    def trigger(self, trigger_pts=None, source="ttl"):
+        """Request a clip around camera time `trigger_pts` (microseconds)."""
+        self.trigger_count += 1
+        due_time = time.monotonic() + self.post_seconds
+        end_pts = trigger_pts + self.post_seconds * 1e6
+
+        with self._lock:
+            if self._pending is not None and trigger_pts <= self._pending[1]:
+                self._pending[1] = end_pts
+                self._pending[2] = due_time
+            else:
+                if self._pending is not None:
+                    self._ready.append(self._pending)
+                self._pending = [
+                    trigger_pts - self.pre_seconds * 1e6,
+                    end_pts,
+                    due_time,
+                    trigger_pts,
+                    source,
+                ]
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                delay = 1.0
+                if self._pending is not None:
+                    delay = self._pending[2] - time.monotonic()
+                    if delay <= 0:
+                        self._ready.append(self._pending)
+                        self._pending = None
+
+            self._write_ready_clips()
+            if delay > 0:
+                self._wakeup.wait(timeout=delay)
+                self._wakeup.clear()
+
+    def _write_ready_clips(self):
+        while self._ready:
+            self._write_clip(*self._ready.popleft())
+
+    def _write_clip(self, start_pts, end_pts, due_time, trigger_pts, source):
+        frames = self.buffer.get_frames(start_pts=start_pts, end_pts=end_pts)
+        if not frames:
+            logging.warning(f"No frames buffered for clip triggered at {trigger_pts}.")
+            return
+
+        clip_files = make_clip_file_names(
+            recording_files=self.recording_files, clip_index=self.clip_count
+        )
+        with Path(clip_files["video"]).open("wb") as f:
+            for _, _, data in frames:
+                f.write(data)
+
+        with Path(clip_files["timestamps"]).open("w") as f:
+            f.write("timestamp_frame\n")
+            f.write("".join([f"{pts}\n" for pts, _, _ in frames]))
+
+        self._clip_index_file.write(
+            f"{self.clip_count},{source},{trigger_pts},{frames[0][0]},{frames[-1][0]},"
+            f"{len(frames)}\n"
+        )
+        self._clip_index_file.flush()
+        logging.info(
+            f"Wrote clip {self.clip_count} ({len(frames)} frames, trigger: {source}) "
+            f"to {Path(clip_files['video']).name}"
+        )
+        self.clip_count += 1
+
+    def close(self):
+        """Write pending clip with the frames buffered so far."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+
+        with self._lock:
+            if self._pending is not None:
+                self._ready.append(self._pending)
+                self._pending = None
+        self._write_ready_clips()
+
+        close_file_safe(file_handle=self._clip_index_file)
+        logging.debug(f"Clip writer closed: triggers={self.trigger_count}, clips={self.clip_count}")
@@ -0,0 +1,110 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import time
+
+import numpy as np
+
+
+class RawFrameOutput:
+    """Encoder output for raw YUV420 frames of a splitter port, as NumPy arrays.
+
+    Each complete frame is passed to the frame callbacks as `callback(array, metadata)`:
+    - format "grey": Y plane cropped to `resolution`, shape (height, width)
+    - format "yuv": full YUV420 frame with padded rows, shape (padded height * 3 / 2, padded width)
+    Arrays are new for each frame, so that callbacks can keep or send them without copying.
+    The metadata holds the frame index and camera timestamp set by the encoder
+    (see `set_frame_info`) and the system time at the end of the frame.
+
+    Frames are cut every `frame_size` bytes, bytes past the end of a frame are carried into the
+    next one. At the end of a frame signalled by the encoder (`end_frame`), an incomplete
+    frame is discarded, so that the next frame starts aligned.
+    """
+
+    resolution = (160, 128)
+    format = "grey"
+
+    def __init__(self, resolution=None, format=None):
+        width, height = resolution or self.resolution
+        self.resolution = (int(width), int(height))
+        self.format = format or self.format
+
+        # Raw frames are padded to multiples of 32 columns and 16 rows
+        self.padded_width = (self.resolution[0] + 31) // 32 * 32
+        self.padded_height = (self.resolution[1] + 15) // 16 * 16
+        self.frame_size = self.padded_width * self.padded_height * 3 // 2
+
+        self.frame_count = 0
+        self.incomplete_frames = 0
+        self._frame = None
+        self._write_position = 0
+        self._frame_index = None
+        self._frame_pts = None
+        self._next_frame_info = (None, None)
+        self._frame_callbacks = []
+
+    def add_frame_callback(self, callback):
+        """Call `callback(array, metadata)` from the encoder thread for each complete frame."""
+        self._frame_callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        if callback in self._frame_callbacks:
+            self._frame_callbacks.remove(callback)
+
+    def set_frame_info(self, frame_index=None, pts=None):
+        """Frame index and camera timestamp of the buffer that is written next.
+
+        Used for the frame that starts in that buffer.
+        """
+        self._next_frame_info = (frame_index, pts)
+
+    def write(self, buf):
+        data = np.frombuffer(buf, dtype=np.uint8)
+        position = 0
+        while position < len(data):
+            if self._write_position == 0:
+                self._frame = np.empty(self.frame_size, dtype=np.uint8)
+                self._frame_index, self._frame_pts = self._next_frame_info
+
+            n = min(len(data) - position, self.frame_size - self._write_position)
+            self._frame[self._write_position : self._write_position + n] = data[
+                position : position + n
+            ]
+            self._write_position += n
+            position += n
+
+            if self._write_position == self.frame_size:
+                self._write_position = 0
+                self._publish_frame(self._frame)
+        return len(data)
+
+    def end_frame(self):
+        """End of a frame from the encoder: discard an incomplete frame to realign."""
+        if self._write_position:
+            self.incomplete_frames += 1
+            self._write_position = 0
+
+    def _publish_frame(self, frame):
+        if self.format == "grey":
+            width, height = self.resolution
+            luma = frame[: self.padded_width * self.padded_height]
+            array = luma.reshape(self.padded_height, self.padded_width)[:height, :width]
+            array = np.ascontiguousarray(array)
+        else:
+            array = frame.reshape(self.padded_height * 3 // 2, self.padded_width)
+
+        metadata = {
+            "frame_index": self._frame_index,
+            "frame_count": self.frame_count,
+            "timestamp_camera": self._frame_pts,
+            "sys_time": time.clock_gettime(time.CLOCK_REALTIME),
+            "format": self.format,
+            "resolution": self.resolution,
+        }
+        self.frame_count += 1
+
+        for callback in self._frame_callbacks:
+            callback(array, metadata)
+
+    def flush(self):
+        pass
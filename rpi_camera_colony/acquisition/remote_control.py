@@ -8,6 +8,7 @@ import time
 
 import rpi_camera_colony
 from rpi_camera_colony.config.config import load_config
+from rpi_camera_colony.serialization import negotiate_codec
 
 
 def validate_ssh_cli_kwargs(command_dict: dict = None):
@@ -52,7 +53,7 @@ class RemoteAcquisitionControl:
     """
 
     instance_name = None
-    control_socket_wrapper = None
+    command_router = None
     auto_init = None
 
     _connected = False
@@ -60,12 +61,13 @@ class RemoteAcquisitionControl:
 
     remote_python_interpreter = None
     remote_python_entrypoint = None
+    pkill_timeout = 10.0
 
     def __init__(
         self,
         instance_name=None,
         config_data=None,
-        control_socket_wrapper=None,
+        command_router=None,
         auto_init=False,
         **kwargs,
     ):
@@ -76,7 +78,7 @@ class RemoteAcquisitionControl:
 
         self.instance_name = instance_name
         self.config_data = config_data or load_config(config_path=kwargs.get("config_file"))
-        self.control_socket_wrapper = control_socket_wrapper
+        self.command_router = command_router
 
         self.remote_python_interpreter = self.config_data["general"].get(
             "remote_python_interpreter"
@@ -114,21 +116,35 @@ class RemoteAcquisitionControl:
         self._settings = value if hasattr(value, "keys") else None
         self.transmit_settings()
 
-    def send_command(self, cmd_type="config", message_dict=None):
+    def send_command(self, cmd_type="config", message_dict=None, wait=True, retries=None):
+        """Returns the ack (or None) if `wait`, else the pending command of the router."""
+        if self.command_router is None:
+            logging.warning(f"No command router. Not sent to {self.instance_name}: {cmd_type}")
+            return None
+
         message = {"type": cmd_type}
         message.update(message_dict)
-        self.control_socket_wrapper.send_multipart_json(
-            recipient=self.instance_name, message=message
+        return self.command_router.send(
+            instance_name=self.instance_name, message=message, wait=wait, retries=retries
+        )
+
+    def send_status(self, status="preview", wait=True, retries=None, **kwargs):
+        """kwargs are added to the message, e.g. `start_at` for status start."""
+        return self.send_command(
+            cmd_type="command",
+            message_dict=dict(kwargs, status=status),
+            wait=wait,
+            retries=retries,
         )
 
-    def transmit_settings(self):
+    def transmit_settings(self, wait=False):
         if not self._settings:
             # logging.warning("Tried to transmit config_data, but cannot find any.")
-            return
+            return None
 
         if not self._connected:
             # logging.debug("Remote is closed.")
-            return
+            return None
 
         settings_for_this_instance = self.config_data["controllers"].get(self.instance_name)
 
@@ -142,10 +158,18 @@ class RemoteAcquisitionControl:
                 overwrite_value = self.config_data["general"].get(key)
                 settings_for_this_instance.update({key: overwrite_value})
 
+        # Configured codec if both sides support it (remote codecs from its hello), else JSON
+        peer_codecs = getattr(self.command_router, "peer_codecs", {})
+        settings_for_this_instance["message_codec"] = negotiate_codec(
+            remote_codecs=[peer_codecs.get(self.instance_name)],
+            preferred=[settings_for_this_instance.get("message_codec", "json")],
+        )
+
         # Send
-        self.send_command(
+        return self.send_command(
             cmd_type="config",
             message_dict=settings_for_this_instance,
+            wait=wait,
         )
 
     def _make_pi_command_base_list(self):
@@ -162,8 +186,7 @@ class RemoteAcquisitionControl:
             logging.debug("Already initialised the remote acquisition.")
             return
 
-        self.pkill_remote()
-        time.sleep(1)
+        self.pkill_remote(wait=True)
 
         instance_settings = self.config_data["controllers"].get(self.instance_name)
 
@@ -204,23 +227,30 @@ class RemoteAcquisitionControl:
 
         self.connected = True
 
-    def pkill_remote(self):
+    def pkill_remote(self, wait=False):
+        """Stop a previous remote instance. If `wait`, until done (at most `pkill_timeout`)."""
         cmd = self._make_pi_command_base_list() + ["pkill", "python"]
-        execute_in_commandline(cmd=cmd, return_std=False)
-        time.sleep(0.1)
+        process = execute_in_commandline(cmd=cmd, return_std=False)
+        if wait:
+            try:
+                process.wait(timeout=self.pkill_timeout)
+            except subprocess.TimeoutExpired:
+                logging.warning(f"Stopping previous instance on {self.remote_address} timed out.")
 
     def start_acquisition(self):
-        self.send_command(cmd_type="command", message_dict={"status": "reset"})
-        self.send_command(cmd_type="command", message_dict={"status": "start"})
+        self.send_status("reset")
+        return self.send_status("start")
+
+    def trigger_clip(self):
+        return self.send_status("trigger")
 
     def stop_acquisition(self):
-        self.send_command(cmd_type="command", message_dict={"status": "stop"})
-        time.sleep(0.5)
+        return self.send_status("stop")
 
     def cleanup(self):
         try:
-            self.send_command(cmd_type="command", message_dict={"status": "close"})
-            time.sleep(0.5)
+            if self.command_router is not None and self.command_router.is_alive():
+                self.send_status("close", retries=0)
             self.connected = False
         except BaseException:
             print("FAILED TO CLEAN UP REMOTE CONTROLLER")
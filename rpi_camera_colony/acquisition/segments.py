@@ -0,0 +1,111 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from pathlib import Path
+from threading import Event, Thread
+
+from rpi_camera_colony.files import close_file_safe
+
+
+class RecordingSegmenter(Thread):
+    """Split the main recording into segment files at key frames.
+
+    A new segment is started with `camera.split_recording` once the current segment is older
+    than `segment_duration` seconds or larger than `segment_size_mb` megabytes (0 disables a limit).
+    Timestamp files roll over at the same frame, see `Camera._start_timestamp_segment`.
+    Finished segments are listed in the segments index file, so that they can be transferred
+    while the recording continues.
+    """
+
+    daemon = True
+
+    segment_duration = 0
+    segment_size_mb = 0
+    check_interval = 0.5
+
+    def __init__(
+        self,
+        camera=None,
+        recording_files=None,
+        make_segment_files=None,
+        segment_duration=None,
+        segment_size_mb=None,
+    ):
+        """
+        :param camera: Recording Camera object
+        :param recording_files: File dict of the first segment (segment index 0)
+        :param make_segment_files: Callable(segment_index=...) returning the file dict of a segment
+        """
+        super().__init__()
+
+        self.camera = camera
+        self.make_segment_files = make_segment_files
+        self.segment_duration = segment_duration or self.segment_duration
+        self.segment_size_mb = segment_size_mb or self.segment_size_mb
+
+        self.segment_index = 0
+        self.segment_files = recording_files
+        self._segment_start = time.monotonic()
+        self._segment_start_time = time.time()
+        self._stop_event = Event()
+
+        # Written for each segment until close
+        self._index_file = Path(recording_files["segments"]).open("w")
+        self._index_file.write("segment_index,video_file,start_time,end_time\n")
+
+    def _segment_due(self):
+        if self.segment_duration and (
+            time.monotonic() - self._segment_start >= self.segment_duration
+        ):
+            return True
+
+        if self.segment_size_mb:
+            try:
+                size = Path(self.segment_files["video"]).stat().st_size
+            except OSError:
+                return False
+            return size >= self.segment_size_mb * 1e6
+
+        return False
+
+    def run(self):
+        while not self._stop_event.wait(self.check_interval):
+            if self._segment_due():
+                try:
+                    self.split()
+                except BaseException as e:
+                    logging.error(f"Failed to split recording: {e}")
+
+    def split(self):
+        next_files = self.make_segment_files(segment_index=self.segment_index + 1)
+
+        self.camera._pending_segment_files = next_files
+        self.camera.split_recording(str(next_files["video"]), splitter_port=1)
+
+        self._write_index_row()
+        self.segment_index += 1
+        self.segment_files = next_files
+        self._segment_start = time.monotonic()
+        self._segment_start_time = time.time()
+        logging.debug(f"Started recording segment {self.segment_index}: {next_files['video']}")
+
+    def _write_index_row(self):
+        self._index_file.write(
+            f"{self.segment_index},{Path(self.segment_files['video']).name},"
+            f"{self._segment_start_time},{time.time()}\n"
+        )
+        self._index_file.flush()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def close(self):
+        """Add last segment to index. Call after the recording is stopped."""
+        self.stop()
+        self._write_index_row()
+        close_file_safe(file_handle=self._index_file)
+        logging.debug(f"Recording segmenter closed after {self.segment_index + 1} segments.")
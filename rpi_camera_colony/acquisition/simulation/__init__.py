@@ -0,0 +1,23 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+"""
+Simulated stand-ins for picamera and RPi.GPIO.
+
+Enable with the environment variable `RCC_SIMULATE_HARDWARE=1` (or `rcc-acquisition --simulate`)
+to run the acquisition stack (Camera, VideoEncoder, StreamingOutput, PiAcquisitionControl)
+on machines without camera hardware, e.g. for profiling and benchmarks.
+"""
+
+import os
+
+SIMULATION_ENV_VARIABLE = "RCC_SIMULATE_HARDWARE"
+
+
+def simulation_enabled():
+    return os.environ.get(SIMULATION_ENV_VARIABLE, "").lower() in ["1", "true", "yes"]
+
+
+def enable_simulation():
+    """Must be called before importing rpi_camera_colony.acquisition.camera"""
+    os.environ[SIMULATION_ENV_VARIABLE] = "1"
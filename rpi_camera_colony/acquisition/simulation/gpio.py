@@ -0,0 +1,155 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+"""Module-level stand-in for RPi.GPIO. Edges on input pins are injected with `simulate_edge`
+or periodically with an `EdgeSource` thread."""
+
+import logging
+import time
+from threading import Event, Lock, Thread
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+_mode = None
+_lock = Lock()
+_pin_values = {}
+_pin_directions = {}
+_edge_counts = {}
+_event_detects = {}  # pin -> [edge, bouncetime, last_edge_time, [callbacks]]
+
+
+def setwarnings(flag):
+    pass
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def getmode():
+    return _mode
+
+
+def cleanup(channel=None):
+    with _lock:
+        channels = [channel] if channel is not None else list(_pin_directions)
+        for pin in channels:
+            _pin_values.pop(pin, None)
+            _pin_directions.pop(pin, None)
+            _event_detects.pop(pin, None)
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    with _lock:
+        _pin_directions[channel] = direction
+        if initial is not None:
+            _pin_values[channel] = int(bool(initial))
+        else:
+            _pin_values[channel] = HIGH if pull_up_down == PUD_UP else LOW
+
+
+def output(channel, value):
+    value = int(bool(value))
+    if _pin_values.get(channel) != value:
+        _edge_counts[channel] = _edge_counts.get(channel, 0) + 1
+    _pin_values[channel] = value
+
+
+def input(channel):
+    return _pin_values.get(channel, LOW)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    with _lock:
+        if channel in _event_detects:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        _event_detects[channel] = [edge, bouncetime, None, [callback] if callback else []]
+
+
+def add_event_callback(channel, callback):
+    with _lock:
+        _event_detects[channel][3].append(callback)
+
+
+def remove_event_detect(channel):
+    with _lock:
+        _event_detects.pop(channel, None)
+
+
+def edge_count(channel):
+    """Number of level changes on a pin (simulation only)."""
+    return _edge_counts.get(channel, 0)
+
+
+def simulate_edge(channel, value):
+    """Set input level and run event callbacks on the calling thread (like the RPi.GPIO
+    event thread would)."""
+    value = int(bool(value))
+    previous = _pin_values.get(channel, LOW)
+    _pin_values[channel] = value
+    if previous == value:
+        return
+    _edge_counts[channel] = _edge_counts.get(channel, 0) + 1
+
+    detect = _event_detects.get(channel)
+    if detect is None:
+        return
+
+    edge, bouncetime, last_edge_time, callbacks = detect
+    if edge == RISING and not value or edge == FALLING and value:
+        return
+
+    now = time.monotonic()
+    if bouncetime and last_edge_time is not None and (now - last_edge_time) * 1000 < bouncetime:
+        return
+    detect[2] = now
+
+    for callback in list(callbacks):
+        try:
+            callback(channel)
+        except BaseException as e:
+            logging.error(f"Simulated GPIO callback failed on channel {channel}: {e}")
+
+
+class EdgeSource(Thread):
+    """Emit square pulses on an input pin at a fixed rate."""
+
+    daemon = True
+
+    def __init__(self, channel=None, rate=1.0, pulse_duration=0.001):
+        super().__init__()
+        self.channel = channel
+        self.rate = rate
+        self.pulse_duration = pulse_duration
+        self.pulse_count = 0
+        self._stop_event = Event()
+
+    def run(self):
+        interval = 1.0 / self.rate
+        next_pulse = time.perf_counter()
+        while not self._stop_event.is_set():
+            simulate_edge(self.channel, HIGH)
+            self.pulse_count += 1
+            if self.pulse_duration:
+                time.sleep(self.pulse_duration)
+            simulate_edge(self.channel, LOW)
+
+            next_pulse += interval
+            self._stop_event.wait(max(0.0, next_pulse - time.perf_counter()))
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,18 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+"""Subset of picamera.mmal constants used by the acquisition code (values as in MMAL)."""
+
+MMAL_TIME_UNKNOWN = -(2**63)
+
+MMAL_BUFFER_HEADER_FLAG_EOS = 1 << 0
+MMAL_BUFFER_HEADER_FLAG_FRAME_START = 1 << 1
+MMAL_BUFFER_HEADER_FLAG_FRAME_END = 1 << 2
+MMAL_BUFFER_HEADER_FLAG_FRAME = (
+    MMAL_BUFFER_HEADER_FLAG_FRAME_START | MMAL_BUFFER_HEADER_FLAG_FRAME_END
+)
+MMAL_BUFFER_HEADER_FLAG_KEYFRAME = 1 << 3
+MMAL_BUFFER_HEADER_FLAG_DISCONTINUITY = 1 << 4
+MMAL_BUFFER_HEADER_FLAG_CONFIG = 1 << 5
+MMAL_BUFFER_HEADER_FLAG_ENCRYPTED = 1 << 6
+MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO = 1 << 7
@@ -0,0 +1,370 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+"""Stand-in for the parts of picamera used by the acquisition code.
+
+Encoders emit synthetic buffers (H.264 with SPS/PPS config buffers and key frames, MJPEG, YUV)
+at the camera framerate with pts from the simulated camera clock,
+and pass them through `_callback_write` like the MMAL callback thread would.
+"""
+
+import logging
+import random
+import time
+from pathlib import Path
+from threading import Event, Thread
+
+from rpi_camera_colony.acquisition.simulation import mmal
+
+_PAYLOAD = bytes(random.Random(0).getrandbits(8) for _ in range(1 << 16)) * 16
+_H264_SPS_PPS = (
+    b"\x00\x00\x00\x01\x27\x64\x00\x28\xac\x2b\x40\x28\x02\xdd\x00\xf1\x22\x6a"  # SPS
+    b"\x00\x00\x00\x01\x28\xee\x02\x5c\xb0"  # PPS
+)
+
+
+class PiCameraError(Exception):
+    pass
+
+
+class PiCameraAlreadyRecording(PiCameraError):
+    pass
+
+
+class PiCameraNotRecording(PiCameraError):
+    pass
+
+
+class SimulatedBuffer:
+    """Mimics picamera.mmalobj.MMALBuffer attributes."""
+
+    __slots__ = ["data", "flags", "pts", "dts"]
+
+    def __init__(self, data=b"", flags=0, pts=mmal.MMAL_TIME_UNKNOWN):
+        self.data = data
+        self.flags = flags
+        self.pts = pts
+        self.dts = pts
+
+    @property
+    def length(self):
+        return len(self.data)
+
+
+class PiVideoEncoder:
+    """Generates buffers on a thread at `parent.framerate`."""
+
+    buffer_size = 65536  # max bytes per buffer, larger frames are split
+    intra_period = 60
+    bitrate = 17000000
+
+    def __init__(self, parent, camera_port, input_port, format, resize, **options):
+        self.parent = parent
+        self.camera_port = camera_port
+        self.input_port = input_port
+        self.format = format
+        self.resize = resize
+        self.options = options
+        self.intra_period = options.get("intra_period") or self.intra_period
+        self.inline_headers = options.get("inline_headers", True)
+        self.bitrate = options.get("bitrate") or self.bitrate
+
+        self.output = None
+        self._own_output = False
+        self._next_output = None
+        self._split_done = Event()
+        self._key_frame_requested = False
+        self.frame_index = 0
+        self.dropped_frames = 0
+        self._raw_frame = b""
+        self.event = Event()
+        self._stop_event = Event()
+        self._thread = None
+
+    @property
+    def resolution(self):
+        return tuple(self.resize or self.parent.resolution)
+
+    @property
+    def active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, output, motion_output=None):
+        self._open_output(output)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def split(self, output, motion_output=None):
+        """Switch output at the next key frame. Blocks until the switch, like picamera."""
+        self._split_done.clear()
+        self._next_output = output
+        self.request_key_frame()
+        timeout = 2 * self.intra_period / float(self.parent.framerate)
+        if self.active and not self._split_done.wait(timeout):
+            raise PiCameraError("Timed out waiting for a split point")
+
+    def request_key_frame(self):
+        self._key_frame_requested = True
+
+    def wait(self, timeout=None):
+        return self._stop_event.wait(timeout)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        self._close_output()
+
+    def _open_output(self, output):
+        if isinstance(output, (str, Path)):
+            self.output = Path(output).open("wb")
+            self._own_output = True
+        else:
+            self.output = output
+            self._own_output = False
+
+    def _close_output(self):
+        if self.output is not None and self._own_output:
+            self.output.close()
+        self.output = None
+
+    def _callback_write(self, buf, key=None):
+        if self._next_output is not None and buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG:
+            self._close_output()
+            self._open_output(self._next_output)
+            self._next_output = None
+            self._split_done.set()
+
+        if buf.length and self.output is not None:
+            self.output.write(buf.data)
+        return bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_EOS)
+
+    def _frame_size(self, key_frame):
+        width, height = self.resolution
+        if self.format in ["yuv", "rgb", "bgr"]:
+            padded_size = ((width + 31) // 32 * 32) * ((height + 15) // 16 * 16)
+            return padded_size * 3 // 2 if self.format == "yuv" else padded_size * 3
+
+        size = int(self.bitrate / 8 / max(1, self.parent.framerate))
+        if self.format == "mjpeg":
+            size = int(width * height * 0.25)
+        return min(size * (4 if key_frame else 1), len(_PAYLOAD) - 4)
+
+    def _make_frame_buffers(self, pts, key_frame):
+        size = self._frame_size(key_frame)
+        if self.format == "h264":
+            nal_header = b"\x00\x00\x00\x01" + (b"\x25" if key_frame else b"\x21")
+            data = nal_header + _PAYLOAD[: size - len(nal_header)]
+        elif self.format == "mjpeg":
+            data = b"\xff\xd8" + _PAYLOAD[: size - 4] + b"\xff\xd9"
+        else:
+            if len(self._raw_frame) != size:
+                self._raw_frame = bytes(size)
+            data = self._raw_frame
+
+        buffers = []
+        n_chunks = 1 if self.format not in ["h264", "mjpeg"] else -(-len(data) // self.buffer_size)
+        chunk_size = -(-len(data) // n_chunks)
+        for i in range(n_chunks):
+            flags = 0
+            if i == 0:
+                flags |= mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_START
+            if i == n_chunks - 1:
+                flags |= mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END
+            if key_frame and self.format == "h264":
+                flags |= mmal.MMAL_BUFFER_HEADER_FLAG_KEYFRAME
+            buffers.append(
+                SimulatedBuffer(
+                    data=data[i * chunk_size : (i + 1) * chunk_size], flags=flags, pts=pts
+                )
+            )
+        return buffers
+
+    def _run(self):
+        frame_interval = 1.0 / float(self.parent.framerate)
+        next_frame_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            next_frame_time += frame_interval
+            delay = next_frame_time - time.perf_counter()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+
+            pts = self.parent.timestamp
+            if random.random() < self.parent.simulated_frame_drop_rate:
+                self.dropped_frames += 1
+                continue
+
+            key_frame = self.format == "h264" and (
+                self.frame_index % self.intra_period == 0 or self._key_frame_requested
+            )
+            buffers = []
+            if key_frame:
+                self._key_frame_requested = False
+                if self.inline_headers or self.frame_index == 0:
+                    buffers.append(
+                        SimulatedBuffer(
+                            data=_H264_SPS_PPS, flags=mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG
+                        )
+                    )
+            buffers += self._make_frame_buffers(pts=pts, key_frame=key_frame)
+
+            for buf in buffers:
+                try:
+                    self._callback_write(buf)
+                except BaseException as e:
+                    logging.error(f"Simulated encoder callback failed: {e}")
+            self.frame_index += 1
+            self.event.set()
+
+
+class PiRawVideoEncoder(PiVideoEncoder):
+    """Raw formats (yuv, rgb, bgr) are generated by PiVideoEncoder."""
+
+
+class PiRenderer:
+    def __init__(self, parent, **options):
+        self.parent = parent
+        self.alpha = options.get("alpha", 255)
+        self.fullscreen = options.get("fullscreen", True)
+
+    def close(self):
+        pass
+
+
+class PiCamera:
+    """Camera clock runs from instantiation (clock_mode "raw")
+    or from the start of the latest recording (clock_mode "reset")."""
+
+    simulated_frame_drop_rate = 0.0
+
+    # Attributes that are set from configuration files
+    vflip = False
+    hflip = False
+    rotation = 0
+    brightness = 50
+    color_effects = None
+    contrast = 0
+    image_denoise = True
+    iso = 0
+    led = False
+    saturation = 0
+    sharpness = 0
+    still_stats = False
+    video_denoise = True
+    video_stabilization = False
+    zoom = (0.0, 0.0, 1.0, 1.0)
+    exposure_compensation = 0
+    meter_mode = "average"
+    drc_strength = "off"
+    annotate_text = ""
+
+    awb_mode = "auto"
+    awb_gains = (1.5, 1.2)
+    exposure_mode = "auto"
+    exposure_speed = 10000
+    shutter_speed = 0
+    analog_gain = 1.0
+    digital_gain = 1.0
+
+    def __init__(
+        self,
+        camera_num=0,
+        stereo_mode="none",
+        stereo_decimate=False,
+        resolution=None,
+        framerate=None,
+        sensor_mode=0,
+        led_pin=None,
+        clock_mode="reset",
+        framerate_range=None,
+    ):
+        self.camera_num = camera_num
+        self.sensor_mode = sensor_mode
+        self.resolution = tuple(resolution or (1280, 720))
+        self.framerate = framerate or 30
+        self.clock_mode = clock_mode
+        self.preview = None
+        self.closed = False
+        self._encoders = {}
+        self._clock_start = time.monotonic()
+        logging.debug(
+            f"Simulated camera: resolution={self.resolution}, framerate={self.framerate}, "
+            f"clock_mode={self.clock_mode}"
+        )
+
+    @property
+    def timestamp(self):
+        return int((time.monotonic() - self._clock_start) * 1e6)
+
+    @property
+    def recording(self):
+        return bool(self._encoders)
+
+    @property
+    def frame(self):
+        encoder = self._encoders.get(1)
+        return None if encoder is None else encoder.frame_index
+
+    def start_preview(self, **options):
+        self.preview = PiRenderer(self, **options)
+        return self.preview
+
+    def stop_preview(self):
+        if self.preview is not None:
+            self.preview.close()
+        self.preview = None
+
+    def _get_video_encoder(self, camera_port, output_port, format, resize, **options):
+        return PiVideoEncoder(self, camera_port, output_port, format, resize, **options)
+
+    def start_recording(self, output, format=None, resize=None, splitter_port=1, **options):
+        if splitter_port in self._encoders:
+            raise PiCameraAlreadyRecording(f"The camera is already using port {splitter_port}")
+
+        if format is None:
+            format = Path(str(output)).suffix.lstrip(".") if isinstance(output, str) else "h264"
+        if self.clock_mode == "reset" and not self._encoders:
+            self._clock_start = time.monotonic()
+
+        options.pop("quality", None)
+        motion_output = options.pop("motion_output", None)
+        encoder = self._get_video_encoder(splitter_port, None, format, resize, **options)
+        self._encoders[splitter_port] = encoder
+        encoder.start(output, motion_output)
+
+    def split_recording(self, output, splitter_port=1, **options):
+        encoder = self._encoders.get(splitter_port)
+        if encoder is None:
+            raise PiCameraNotRecording(f"There is no recording in progress on port {splitter_port}")
+        encoder.split(output, options.get("motion_output"))
+
+    def request_key_frame(self, splitter_port=1):
+        self._encoders[splitter_port].request_key_frame()
+
+    def wait_recording(self, timeout=0, splitter_port=1):
+        encoder = self._encoders.get(splitter_port)
+        if encoder is None:
+            raise PiCameraNotRecording(f"There is no recording in progress on port {splitter_port}")
+        encoder.wait(timeout)
+
+    def stop_recording(self, splitter_port=1):
+        encoder = self._encoders.pop(splitter_port, None)
+        if encoder is None:
+            raise PiCameraNotRecording(f"There is no recording in progress on port {splitter_port}")
+        encoder.close()
+
+    def close(self):
+        for splitter_port in list(self._encoders):
+            self.stop_recording(splitter_port=splitter_port)
+        self.stop_preview()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
@@ -0,0 +1,89 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from threading import Event, Lock, Thread
+
+
+class StatusPublisher(Thread):
+    """Periodically publish status dicts on topics `[instance_name].[topic]` over one socket.
+
+    Each topic has its own `status_callback` and interval. The socket wrapper is only used
+    from this thread. `status_callback` returns a dict to send or None to skip the interval.
+    """
+
+    daemon = True
+
+    socket_wrapper = None
+    instance_name = None
+    interval = 2.0  # default interval per topic
+
+    def __init__(self, socket_wrapper=None, instance_name=None):
+        super().__init__()
+
+        self.socket_wrapper = socket_wrapper
+        self.instance_name = instance_name
+        self._topics = {}
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._topics_changed = Event()
+
+    def add_topic(self, topic=None, status_callback=None, interval=None):
+        """Publish `status_callback()` on `topic` every `interval` seconds, also when running."""
+        interval = interval or self.interval
+        with self._lock:
+            self._topics[topic] = {
+                "callback": status_callback,
+                "interval": interval,
+                "next": time.monotonic() + interval,
+            }
+        self._topics_changed.set()
+
+    def set_interval(self, topic=None, interval=None):
+        with self._lock:
+            if topic in self._topics and interval and interval != self._topics[topic]["interval"]:
+                self._topics[topic]["interval"] = interval
+                self._topics[topic]["next"] = time.monotonic() + interval
+        self._topics_changed.set()
+
+    def full_topic(self, topic=None):
+        return f"{self.instance_name}.{topic}"
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                now = time.monotonic()
+                due = [topic for topic, entry in self._topics.items() if entry["next"] <= now]
+                for topic in due:
+                    self._topics[topic]["next"] = now + self._topics[topic]["interval"]
+                next_time = min(
+                    (entry["next"] for entry in self._topics.values()), default=now + self.interval
+                )
+
+            for topic in due:
+                self.publish(topic)
+
+            self._topics_changed.wait(max(0.0, next_time - time.monotonic()))
+            self._topics_changed.clear()
+
+    def publish(self, topic=None):
+        with self._lock:
+            entry = self._topics.get(topic)
+        if entry is None:
+            return
+
+        try:
+            status = entry["callback"]()
+        except BaseException as e:
+            logging.debug(f"Status callback failed for {self.full_topic(topic)}: {e}")
+            return
+
+        if status:
+            self.socket_wrapper.send_message(topic=self.full_topic(topic), message=status)
+
+    def stop(self):
+        self._stop_event.set()
+        self._topics_changed.set()
+        if self.is_alive():
+            self.join()
@@ -1,8 +1,14 @@
-import io
+import asyncio
+import json
 import logging
 import socketserver
+import time
+from functools import partial
 from http import server
-from threading import Condition
+from threading import Condition, Event, Thread
+from urllib.parse import parse_qs, urlsplit
+
+from rpi_camera_colony.latency import LatencyRecorder
 
 """
 Adapted from code of PiCamera:
@@ -11,46 +17,197 @@ https://picamera.readthedocs.io/en/release-1.13/recipes2.html#web-streaming
 
 
 class StreamingOutput:
-    def __init__(self):
-        self.frame = None
-        self.buffer = io.BytesIO()
+    """MJPEG encoder output that keeps the latest frames in a ring of preallocated slots.
+
+    Frames are written into the slots in place. `generation` counts complete frames and
+    frame `g` lives in slot `(g - 1) % n_slots`, so readers get `memoryview`s of complete frames
+    without copying. A slot is rewritten `n_slots - 1` frames later; readers check
+    `frame_valid(generation)` after use to detect that (see `FrameReader`).
+    """
+
+    n_slots = 8
+    slot_size = 2**19
+
+    def __init__(self, n_slots=None, slot_size=None):
+        self.n_slots = n_slots or self.n_slots
+        self.slot_size = slot_size or self.slot_size
+
+        self._slots = [bytearray(self.slot_size) for _ in range(self.n_slots)]
+        self._lengths = [0] * self.n_slots
+        self._write_position = 0
+        self.generation = 0
         self.condition = Condition()
+        self._frame_callbacks = []
+
+    @property
+    def _write_slot(self):
+        return self.generation % self.n_slots
 
     def write(self, buf):
-        if buf.startswith(b"\xff\xd8"):
-            # New frame, copy the existing buffer's content and notify all
-            # clients it's available
-            self.buffer.truncate()
-            with self.condition:
-                self.frame = self.buffer.getvalue()
-                self.condition.notify_all()
-            self.buffer.seek(0)
-        return self.buffer.write(buf)
+        if buf.startswith(b"\xff\xd8") and self._write_position:
+            # New frame starts before end of previous frame was seen
+            self._commit_frame()
+
+        length = len(buf)
+        slot = self._slots[self._write_slot]
+        end = self._write_position + length
+        if end > len(slot):
+            # Grow slot. Replace instead of resize: readers may hold memoryviews of the old slot
+            new_slot = bytearray(max(end, 2 * len(slot)))
+            new_slot[: self._write_position] = slot[: self._write_position]
+            self._slots[self._write_slot] = slot = new_slot
+        slot[self._write_position : end] = buf
+        self._write_position = end
+
+        if buf.endswith(b"\xff\xd9"):
+            self._commit_frame()
+        return length
+
+    def _commit_frame(self):
+        with self.condition:
+            self._lengths[self._write_slot] = self._write_position
+            self.generation += 1
+            self.condition.notify_all()
+        self._write_position = 0
+
+        for callback in self._frame_callbacks:
+            callback(self.generation)
+
+    def add_frame_callback(self, callback):
+        """Call `callback(generation)` from the encoder thread for each complete frame."""
+        self._frame_callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        if callback in self._frame_callbacks:
+            self._frame_callbacks.remove(callback)
+
+    def frame_valid(self, generation):
+        """Frame `generation` has not been (partly) overwritten by the encoder yet."""
+        return generation > 0 and self.generation - generation < self.n_slots - 1
+
+    def get_frame(self, generation=None):
+        """`memoryview` of frame `generation` (default: latest), or None if not available."""
+        generation = generation or self.generation
+        if not self.frame_valid(generation):
+            return None
+
+        slot_index = (generation - 1) % self.n_slots
+        return memoryview(self._slots[slot_index])[: self._lengths[slot_index]]
+
+    def wait_for_frame(self, last_generation=0, timeout=None):
+        """Wait for a frame newer than `last_generation`. Returns its generation or None."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.generation > last_generation, timeout):
+                return None
+            return self.generation
+
+    @property
+    def frame(self):
+        """Copy of the latest frame."""
+        frame = self.get_frame()
+        return None if frame is None else bytes(frame)
+
+    def reader(self):
+        return FrameReader(output=self)
 
     def flush(self):
         print(f"FLUSHING {StreamingOutput}")
 
 
+class FrameReader:
+    """Per-reader view on a StreamingOutput that always moves to the latest frame
+    and counts delivered, skipped and torn (overwritten while in use) frames."""
+
+    def __init__(self, output=None):
+        self.output = output
+        self.generation = 0
+        self.delivered = 0
+        self.skipped = 0
+        self.torn = 0
+
+    def next_frame(self, timeout=None):
+        """`memoryview` of the next (latest) frame, or None on timeout or if already stale."""
+        generation = self.output.wait_for_frame(last_generation=self.generation, timeout=timeout)
+        if generation is None:
+            return None
+
+        frame = self.output.get_frame(generation)
+        if self.generation:
+            self.skipped += generation - self.generation - 1
+        self.generation = generation
+        if frame is None:
+            self.skipped += 1
+            return None
+        self.delivered += 1
+        return frame
+
+    def frame_valid(self):
+        """Check after using the frame returned by `next_frame`."""
+        valid = self.output.frame_valid(self.generation)
+        if not valid:
+            self.torn += 1
+        return valid
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "delivered": self.delivered,
+            "skipped": self.skipped,
+            "torn": self.torn,
+        }
+
+
+def parse_max_fps(query=None):
+    """Frame rate limit of a stream request from the `fps` query parameter, or None."""
+    try:
+        return float(query.get("fps", [0])[0]) or None
+    except ValueError:
+        return None
+
+
 class StreamingHandler(server.BaseHTTPRequestHandler):
+    """MJPEG stream with one thread per viewer (`stream_server = "threading"`).
+
+    Sends are blocking and the viewer's FrameReader moves to the latest frame after each send,
+    so a slow viewer skips frames instead of queueing them. `?fps=N` limits the frame rate.
+    """
+
     def do_GET(self):
-        if self.path == "/":
+        url = urlsplit(self.path)
+        if url.path == "/":
+            max_fps = parse_max_fps(parse_qs(url.query))
+            min_interval = 1.0 / max_fps if max_fps else 0
             self.send_response(200)
             self.send_header("Age", 0)
             self.send_header("Cache-Control", "no-cache, private")
             self.send_header("Pragma", "no-cache")
             self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=FRAME")
             self.end_headers()
+            reader = None
             try:
+                attribute_name = "output_from_camera"
+                if hasattr(self, attribute_name):
+                    obj = getattr(self, attribute_name)
+                else:
+                    raise AttributeError(f"{self} has no attribute '{attribute_name}'")
+
+                reader = obj.reader()
+                next_send_time = 0
                 while True:
-                    attribute_name = "output_from_camera"
-                    if hasattr(self, attribute_name):
-                        obj = getattr(self, attribute_name)
-                    else:
-                        raise AttributeError(f"{self} has no attribute '{attribute_name}'")
-
-                    with obj.condition:
-                        obj.condition.wait()
-                        frame = obj.frame
+                    delay = next_send_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)  # frames in between are skipped by the reader
+
+                    frame = reader.next_frame(timeout=1.0)
+                    if frame is None:
+                        continue
+                    # Copy before the (possibly slow) send, then check that the encoder did not
+                    # rewrite the slot while copying
+                    frame = bytes(frame)
+                    if not reader.frame_valid():
+                        continue
+
+                    next_send_time = time.monotonic() + min_interval
                     self.wfile.write(b"--FRAME\r\n")
                     self.send_header("Content-Type", "image/jpeg")
                     self.send_header("Content-Length", len(frame))
@@ -59,9 +216,11 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
                     self.wfile.write(b"\r\n")
             except Exception as e:
                 logging.warning(
-                    "Removed streaming client %s: %s",
+                    "Removed streaming client %s: %s (max fps: %s, %s)",
                     self.client_address,
                     str(e),
+                    max_fps,
+                    reader.stats() if reader is not None else {},
                 )
         else:
             self.send_error(404)
@@ -71,3 +230,288 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
 class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
     allow_reuse_address = True
     daemon_threads = True
+
+
+STREAM_RESPONSE_HEADER = (
+    b"HTTP/1.0 200 OK\r\n"
+    b"Age: 0\r\n"
+    b"Cache-Control: no-cache, private\r\n"
+    b"Pragma: no-cache\r\n"
+    b"Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\n\r\n"
+)
+NOT_FOUND_RESPONSE = b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+NO_FRAME_RESPONSE = b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n"
+
+
+def make_snapshot_response(frame, etag):
+    return b"".join(
+        [
+            b"HTTP/1.0 200 OK\r\nContent-Type: image/jpeg\r\n",
+            b"Cache-Control: no-cache\r\nETag: %s\r\n" % etag.encode(),
+            b"Content-Length: %d\r\n\r\n" % len(frame),
+            frame,
+        ]
+    )
+
+
+def make_not_modified_response(etag):
+    return b"HTTP/1.0 304 Not Modified\r\nETag: %s\r\nContent-Length: 0\r\n\r\n" % etag.encode()
+
+
+def make_json_response(data):
+    body = json.dumps(data).encode()
+    return (
+        b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+        b"Cache-Control: no-cache\r\nContent-Length: %d\r\n\r\n" % len(body)
+    ) + body
+
+
+def make_multipart_chunk(frame):
+    """Multipart part of one JPEG frame, with the same framing as StreamingHandler."""
+    return b"".join(
+        [
+            b"--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame),
+            frame,
+            b"\r\n",
+        ]
+    )
+
+
+class StreamClient:
+    """Connected stream viewer with a newest-only send slot.
+
+    A new frame replaces a frame that was not sent yet (counted as skipped), and the next frame
+    is only written once the previous one is flushed to the socket. A slow viewer always gets
+    the latest frame and holds at most one queued frame, shared with the other viewers.
+    `max_fps` limits the frame rate sent to this viewer.
+    """
+
+    def __init__(self, writer=None, max_fps=None, stream=""):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.max_fps = max_fps
+        self.stream = stream
+        self.connected_at = time.time()
+        self.frames_delivered = 0
+        self.frames_skipped = 0
+        self.latency = LatencyRecorder(size=1024)
+        self._pending = None  # (chunk, frame time)
+        self._new_frame = asyncio.Event()
+
+        # drain() returns once the transport buffer is empty
+        writer.transport.set_write_buffer_limits(high=0)
+
+    def offer(self, chunk, frame_time):
+        if self._pending is not None:
+            self.frames_skipped += 1
+        self._pending = (chunk, frame_time)
+        self._new_frame.set()
+
+    async def send_loop(self):
+        min_interval = 1.0 / self.max_fps if self.max_fps else 0
+        next_send_time = 0
+        try:
+            while not self.writer.is_closing():
+                await self._new_frame.wait()
+                delay = next_send_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)  # newer frames replace pending frame meanwhile
+
+                self._new_frame.clear()
+                chunk, frame_time = self._pending
+                self._pending = None
+                next_send_time = time.monotonic() + min_interval
+
+                self.writer.write(chunk)
+                await self.writer.drain()
+                self.latency.add(time.monotonic() - frame_time)
+                self.frames_delivered += 1
+        except ConnectionError:
+            pass
+
+    def stats(self):
+        return {
+            "address": "{}:{}".format(*self.address[:2]) if self.address else None,
+            "stream": self.stream,
+            "max_fps": self.max_fps,
+            "connected_seconds": time.time() - self.connected_at,
+            "delivered": self.frames_delivered,
+            "skipped": self.frames_skipped,
+            "latency": self.latency.percentiles(),
+        }
+
+
+class AsyncStreamingServer(Thread):
+    """MJPEG-over-HTTP server on an asyncio event loop in a background thread.
+
+    Each new frame of `output` is formatted as multipart chunk once and written to
+    all connected clients, instead of one thread per viewer waiting on the frame condition.
+
+    Endpoints: `/` MJPEG stream (`?fps=N` to limit the frame rate), `/snapshot.jpg` latest frame
+    (with ETag, `If-None-Match` gets 304 while there is no newer frame), `/stats` client stats.
+    Additional `outputs` (dict by name) are served the same way at `/[name]/` and
+    `/[name]/snapshot.jpg`.
+    """
+
+    daemon = True
+
+    def __init__(self, output=None, address="", port=8001, outputs=None):
+        super().__init__()
+
+        self.output = output
+        self.outputs = dict(outputs or {})
+        if output is not None:
+            self.outputs[""] = output
+        self.address = address
+        self.port = port
+        self.clients = set()
+        self.loop = None
+        self._server = None
+        self._frame_callbacks = {name: partial(self._frame_callback, name) for name in self.outputs}
+        self._last_generations = dict.fromkeys(self.outputs, 0)
+        self._snapshots = dict.fromkeys(self.outputs, (0, None))  # (generation, response)
+        self._etag_prefix = f"{time.time_ns():x}"  # ETags differ between server runs
+        self._ready = Event()
+
+    def start(self):
+        super().start()
+        self._ready.wait(timeout=5)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(
+                self._handle_client, self.address or None, self.port, reuse_address=True
+            )
+        )
+        self.port = self._server.sockets[0].getsockname()[1]  # port 0: any free port
+        for name, output in self.outputs.items():
+            output.add_frame_callback(self._frame_callbacks[name])
+        self._ready.set()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            for name, output in self.outputs.items():
+                output.remove_frame_callback(self._frame_callbacks[name])
+            for client in list(self.clients):
+                client.writer.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._server.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+    def _frame_callback(self, name, generation):
+        # Encoder thread: only schedule the broadcast on the event loop
+        if self.clients:
+            self.loop.call_soon_threadsafe(self._broadcast_frame, name, time.monotonic())
+
+    def _broadcast_frame(self, name, frame_time):
+        output = self.outputs[name]
+        generation = output.generation
+        if generation == self._last_generations[name]:
+            return
+
+        frame = output.get_frame(generation)
+        if frame is None:
+            return
+        chunk = make_multipart_chunk(frame)
+        if not output.frame_valid(generation):
+            return  # overwritten while copying
+
+        self._last_generations[name] = generation
+        for client in list(self.clients):
+            if client.stream == name:
+                client.offer(chunk, frame_time)
+
+    def stats(self):
+        """Per-client delivered/skipped frames and latency (frame complete to flushed)."""
+        return {
+            "generations": {name: output.generation for name, output in self.outputs.items()},
+            "clients": [client.stats() for client in self.clients],
+        }
+
+    def _snapshot_response(self, name="", if_none_match=None):
+        output = self.outputs[name]
+        generation = output.generation
+        etag = f'"{self._etag_prefix}-{name}-{generation}"'
+        if if_none_match == etag:
+            return make_not_modified_response(etag)
+
+        snapshot_generation, response = self._snapshots[name]
+        if response is None or snapshot_generation != generation:
+            frame = output.get_frame(generation)
+            if frame is None:
+                return NO_FRAME_RESPONSE
+            response = make_snapshot_response(frame, etag)
+            if not output.frame_valid(generation):
+                return NO_FRAME_RESPONSE  # overwritten while copying
+            self._snapshots[name] = (generation, response)
+        return response
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in [b"\r\n", b"\n", b""]:
+                break
+            name, _, value = line.decode(errors="replace").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode(errors="replace").split()
+        url = urlsplit(parts[1] if len(parts) > 1 else "")
+        return url.path, parse_qs(url.query), headers
+
+    async def _handle_client(self, reader, writer):
+        try:
+            path, query, headers = await self._read_request(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+
+        if path == "/stats":
+            writer.write(make_json_response(self.stats()))
+            writer.close()
+            return
+
+        name, _, endpoint = path.strip("/").rpartition("/")
+        if endpoint != "snapshot.jpg":
+            name, endpoint = path.strip("/"), ""
+        if name not in self.outputs:
+            writer.write(NOT_FOUND_RESPONSE)
+            writer.close()
+            return
+        elif endpoint == "snapshot.jpg":
+            response = self._snapshot_response(name, if_none_match=headers.get("if-none-match"))
+            writer.write(response)
+            writer.close()
+            return
+
+        max_fps = parse_max_fps(query)
+        writer.write(STREAM_RESPONSE_HEADER)
+        client = StreamClient(writer=writer, max_fps=max_fps, stream=name)
+        self.clients.add(client)
+        send_task = asyncio.ensure_future(client.send_loop())
+        logging.debug(f"New streaming client {client.address} on /{name} (max fps: {max_fps})")
+
+        try:
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # disconnected or server shutdown
+        finally:
+            self.clients.discard(client)
+            send_task.cancel()
+            writer.close()
+            logging.debug(f"Removed streaming client {client.address}: {client.stats()}")
+
+    def shutdown(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.is_alive():
+            self.join()
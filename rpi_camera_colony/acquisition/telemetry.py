@@ -0,0 +1,68 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import os
+import shutil
+import time
+from pathlib import Path
+
+CPU_TEMPERATURE_FILE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def get_cpu_temperature():
+    """CPU temperature in degrees Celsius, or None if not available."""
+    try:
+        return int(Path(CPU_TEMPERATURE_FILE).read_text()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def get_free_disk_space(path=None):
+    """Free space in bytes on the file system of `path` (or its closest existing parent)."""
+    path = Path(path or ".").absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    try:
+        return shutil.disk_usage(str(path)).free
+    except OSError:
+        return None
+
+
+class TelemetryCollector:
+    """Collect a telemetry snapshot of a recording camera and the host.
+
+    The fps is measured over the interval between consecutive snapshots.
+    """
+
+    def __init__(self, camera=None, data_path=None):
+        self.camera = camera
+        self.data_path = data_path
+        self._last_time = None
+        self._last_frame_count = 0
+
+    def snapshot(self):
+        encoder = self.camera.video_encoder if self.camera.recording else None
+        frame_count = 0 if encoder is None else encoder.frame_count
+        ttl_in_filter = self.camera.ttl_in_filter
+
+        now = time.monotonic()
+        fps = None
+        if self._last_time is not None and frame_count >= self._last_frame_count:
+            fps = (frame_count - self._last_frame_count) / (now - self._last_time)
+        self._last_time = now
+        self._last_frame_count = frame_count
+
+        return {
+            "recording": bool(self.camera.recording),
+            "fps": fps,
+            "framerate": float(self.camera.framerate),
+            "frame_count": frame_count,
+            "ttl_count": 0 if encoder is None else encoder.ttl_count,
+            "bytes_written": 0 if encoder is None else encoder.bytes_written,
+            "ttl_in": {} if ttl_in_filter is None else ttl_in_filter.stats(),
+            "callback_latency": {} if encoder is None else encoder.callback_latency.percentiles(),
+            "disk_free_bytes": get_free_disk_space(self.data_path),
+            "cpu_temperature": get_cpu_temperature(),
+            "load_average": list(os.getloadavg()),
+            "time": time.time(),
+        }
@@ -0,0 +1,198 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+from collections import deque
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+from rpi_camera_colony.files import (
+    TIMESTAMP_FIELDS,
+    close_file_safe,
+    write_binary_timestamp_header,
+)
+
+TTL_OUT_FIELDS = TIMESTAMP_FIELDS["ttl.out"]
+TTL_IN_FIELDS = TIMESTAMP_FIELDS["ttl.in"]
+
+
+class TimestampWriter(Thread):
+    """Collect timestamp rows in a preallocated ring buffer and write them to file in batches.
+
+    Rows are written as CSV (`path`) and/or as fixed-width binary rows (`binary_path`),
+    see `rpi_camera_colony.files.open_binary_timestamps` for reading the binary files.
+
+    `push` is called from the camera callback threads and only copies the values
+    into the ring. A background thread drains the ring every `flush_interval` seconds
+    (0: as soon as rows are pushed).
+    Single producer, single consumer: the producer only advances `_head`,
+    the writer thread only advances `_tail`.
+
+    `rollover` switches to new files from the next pushed row on (e.g. for a new video segment).
+    It may be called from another thread than `push` (e.g. the encoder thread for TTL-in rows
+    pushed by the GPIO callback thread): a lock orders rollover and push.
+    """
+
+    daemon = True
+
+    path = None
+    binary_path = None
+    fields = TTL_OUT_FIELDS
+    buffer_size = 2**16
+    flush_interval = 0.5
+
+    overflow_count = 0
+    high_water_mark = 0
+    rows_written = 0
+
+    def __init__(
+        self, path=None, fields=None, buffer_size=None, flush_interval=None, binary_path=None
+    ):
+        """
+        :param path: Output CSV file path, or None to skip CSV output
+        :param binary_path: Output binary file path, or None to skip binary output
+        :param fields: List of (column name, numpy dtype) tuples
+        :param buffer_size: Number of rows in ring buffer
+        :param flush_interval: Seconds between batched writes, 0 writes as soon as rows arrive
+        """
+        super().__init__()
+
+        self.path = path
+        self.binary_path = binary_path
+        self.fields = fields or self.fields
+        if buffer_size is not None:
+            self.buffer_size = int(buffer_size)
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+
+        self._ring = np.zeros(self.buffer_size, dtype=np.dtype(self.fields))
+        self._head = 0
+        self._tail = 0
+        self._stop_event = Event()
+        self._rows_pushed = Event()  # only used with flush_interval 0
+        self._rollovers = deque()  # (row index, path, binary_path)
+        self._push_lock = Lock()
+
+        self._file = None
+        self._binary_file = None
+        self._open_files(path=self.path, binary_path=self.binary_path)
+
+    def _open_files(self, path=None, binary_path=None):
+        self._close_files()
+        self.path = path
+        self.binary_path = binary_path
+
+        if self.path is not None:
+            self._file = Path(self.path).open("w")
+            self._file.write(",".join([name for name, _ in self.fields]) + "\n")
+
+        if self.binary_path is not None:
+            self._binary_file = Path(self.binary_path).open("wb")
+            write_binary_timestamp_header(file_handle=self._binary_file, fields=self.fields)
+
+    def _close_files(self):
+        for file_handle in [self._file, self._binary_file]:
+            if file_handle is not None:
+                close_file_safe(file_handle=file_handle)
+        self._file = None
+        self._binary_file = None
+
+    @property
+    def fill_level(self):
+        return self._head - self._tail
+
+    def push(self, *values):
+        """Add one row. Returns False and counts overflow if the ring is full."""
+        with self._push_lock:
+            fill = self._head - self._tail
+            if fill >= self.buffer_size:
+                self.overflow_count += 1
+                return False
+
+            self._ring[self._head % self.buffer_size] = values
+            self._head += 1
+
+        if not self.flush_interval:
+            self._rows_pushed.set()
+        if fill + 1 > self.high_water_mark:
+            self.high_water_mark = fill + 1
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.flush_interval:
+                self._stop_event.wait(self.flush_interval)
+            else:
+                self._rows_pushed.wait()
+                self._rows_pushed.clear()
+            self._drain()
+        self._drain()
+
+    def rollover(self, path=None, binary_path=None):
+        """Write rows pushed from now on to new files."""
+        with self._push_lock:
+            self._rollovers.append((self._head, path, binary_path))
+
+    def _drain(self):
+        head = self._head
+        while self._rollovers and self._rollovers[0][0] <= head:
+            row_index, path, binary_path = self._rollovers.popleft()
+            self._drain_until(row_index)
+            self._open_files(path=path, binary_path=binary_path)
+        self._drain_until(head)
+
+    def _drain_until(self, head):
+        tail = self._tail
+        if head == tail:
+            return
+
+        start = tail % self.buffer_size
+        stop = head % self.buffer_size
+        if start < stop:
+            rows = self._ring[start:stop].copy()
+        else:
+            rows = np.concatenate([self._ring[start:], self._ring[:stop]])
+        self._tail = head
+
+        self._write_rows(rows)
+        self.rows_written += len(rows)
+
+    def _write_rows(self, rows):
+        if self._file is not None:
+            self._file.write("".join([",".join(map(str, row)) + "\n" for row in rows.tolist()]))
+            self._file.flush()
+
+        if self._binary_file is not None:
+            rows.tofile(self._binary_file)
+            self._binary_file.flush()
+
+    def close(self):
+        self._stop_event.set()
+        self._rows_pushed.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self._drain()
+        self._close_files()
+
+        if self.overflow_count:
+            logging.warning(
+                f"Timestamp buffer overflowed {self.overflow_count} times "
+                f"for {self.path or self.binary_path}. "
+                f"Increase timestamp_buffer_size (now {self.buffer_size})."
+            )
+        logging.debug(
+            f"Timestamp writer closed for {self.path or self.binary_path}: "
+            f"rows={self.rows_written}, "
+            f"high_water_mark={self.high_water_mark}/{self.buffer_size}"
+        )
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "overflow_count": self.overflow_count,
+            "high_water_mark": self.high_water_mark,
+            "buffer_size": self.buffer_size,
+        }
@@ -0,0 +1,220 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from collections import deque
+from threading import Event, Thread
+
+import numpy as np
+
+from rpi_camera_colony.acquisition.simulation import simulation_enabled
+
+
+class RPiGPIOBackend:
+    """GPIO backend wrapping the RPi.GPIO module (or a module with the same interface).
+
+    Without `gpio_module`, uses the simulated GPIO module if RCC_SIMULATE_HARDWARE is set.
+    """
+
+    def __init__(self, gpio_module=None):
+        if gpio_module is None:
+            if simulation_enabled():
+                from rpi_camera_colony.acquisition.simulation import gpio as gpio_module
+            else:
+                import RPi.GPIO as gpio_module
+        self.gpio = gpio_module
+
+    def setup_output(self, pin):
+        self.gpio.setup(pin, self.gpio.OUT, initial=self.gpio.LOW)
+        self.gpio.output(pin, False)
+
+    def output(self, pin, value):
+        self.gpio.output(pin, value)
+
+
+class TTLEdgeFilter:
+    """Debounce and decimate TTL-in edges on the GPIO callback thread.
+
+    Edges closer than `debounce` (microseconds) to the previous accepted edge are ignored.
+    Of the accepted edges, only every n-th is recorded. Only counters are updated per edge.
+    """
+
+    debounce = 0
+    every_nth = 1
+
+    def __init__(self, debounce=None, every_nth=None):
+        if debounce is not None:
+            self.debounce = debounce
+        if every_nth is not None:
+            self.every_nth = int(every_nth)
+
+        self.edge_count = 0
+        self.debounced_count = 0
+        self.accepted_count = 0
+        self.recorded_count = 0
+        self._last_edge = None
+
+    def accept(self, timestamp):
+        """Returns True if the edge at `timestamp` (microseconds) should be recorded."""
+        self.edge_count += 1
+        if self._last_edge is not None and timestamp - self._last_edge < self.debounce:
+            self.debounced_count += 1
+            return False
+
+        self._last_edge = timestamp
+        self.accepted_count += 1
+        if (self.accepted_count - 1) % self.every_nth:
+            return False
+
+        self.recorded_count += 1
+        return True
+
+    def stats(self):
+        return {
+            "edges": self.edge_count,
+            "debounced": self.debounced_count,
+            "recorded": self.recorded_count,
+        }
+
+
+class TTLPulseGenerator(Thread):
+    """Emit TTL pulses from a dedicated thread.
+
+    The encoder callback only calls `trigger`, which appends the trigger time to a
+    deque and sets an event. Pulse timing (incl. sleeping for the pulse duration)
+    happens on this thread.
+
+    At most `max_backlog` triggers wait for emission. Triggers arriving with a full backlog
+    (e.g. pulse trains longer than the frame interval) are dropped and counted, so pulses
+    do not drift away from their frames.
+    """
+
+    daemon = True
+
+    pin = None
+    backend = None
+    pulse_duration = 0.001
+    pulses_per_trigger = 1  # >1 emits a pulse train per trigger
+    pulse_interval = 0.002  # seconds between rising edges within a pulse train
+    every_nth = 1  # only pulse for every n-th trigger
+    max_backlog = 2  # pending triggers, later triggers are dropped
+
+    trigger_count = 0
+    pulse_count = 0
+    dropped_count = 0
+    backlog_high_water_mark = 0
+
+    def __init__(
+        self,
+        pin=None,
+        backend=None,
+        pulse_duration=None,
+        pulses_per_trigger=None,
+        pulse_interval=None,
+        every_nth=None,
+        max_backlog=None,
+        latency_buffer_size=4096,
+    ):
+        super().__init__()
+
+        self.pin = pin
+        self.backend = backend or RPiGPIOBackend()
+        if pulse_duration is not None:
+            self.pulse_duration = pulse_duration
+        if pulses_per_trigger is not None:
+            self.pulses_per_trigger = int(pulses_per_trigger)
+        if pulse_interval is not None:
+            self.pulse_interval = pulse_interval
+        if every_nth is not None:
+            self.every_nth = max(1, int(every_nth))
+        if max_backlog is not None:
+            self.max_backlog = max(1, int(max_backlog))
+
+        self._pending = deque()
+        self._drop_logged = False
+        self._wakeup = Event()
+        self._stop_event = Event()
+        self._latencies = np.zeros(int(latency_buffer_size), dtype=np.float64)
+
+        self.backend.setup_output(self.pin)
+
+    def trigger(self):
+        """Request pulse(s) for one frame. Returns True if a pulse was scheduled."""
+        self.trigger_count += 1
+        if (self.trigger_count - 1) % self.every_nth:
+            return False
+
+        if len(self._pending) >= self.max_backlog:
+            self.dropped_count += 1
+            return False
+
+        self._pending.append(time.perf_counter())
+        self._wakeup.set()
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(timeout=0.1)
+            self._wakeup.clear()
+            self._emit_pending()
+        self._emit_pending()
+
+    def _emit_pending(self):
+        backlog = len(self._pending)
+        if backlog > self.backlog_high_water_mark:
+            self.backlog_high_water_mark = backlog
+
+        if self.dropped_count and not self._drop_logged:
+            self._drop_logged = True
+            logging.warning(
+                f"TTL-out on pin {self.pin}: dropping triggers while pulses are pending "
+                f"(pulse train longer than the frame interval?). See dropped count at close."
+            )
+
+        while self._pending:
+            self._emit(trigger_time=self._pending.popleft())
+
+    def _emit(self, trigger_time):
+        for i in range(self.pulses_per_trigger):
+            self.backend.output(self.pin, True)
+            if i == 0:
+                self._latencies[self.pulse_count % len(self._latencies)] = (
+                    time.perf_counter() - trigger_time
+                )
+                self.pulse_count += 1
+
+            time.sleep(self.pulse_duration)
+            self.backend.output(self.pin, False)
+
+            if i < self.pulses_per_trigger - 1:
+                time.sleep(max(0.0, self.pulse_interval - self.pulse_duration))
+
+    def latency_stats(self):
+        """Trigger-to-rising-edge latency in seconds over the most recent pulses."""
+        latencies = self._latencies[: min(self.pulse_count, len(self._latencies))]
+        if not len(latencies):
+            return {}
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {
+            "count": int(self.pulse_count),
+            "mean": float(latencies.mean()),
+            "p50": float(p50),
+            "p99": float(p99),
+            "max": float(latencies.max()),
+        }
+
+    def close(self):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+
+        self.backend.output(self.pin, False)
+        logging.debug(
+            f"TTL pulse generator on pin {self.pin} closed: triggers={self.trigger_count}, "
+            f"pulses={self.pulse_count}, dropped={self.dropped_count}, "
+            f"backlog_high_water_mark={self.backlog_high_water_mark}, "
+            f"latency={self.latency_stats()}"
+        )
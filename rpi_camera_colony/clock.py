@@ -0,0 +1,135 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import time
+
+import numpy as np
+
+
+class ClockDriftModel:
+    """Online linear fit of a reference clock (seconds) against the camera clock (microseconds).
+
+    reference_time = reference_origin + intercept + slope * (camera_time - camera_origin) * 1e-6
+
+    The origins are the first sample, so that the fit runs on small numbers.
+    Uses running (Welford) means and co-moments, so samples do not need to be kept.
+    """
+
+    def __init__(self, clock="realtime"):
+        self.clock = clock
+        self.n_samples = 0
+        self.camera_origin = None
+        self.reference_origin = None
+        self._mean_x = 0.0
+        self._mean_y = 0.0
+        self._cxx = 0.0
+        self._cxy = 0.0
+        self._cyy = 0.0
+
+    def add_sample(self, camera_time, reference_time):
+        if self.camera_origin is None:
+            self.camera_origin = int(camera_time)
+            self.reference_origin = float(reference_time)
+
+        x = (camera_time - self.camera_origin) * 1e-6
+        y = reference_time - self.reference_origin
+
+        self.n_samples += 1
+        dx = x - self._mean_x
+        dy = y - self._mean_y
+        self._mean_x += dx / self.n_samples
+        self._mean_y += dy / self.n_samples
+        self._cxx += dx * (x - self._mean_x)
+        self._cxy += dx * (y - self._mean_y)
+        self._cyy += dy * (y - self._mean_y)
+
+    @property
+    def slope(self):
+        if self.n_samples < 2 or not self._cxx:
+            return 1.0
+        return self._cxy / self._cxx
+
+    @property
+    def intercept(self):
+        return self._mean_y - self.slope * self._mean_x
+
+    @property
+    def residual_std(self):
+        if self.n_samples < 3:
+            return None
+        return float(np.sqrt(max(0.0, self._cyy - self.slope * self._cxy) / (self.n_samples - 2)))
+
+    @property
+    def drift_ppm(self):
+        return (self.slope - 1.0) * 1e6
+
+    def predict(self, camera_time):
+        """Reference clock time (seconds) for camera time(s) in microseconds. Vectorized."""
+        x = (np.asarray(camera_time, dtype=np.float64) - self.camera_origin) * 1e-6
+        return self.reference_origin + (self.intercept + self.slope * x)
+
+    def to_dict(self):
+        return {
+            "clock": self.clock,
+            "n_samples": self.n_samples,
+            "camera_origin": self.camera_origin,
+            "reference_origin": self.reference_origin,
+            "intercept": self.intercept,
+            "slope": self.slope,
+            "drift_ppm": self.drift_ppm,
+            "residual_std": self.residual_std,
+        }
+
+    @classmethod
+    def from_dict(cls, model_dict=None):
+        """Model for prediction from the parameters of `to_dict` (e.g. from metadata)."""
+        model = cls(clock=model_dict.get("clock", "realtime"))
+        model.n_samples = model_dict["n_samples"]
+        model.camera_origin = model_dict["camera_origin"]
+        model.reference_origin = model_dict["reference_origin"]
+        # Fixed parameters: represent the fit as means with unit variance in x
+        model._mean_x = 0.0
+        model._mean_y = model_dict["intercept"]
+        model._cxx = 1.0
+        model._cxy = model_dict["slope"]
+        model._cyy = model._cxy * model_dict["slope"]
+        if model_dict.get("residual_std") is not None and model.n_samples > 2:
+            model._cyy += model_dict["residual_std"] ** 2 * (model.n_samples - 2)
+        return model
+
+
+def wait_until(wall_time=None, spin_time=0.002):
+    """Block until the wall-clock time `wall_time` (seconds since epoch, `time.time`).
+
+    Sleeps until `spin_time` seconds before, then busy-waits, because sleep overshoots by
+    up to a scheduler tick. Returns how late (seconds) it returned, or was already.
+    """
+    while True:
+        remaining = wall_time - time.time()
+        if remaining <= 0:
+            return -remaining
+        if remaining > spin_time:
+            time.sleep(remaining - spin_time)
+
+
+def summarise_start_offsets(start_at=None, offsets=None):
+    """Inter-camera start skew from the start offsets (seconds after `start_at`) by camera.
+
+    Cameras with offset None (not started or not reported) are listed as missing.
+    """
+    reported = {name: offset for name, offset in offsets.items() if offset is not None}
+    summary = {
+        "start_at": start_at,
+        "offsets": reported,
+        "missing": sorted(name for name, offset in offsets.items() if offset is None),
+    }
+    if reported:
+        values = np.array(list(reported.values()))
+        summary.update(
+            skew=float(values.max() - values.min()),
+            mean_offset=float(values.mean()),
+            max_offset=float(values.max()),
+            first=min(reported, key=reported.get),
+            last=max(reported, key=reported.get),
+        )
+    return summary
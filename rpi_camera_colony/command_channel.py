@@ -0,0 +1,379 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import itertools
+import logging
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+from threading import Event, Lock, Thread
+
+import zmq
+
+from rpi_camera_colony.latency import LatencyRecorder
+from rpi_camera_colony.network_communication import zmq_context
+from rpi_camera_colony.serialization import (
+    decode_message,
+    encode_message,
+    get_message_codec,
+    negotiate_codec,
+)
+
+HELLO = "hello"
+RECEIVED = "received"
+ACK = "ack"
+
+
+class PendingCommand:
+    """Command sent by the CommandRouter, until acknowledged or out of retries."""
+
+    def __init__(self, command_id=None, instance_name=None, message=None, timeout=1.0, retries=2):
+        self.command_id = command_id
+        self.instance_name = instance_name
+        self.message = message
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.sent_time = None
+        self.received = False
+        self.ack = None
+        self.done = Event()
+
+    def wait(self, timeout=None):
+        """Ack message (dict), or None if not acknowledged."""
+        self.done.wait(timeout)
+        return self.ack
+
+
+class CommandRouter(Thread):
+    """Acknowledged commands to many remote instances over one ROUTER socket.
+
+    Remote instances connect a DEALER socket with their instance name as identity and
+    announce themselves with a hello message. Each command carries an id and is re-sent
+    every `ack_timeout` seconds (at most `retries` times) until the remote confirms receipt,
+    then acknowledged when handled (within `handle_timeout` seconds, e.g. camera warm-up).
+    Commands to instances that are not connected yet are sent as soon as they say hello.
+    Commands are encoded with the best codec both sides support (`codecs` in the hello).
+    The socket is only used by this thread, commands are queued from any thread.
+    """
+
+    daemon = True
+
+    ack_timeout = 1.0  # seconds
+    retries = 2
+    handle_timeout = 30.0  # seconds
+    poll_interval = 100  # milliseconds, maximum delay of stop
+
+    def __init__(self, socket_wrapper=None, ack_timeout=None, retries=None):
+        """
+        :param socket_wrapper: bound SocketCommunication with pattern ROUTER
+        """
+        super().__init__()
+
+        self.socket_wrapper = socket_wrapper
+        self.ack_timeout = ack_timeout or self.ack_timeout
+        self.retries = self.retries if retries is None else retries
+        self.peers = {}  # instance name: time of the last message
+        self.peer_codecs = {}  # instance name: codec negotiated at hello
+        self.command_stats = {}
+
+        self._pending = {}  # in order of sending
+        self._command_ids = itertools.count(1)
+        self._command_id_prefix = format(time.time_ns(), "x")  # unique per router
+        self._outgoing = queue.Queue()
+        self._peer_event = Event()
+        self._stop_event = Event()
+
+        # Wake up the thread for queued commands
+        wakeup_address = f"inproc://command-router-{id(self)}"
+        self._wakeup_receiver = zmq_context.context.socket(zmq.PAIR)
+        self._wakeup_receiver.bind(wakeup_address)
+        self._wakeup_sender = zmq_context.context.socket(zmq.PAIR)
+        self._wakeup_sender.connect(wakeup_address)
+        self._wakeup_lock = Lock()
+
+        socket = self.socket_wrapper.socket
+        socket.setsockopt(zmq.ROUTER_MANDATORY, 1)  # error instead of drop for unknown peers
+        socket.setsockopt(zmq.ROUTER_HANDOVER, 1)  # restarted remote takes over its identity
+
+    def send(self, instance_name=None, message=None, wait=True, timeout=None, retries=None):
+        """Send `message` (dict) to `instance_name`.
+
+        Returns the ack (dict, or None if not acknowledged) if `wait`, else the PendingCommand.
+        """
+        pending = PendingCommand(
+            command_id=f"{self._command_id_prefix}-{next(self._command_ids)}",
+            instance_name=instance_name,
+            message=dict(message),
+            timeout=timeout or self.ack_timeout,
+            retries=self.retries if retries is None else retries,
+        )
+        try:
+            if not self.is_alive():
+                raise zmq.ZMQError(msg="not running")
+            self._outgoing.put(pending)
+            with self._wakeup_lock:
+                self._wakeup_sender.send(b"")
+        except zmq.ZMQError:
+            logging.warning(f"Command router not running. Not sent to {instance_name}: {message}")
+            pending.done.set()
+            return None if wait else pending
+
+        if wait:
+            return pending.wait()
+        return pending
+
+    @staticmethod
+    def wait_all(pending_commands=None):
+        """Acks of a list of PendingCommands by instance name."""
+        return {pending.instance_name: pending.wait() for pending in pending_commands}
+
+    def wait_for_peers(self, instance_names=None, timeout=None):
+        """Wait until all instances said hello. Returns the names of missing instances."""
+        end = time.monotonic() + (timeout or 0)
+        missing = [name for name in instance_names if name not in self.peers]
+        while missing and time.monotonic() < end:
+            self._peer_event.clear()
+            self._peer_event.wait(min(0.1, max(0.0, end - time.monotonic())))
+            missing = [name for name in missing if name not in self.peers]
+        return missing
+
+    def run(self):
+        socket = self.socket_wrapper.socket
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        poller.register(self._wakeup_receiver, zmq.POLLIN)
+
+        try:
+            while not self._stop_event.is_set():
+                ready = dict(poller.poll(self._next_poll_timeout()))
+
+                if self._wakeup_receiver in ready:
+                    while self._wakeup_receiver.poll(0):
+                        self._wakeup_receiver.recv()
+                    while not self._outgoing.empty():
+                        pending = self._outgoing.get()
+                        self._pending[pending.command_id] = pending
+                        self._transmit(pending)
+
+                if socket in ready:
+                    while socket.poll(0):
+                        message_parts = socket.recv_multipart(zmq.NOBLOCK)
+                        if len(message_parts) == 2:
+                            self._receive(*message_parts)
+
+                self._check_timeouts()
+        except zmq.ZMQError as e:
+            logging.debug(f"Command router stopped: {e}")  # socket closed at exit
+        finally:
+            for pending in self._pending.values():
+                pending.done.set()
+            self._wakeup_receiver.close()
+            self._wakeup_sender.close()
+
+    def _next_poll_timeout(self):
+        if not self._pending:
+            return self.poll_interval
+        next_retry = min(pending.sent_time + pending.timeout for pending in self._pending.values())
+        return min(self.poll_interval, max(0, int(1000 * (next_retry - time.monotonic())) + 1))
+
+    def _stats(self, instance_name):
+        if instance_name not in self.command_stats:
+            self.command_stats[instance_name] = {
+                "sent": 0,
+                "acknowledged": 0,
+                "retries": 0,
+                "failed": 0,
+                "latency": LatencyRecorder(size=256),
+            }
+        return self.command_stats[instance_name]
+
+    def _transmit(self, pending):
+        stats = self._stats(pending.instance_name)
+        if pending.attempts:
+            stats["retries"] += 1
+        else:
+            stats["sent"] += 1
+        pending.attempts += 1
+        pending.sent_time = time.monotonic()
+
+        message = dict(pending.message, id=pending.command_id)
+        try:
+            self.socket_wrapper.socket.send_multipart(
+                [
+                    pending.instance_name.encode(),
+                    encode_message(message, self.peer_codecs.get(pending.instance_name)),
+                ],
+                zmq.NOBLOCK,
+            )
+            self.socket_wrapper.messages_sent += 1
+        except zmq.ZMQError:
+            pass  # remote not connected (yet), re-sent on hello or after timeout
+
+    def _receive(self, identity, payload):
+        instance_name = identity.decode()
+        self.socket_wrapper.messages_received += 1
+        try:
+            message = decode_message(payload)
+        except ValueError:
+            logging.warning(f"Invalid message from {instance_name}: {payload[:100]}")
+            return
+
+        if instance_name not in self.peers:
+            logging.debug(f"Remote instance connected: {instance_name}")
+        self.peers[instance_name] = time.time()
+        self._peer_event.set()
+
+        if message.get("type") == HELLO:
+            self.peer_codecs[instance_name] = negotiate_codec(message.get("codecs"))
+            # Send waiting commands now instead of at their next retry
+            for pending in list(self._pending.values()):
+                if pending.instance_name == instance_name and not pending.received:
+                    self._transmit(pending)
+
+        elif message.get("type") == RECEIVED:
+            pending = self._pending.get(message.get("id"))
+            if pending is None or pending.received or pending.instance_name != instance_name:
+                return
+            self._stats(instance_name)["latency"].add(time.monotonic() - pending.sent_time)
+            pending.received = True
+            pending.sent_time = time.monotonic()
+            pending.timeout = self.handle_timeout
+
+        elif message.get("type") == ACK:
+            pending = self._pending.pop(message.get("id"), None)
+            if pending is None or pending.instance_name != instance_name:
+                return  # duplicate ack of a re-sent command
+
+            stats = self._stats(instance_name)
+            stats["acknowledged"] += 1
+            if not pending.received:
+                stats["latency"].add(time.monotonic() - pending.sent_time)
+            if not message.get("ok", True):
+                logging.warning(f"{instance_name} failed command {pending.message}: {message}")
+            pending.ack = message
+            pending.done.set()
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        for command_id, pending in list(self._pending.items()):
+            if now - pending.sent_time < pending.timeout:
+                continue
+            if pending.attempts <= pending.retries and not pending.received:
+                self._transmit(pending)
+                continue
+
+            self._stats(pending.instance_name)["failed"] += 1
+            logging.warning(
+                f"No ack from {pending.instance_name} for {pending.message} "
+                f"after {pending.attempts} attempts."
+            )
+            del self._pending[command_id]
+            pending.done.set()
+
+    def stats(self):
+        """Command counters and round-trip latency per remote instance."""
+        return {
+            instance_name: {
+                **{key: value for key, value in stats.items() if key != "latency"},
+                "connected": instance_name in self.peers,
+                "latency": stats["latency"].percentiles(),
+            }
+            for instance_name, stats in self.command_stats.items()
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class CommandReceiver:
+    """Remote side of the CommandRouter: handle and acknowledge commands from a DEALER socket.
+
+    Receipt of a command is confirmed at once, then `handler(message)` is called once per
+    command id (re-sent commands are only acknowledged again) and the command is
+    acknowledged when it returns (a dict returned by the handler is sent as `result` of the
+    ack). Use `receive` as recv callback of a SocketPoller, which then owns the socket.
+    A handler can return a `concurrent.futures.Future` to not block the poller: the command is
+    acknowledged with its result when done, sent from the poller thread with `call_soon`.
+    """
+
+    history_size = 64
+
+    def __init__(self, socket_wrapper=None, handler=None, call_soon=None):
+        """
+        :param socket_wrapper: connected SocketCommunication with pattern DEALER
+        :param handler: function called with the message dict of each command
+        :param call_soon: `SocketPoller.call_soon` of the poller owning the socket, without it
+            the receiver waits for futures returned by the handler
+        """
+        self.socket_wrapper = socket_wrapper
+        self.handler = handler
+        self.call_soon = call_soon
+        self._acks = OrderedDict()  # command id: ack
+        self._deferred = set()  # command ids of futures not done yet
+        self._codec = None  # of the last received command
+
+    def say_hello(self, **state):
+        """Announce to the router. Call before the SocketPoller takes over the socket."""
+        self._send(dict(state, type=HELLO))
+
+    def _send(self, message):
+        try:
+            self.socket_wrapper.socket.send(encode_message(message, self._codec), zmq.NOBLOCK)
+            self.socket_wrapper.messages_sent += 1
+        except zmq.Again:
+            logging.debug(f"Could not send {message.get('type')} to {self.socket_wrapper}")
+
+    def receive(self, message_parts):
+        self._codec = get_message_codec(message_parts[-1])  # reply in the same encoding
+        message = decode_message(message_parts[-1])
+        command_id = message.pop("id", None)
+
+        if command_id in self._acks:
+            self._send(self._acks[command_id])
+            return
+        if command_id is not None:
+            self._send({"type": RECEIVED, "id": command_id})
+            if command_id in self._deferred:
+                return
+
+        try:
+            result = self.handler(message)
+            if isinstance(result, Future):
+                if self.call_soon is not None:
+                    self._deferred.add(command_id)
+                    result.add_done_callback(partial(self._future_done, command_id, message))
+                    return
+                result = result.result()
+        except Exception as e:
+            self._acknowledge(command_id, message, error=e)
+            return
+        self._acknowledge(command_id, message, result=result)
+
+    def _future_done(self, command_id, message, future):
+        self.call_soon(partial(self._acknowledge_future, command_id, message, future))
+
+    def _acknowledge_future(self, command_id, message, future):
+        self._deferred.discard(command_id)
+        error = future.exception()
+        self._acknowledge(
+            command_id, message, result=future.result() if error is None else None, error=error
+        )
+
+    def _acknowledge(self, command_id, message, result=None, error=None):
+        ack = {"type": ACK, "id": command_id, "ok": error is None}
+        if error is not None:
+            logging.error(f"Command {message} failed: {error}")
+            ack["error"] = str(error)
+        elif isinstance(result, dict):
+            ack["result"] = result
+
+        if command_id is not None:
+            self._acks[command_id] = ack
+            while len(self._acks) > self.history_size:
+                self._acks.popitem(last=False)
+            self._send(ack)
@@ -1,6 +1,7 @@
 #
 # Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
 # License: BSD 3-Clause
+import atexit
 import json
 import logging
 import socket
@@ -8,9 +9,8 @@ from pathlib import Path
 
 from configobj import ConfigObj
 from validate import Validator
-from zmq.log.handlers import PUBHandler
 
-from rpi_camera_colony.log import log_level_name_to_value
+from rpi_camera_colony.log import LogBatchSender, log_level_name_to_value
 
 
 def load_config(config_path=None, config_spec_path=None, ignore_errors=True):
@@ -50,27 +50,33 @@ def load_config(config_path=None, config_spec_path=None, ignore_errors=True):
 
 
 def setup_logging_via_socket(
-    level="DEBUG", address_or_socket=None, root_topic="logging_root_topic"
+    level="DEBUG", address_or_socket=None, root_topic="logging_root_topic", **kwargs
 ):
-    logging_handler = PUBHandler(interface_or_socket=address_or_socket)
+    """Send log records in batches over the PUB socket `address_or_socket`.
+
+    Log calls format and queue the record, a LogBatchSender thread batches and sends them.
+    Returns the sender, kwargs are passed to it (e.g. queue_size, max_batch_rate).
+    """
     formatter = logging.Formatter(
         "%(asctime)s.%(msecs)03d - %(levelname)s"
         " - %(processName)s %(filename)s:%(lineno)s"
         " - %(message)s"
     )
     formatter.datefmt = "%Y-%m-%d %H:%M:%S"
-    logging_handler.setFormatter(formatter)
-    logging_handler.root_topic = str(
-        root_topic
-    )  # ARM pyzmq version doesn't have root_topic as init argument
+    sender = LogBatchSender(
+        socket=address_or_socket, root_topic=str(root_topic), formatter=formatter, **kwargs
+    )
+    sender.start()
+    # Send the last records before the shared ZMQ context closes the socket at exit
+    atexit.register(sender.handler.close)
 
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, level))
-    logger.addHandler(logging_handler)
+    logger.addHandler(sender.handler)
     logging.info(
-        f"Logging initialised for {address_or_socket} "
-        f"with topic {root_topic} and level {level}."
+        f"Logging initialised for {address_or_socket} with topic {root_topic} and level {level}."
     )
+    return sender
 
 
 def get_local_ip_address():
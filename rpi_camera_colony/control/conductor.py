@@ -4,19 +4,34 @@
 import argparse
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import pandas as pd
+
 from rpi_camera_colony.acquisition.remote_control import (
     RemoteAcquisitionControl,
 )
+from rpi_camera_colony.clock import summarise_start_offsets
+from rpi_camera_colony.command_channel import CommandRouter
 from rpi_camera_colony.config.config import load_config
+from rpi_camera_colony.control.presence import PresenceTracker
+from rpi_camera_colony.control.relay import StreamRelay
+from rpi_camera_colony.control.snapshots import (
+    SnapshotFetcher,
+    get_snapshot_urls,
+    get_stream_urls,
+    save_contact_sheet,
+)
 from rpi_camera_colony.files import close_file_safe, get_datestr
-from rpi_camera_colony.log import log_level_name_to_value
+from rpi_camera_colony.log import LOG_BATCH_TOPIC, log_level_name_to_value, unpack_log_batch
 from rpi_camera_colony.network_communication import (
-    ListenerStream,
     SocketCommunication,
+    SocketPoller,
     find_available_port,
+    zmq_context,
 )
+from rpi_camera_colony.serialization import decode_message
 
 
 def parse_args_for_conductor():
@@ -87,8 +102,16 @@ class Conductor:
     _log_file = None
 
     _control_socket = None
+    command_router = None
     _comms_stream = None
 
+    presence = None  # heartbeat state per camera
+    frame_stats = None  # latest frame statistics per camera
+    camera_states = None  # latest telemetry per camera
+    start_summary = None  # start offsets & skew of the last scheduled start
+    snapshot_fetcher = None
+    stream_relay = None
+
     __cleaned_up = False
 
     def __init__(
@@ -101,8 +124,7 @@ class Conductor:
         logging_stream_callback=None,
         auto_init=False,
         auto_init_remote=True,
-        delay_for_networking=4,
-        delay_for_remote_instance=6,
+        ready_timeout=30,
         run_for_calibration=False,
         debug=False,
         **kwargs,
@@ -112,6 +134,10 @@ class Conductor:
 
         self.config_file = config_file
         self._load_config()
+        self.frame_stats = {}
+        self.camera_states = {}
+        self.remote_log_stats = {}
+        self.snapshot_fetcher = SnapshotFetcher()
 
         self.debug = debug
         self._log_level = "DEBUG" if self.debug else self.config_data["log"]["level"]
@@ -156,13 +182,17 @@ class Conductor:
         self._log_to_console = self.config_data["log"].get("log_to_console")
 
         # Execute main components
+        self.presence = PresenceTracker(
+            timeout=self.config_data["control"].get("heartbeat_timeout")
+        )
+        self.presence.start()
         self._open_network_comms()
-        logging.info(f"Waiting {delay_for_networking}s for networking to come up..")
-        time.sleep(delay_for_networking)
 
         self._make_acquisition_controllers(auto_init=auto_init_remote)
-        logging.info(f"Waiting {delay_for_remote_instance}s for remote instance to listen..")
-        time.sleep(delay_for_remote_instance)
+        self.wait_until_ready(timeout=ready_timeout)
+
+        if self.config_data.get("relay", {}).get("enabled"):
+            self.start_stream_relay()
 
     def __enter__(self):
         return self
@@ -177,6 +207,8 @@ class Conductor:
         self.config_data = load_config(config_path=self.config_file)
 
     def _open_network_comms(self):
+        zmq_context.configure(io_threads=self.config_data["control"].get("io_threads"))
+
         # Find available socket ports
         start_port = int(self.config_data["log"].get("port"))
         address = self.config_data["log"].get("address")
@@ -197,20 +229,23 @@ class Conductor:
             bind=True,
             auto_open=True,
         )
-        # Control
+        # Control: acknowledged commands to each remote instance
         self._control_socket = SocketCommunication(
             address=self.config_data["control"].get("address"),
             port=self.config_data["control"].get("port"),
-            pattern="PUB",
+            pattern="ROUTER",
             bind=True,
             auto_open=True,
         )
-        # Stream ioloop
-        self._comms_stream = ListenerStream(
-            socket_dict={
-                "logging": self._logging_socket.socket,
-                "control": self._control_socket.socket,
-            },
+        self.command_router = CommandRouter(
+            socket_wrapper=self._control_socket,
+            ack_timeout=self.config_data["control"].get("ack_timeout"),
+            retries=self.config_data["control"].get("command_retries"),
+        )
+        self.command_router.start()
+        # Receive loop. The control socket is owned by the command router
+        self._comms_stream = SocketPoller(
+            socket_dict={"logging": self._logging_socket.socket},
             recv_callback_dict=self._callback_receiver,
         )
         self._comms_stream.start()
@@ -222,9 +257,49 @@ class Conductor:
             logging.info(f"Logging remote messages to: {self._log_file.name}")
 
     def _callback_receiver(self, message=None):
-        topic, message = [m.decode() for m in message]
-        instance_name, log_level_on_remote = topic.split(".")
+        topic, message = message
+        instance_name, log_level_on_remote = topic.decode().rsplit(".", 1)
+
+        # Status topics, published on one status socket per remote instance
+        status_handler = {
+            "FRAMESTATS": self._update_frame_stats,
+            "TELEMETRY": self._update_camera_state,
+            "HEARTBEAT": self.presence.update,
+        }.get(log_level_on_remote)
+        if status_handler is not None:
+            status_handler(instance_name, decode_message(message))
+            return
+        elif log_level_on_remote == LOG_BATCH_TOPIC:
+            self._receive_log_batch(instance_name=instance_name, data=message)
+            return
+
+        self._handle_log_message(
+            instance_name=instance_name, level_name=log_level_on_remote, message=message.decode()
+        )
 
+    def _receive_log_batch(self, instance_name=None, data=None):
+        records, dropped = unpack_log_batch(data)
+        stats = self.remote_log_stats.setdefault(
+            instance_name, {"batches": 0, "records": 0, "bytes": 0, "dropped": 0}
+        )
+        if dropped > stats["dropped"]:
+            logging.warning(
+                f"{instance_name}: {dropped - stats['dropped']} log record(s) dropped on remote "
+                f"(total: {dropped})"
+            )
+        stats.update(
+            batches=stats["batches"] + 1,
+            records=stats["records"] + len(records),
+            bytes=stats["bytes"] + len(data),
+            dropped=dropped,
+        )
+
+        for level_name, message in records:
+            self._handle_log_message(
+                instance_name=instance_name, level_name=level_name, message=message
+            )
+
+    def _handle_log_message(self, instance_name=None, level_name=None, message=None):
         # FIXME: Why is ARM logger not formatted correctly ?
         #  Missing timestamps and dash separators.
         try:
@@ -240,7 +315,7 @@ class Conductor:
         except BaseException:
             out_string = message
 
-        message_level = log_level_name_to_value(name=log_level_on_remote)
+        message_level = log_level_name_to_value(name=level_name)
         target_level = log_level_name_to_value(name=self._log_level)
         if self._log_to_console and message_level >= target_level:
             logging.info(out_string)
@@ -248,6 +323,121 @@ class Conductor:
         if self._log_to_file is not None and self._log_to_file and self._log_file is not None:
             self._write_to_log(out_string)
 
+    def _update_frame_stats(self, instance_name=None, stats=None):
+        previous = self.frame_stats.get(instance_name, {})
+        new_dropped = stats["dropped_frames"] - previous.get("dropped_frames", 0)
+        if new_dropped > 0:
+            logging.warning(
+                f"{instance_name}: {new_dropped} dropped frame(s) since last report "
+                f"(total: {stats['dropped_frames']} of {stats['frame_count']} frames, "
+                f"late: {stats['late_frames']})"
+            )
+        self.frame_stats[instance_name] = stats
+
+    def _update_camera_state(self, instance_name=None, telemetry=None):
+        telemetry["received"] = time.time()
+        self.camera_states[instance_name] = telemetry
+
+    def wait_until_ready(self, timeout=30):
+        """Wait until all cameras are ready to record and connected for commands.
+
+        Returns the names of cameras that are not ready after `timeout` seconds.
+        """
+        logging.info(f"Waiting up to {timeout}s for remote instances..")
+        start = time.monotonic()
+        missing = self.presence.wait_until_ready(
+            instance_names=list(self._acquisition_controllers),
+            timeout=timeout,
+            condition=lambda instance_name: instance_name in self.command_router.peers,
+        )
+        if missing:
+            states = {name: self.presence.heartbeats.get(name, {}).get("state") for name in missing}
+            logging.warning(f"Remote instances not ready: {states}")
+        else:
+            logging.info(f"All remote instances ready after {time.monotonic() - start:.1f}s.")
+        return missing
+
+    def get_presence(self):
+        """Heartbeat state, age and stale flag of each camera."""
+        return self.presence.summary()
+
+    def get_camera_state_table(self):
+        """Latest telemetry of all cameras as one row per camera.
+
+        `age` is the time in seconds since the last telemetry message of that camera.
+        """
+        now = time.time()
+        rows = {}
+        for instance_name, state in self.camera_states.items():
+            latency = state.get("callback_latency") or {}
+            rows[instance_name] = {
+                "recording": state.get("recording"),
+                "fps": state.get("fps"),
+                "frame_count": state.get("frame_count"),
+                "ttl_count": state.get("ttl_count"),
+                "ttl_in_count": (state.get("ttl_in") or {}).get("recorded"),
+                "dropped_frames": self.frame_stats.get(instance_name, {}).get("dropped_frames"),
+                "callback_p99_ms": latency.get("p99_ms"),
+                "bytes_written": state.get("bytes_written"),
+                "disk_free_gb": (state.get("disk_free_bytes") or 0) / 1e9,
+                "cpu_temperature": state.get("cpu_temperature"),
+                "load_1min": (state.get("load_average") or [None])[0],
+                "age": now - state["received"],
+            }
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def get_receive_stats(self, reset=False):
+        """Messages, bytes, receive rate and callback latency of each receiving socket.
+
+        The rate is averaged since the start or the last call with `reset`.
+        """
+        if self._comms_stream is None:
+            return {}
+        return self._comms_stream.stats(reset=reset)
+
+    def get_remote_log_stats(self):
+        """Log batches, records, compressed bytes and dropped records of each camera."""
+        return {name: dict(stats) for name, stats in self.remote_log_stats.items()}
+
+    def get_snapshots(self):
+        """Latest stream frame (JPEG bytes, None if unavailable) of all streaming cameras.
+
+        Fetched from the `/snapshot.jpg` endpoints of all cameras concurrently.
+        """
+        return self.snapshot_fetcher.fetch_all(urls=get_snapshot_urls(self.config_data))
+
+    def save_contact_sheet(self, path=None, columns=None):
+        """Save snapshots of all streaming cameras tiled in one sheet, see `get_snapshots`.
+
+        :param path: .html page, or .jpg/.png image (requires Pillow)
+        """
+        return save_contact_sheet(snapshots=self.get_snapshots(), path=path, columns=columns)
+
+    def start_stream_relay(self):
+        """Receive each camera stream once and re-serve all of them (and a mosaic) from here.
+
+        Streams are at http://[relay address]:[relay port]/[instance_name]/ and /mosaic/.
+        """
+        if self.stream_relay is not None:
+            return
+
+        relay_settings = self.config_data.get("relay", {})
+        self.stream_relay = StreamRelay(
+            stream_urls=get_stream_urls(self.config_data),
+            address=relay_settings.get("address", StreamRelay.address),
+            port=relay_settings.get("port", StreamRelay.port),
+            mosaic_framerate=relay_settings.get("mosaic_framerate", StreamRelay.mosaic_framerate),
+            mosaic_tile_size=relay_settings.get("mosaic_tile_size", StreamRelay.mosaic_tile_size),
+            mosaic_columns=relay_settings.get("mosaic_columns", StreamRelay.mosaic_columns),
+            mosaic_quality=relay_settings.get("mosaic_quality", StreamRelay.mosaic_quality),
+        )
+        self.stream_relay.start()
+
+    def stop_stream_relay(self):
+        if self.stream_relay is not None:
+            self.stream_relay.stop()
+            self.stream_relay = None
+
     def _write_to_log(self, out_string):
         if not self._log_file.closed:
             self._log_file.write(f"{out_string}\n")
@@ -261,28 +451,74 @@ class Conductor:
             self._acquisition_controllers[instance_name] = RemoteAcquisitionControl(
                 instance_name=instance_name,
                 config_data=self.config_data,
-                control_socket_wrapper=self._control_socket,
-                auto_init=auto_init,
+                command_router=self.command_router,
+                auto_init=False,
             )
+        if auto_init:
+            self.initialise_acquisition_conductors()
 
     def initialise_acquisition_conductors(self):
         """Start up remote acquisition
         & transmit config_data in preparation for acquisition.
         """
-        for _, acq in self._acquisition_controllers.items():
-            acq.initialise()
+        # Concurrently, each launch waits for ssh
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(lambda acq: acq.initialise(), self._acquisition_controllers.values()))
+
+    def _command_all(self, command):
+        """Send to all remote instances at once and wait for all acks."""
+        pending = [command(acq) for acq in self._acquisition_controllers.values()]
+        acks = self.command_router.wait_all([p for p in pending if p is not None])
+        failed = [name for name, ack in acks.items() if not (ack and ack.get("ok"))]
+        if failed:
+            logging.warning(f"Command not acknowledged by: {failed}")
+        return acks
+
+    def start_acquisition(self, start_lead_time=None):
+        """Start acquisition on all cameras at the same wall-clock time.
+
+        Once all remote instances acknowledged their settings and reset, the start is
+        scheduled `start_lead_time` seconds ahead. The start offsets reported by the cameras
+        are summarised in `start_summary` and sent to the cameras for their metadata.
+        """
+        start_lead_time = start_lead_time or self.config_data["control"].get("start_lead_time")
+        self._command_all(lambda acq: acq.transmit_settings(wait=False))
+        self._command_all(lambda acq: acq.send_status("reset", wait=False))
 
-    def start_acquisition(self):
-        """Start acquisition."""
-        for _, acq in self._acquisition_controllers.items():
-            acq.transmit_settings()
+        start_at = time.time() + start_lead_time
+        acks = self._command_all(
+            lambda acq: acq.send_status("start", wait=False, start_at=start_at)
+        )
+        self.acquiring = True
 
-        time.sleep(1)  # Essential delay to give remote time to process settings
+        self.start_summary = summarise_start_offsets(
+            start_at=start_at,
+            offsets={
+                name: ((ack or {}).get("result") or {}).get("start_offset")
+                for name, ack in acks.items()
+            },
+        )
+        if "skew" in self.start_summary:
+            logging.info(
+                f"Start skew: {1e3 * self.start_summary['skew']:.3f}ms "
+                f"(latest: {self.start_summary['last']}, "
+                f"{1e3 * self.start_summary['max_offset']:.3f}ms after scheduled start)"
+            )
+        if self.start_summary["missing"]:
+            logging.warning(f"No start offset from: {self.start_summary['missing']}")
+        self._command_all(
+            lambda acq: acq.send_command(
+                cmd_type="metadata", message_dict={"start_skew": self.start_summary}, wait=False
+            )
+        )
 
-        for _, acq in self._acquisition_controllers.items():
-            acq.start_acquisition()
+    def trigger_clips(self):
+        """Save a clip on all cameras recording in triggered mode."""
+        self._command_all(lambda acq: acq.send_status("trigger", wait=False))
 
-        self.acquiring = True
+    def get_command_stats(self):
+        """Command counters and round-trip latency of each remote instance."""
+        return self.command_router.stats()
 
     def stop_acquisition(self):
         """Stop acquisition."""
@@ -294,8 +530,7 @@ class Conductor:
             logging.info("")
             return
 
-        for _, acq in self._acquisition_controllers.items():
-            acq.stop_acquisition()
+        self._command_all(lambda acq: acq.send_status("stop", wait=False))
 
         self.acquiring = False
 
@@ -313,10 +548,15 @@ class Conductor:
         for _, acq in self._acquisition_controllers.items():
             acq.cleanup()
 
+        self.stop_stream_relay()
+
         self._acquisition_controllers = []
+        if self.command_router is not None:
+            self.command_router.stop()
+        if self.presence is not None:
+            self.presence.stop()
         if self._comms_stream is not None:
             self._comms_stream.stop()
-            time.sleep(0.5)
             self._comms_stream = None
 
         self._logging_socket.close()
@@ -0,0 +1,113 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import logging
+import time
+from threading import Condition, Event, Thread
+
+# Heartbeat states of an acquisition instance, in startup order
+BOOTED = "booted"  # process running, camera not open yet
+CAMERA_WARMED = "camera_warmed"  # camera open
+PREVIEW_DONE = "preview_done"  # exposure & white balance fixed, ready to record
+RECORDING = "recording"
+STOPPED = "stopped"  # recording stopped, ready to record again
+CLOSING = "closing"
+
+READY_STATES = (PREVIEW_DONE, STOPPED)
+
+
+class PresenceTracker(Thread):
+    """Track the heartbeats of all acquisition instances.
+
+    `update` is called with each received heartbeat, `wait_until_ready` blocks until all
+    instances are ready to record (or timeout). The thread checks every `check_interval`
+    seconds for instances whose heartbeat is older than `timeout` and warns once per
+    instance that went stale while recording.
+    """
+
+    daemon = True
+
+    timeout = 3.0  # seconds without heartbeat until an instance is stale
+    check_interval = 0.5
+
+    def __init__(self, timeout=None, check_interval=None):
+        super().__init__()
+
+        self.timeout = timeout or self.timeout
+        self.check_interval = check_interval or self.check_interval
+        self.heartbeats = {}  # instance name: latest heartbeat with receive time
+        self.stale = set()
+        self._condition = Condition()
+        self._stop_event = Event()
+
+    def update(self, instance_name=None, heartbeat=None):
+        heartbeat["received"] = time.monotonic()
+        with self._condition:
+            previous = self.heartbeats.get(instance_name, {})
+            self.heartbeats[instance_name] = heartbeat
+            self._condition.notify_all()
+
+        if heartbeat.get("state") != previous.get("state"):
+            logging.debug(f"{instance_name}: {previous.get('state')} > {heartbeat.get('state')}")
+        if instance_name in self.stale:
+            self.stale.discard(instance_name)
+            logging.info(f"{instance_name}: heartbeat recovered.")
+
+    def is_ready(self, instance_name=None):
+        return self.heartbeats.get(instance_name, {}).get("state") in READY_STATES
+
+    def wait_until_ready(self, instance_names=None, timeout=None, condition=None):
+        """Wait until all instances are ready. Returns the names of instances not ready.
+
+        :param condition: optional function of the instance name that must also be true
+        """
+        condition = condition or (lambda instance_name: True)
+        end = time.monotonic() + (timeout or 0)
+
+        def not_ready():
+            return [
+                name for name in instance_names if not (self.is_ready(name) and condition(name))
+            ]
+
+        with self._condition:
+            missing = not_ready()
+            while missing and time.monotonic() < end:
+                self._condition.wait(min(0.1, max(0.0, end - time.monotonic())))
+                missing = not_ready()
+        return missing
+
+    def run(self):
+        while not self._stop_event.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        """Warn about instances that stopped sending heartbeats while recording."""
+        now = time.monotonic()
+        for instance_name, heartbeat in list(self.heartbeats.items()):
+            if instance_name in self.stale or now - heartbeat["received"] < self.timeout:
+                continue
+            self.stale.add(instance_name)
+            if heartbeat.get("state") == RECORDING:
+                logging.warning(
+                    f"{instance_name}: no heartbeat for {now - heartbeat['received']:.1f}s "
+                    f"while recording."
+                )
+            else:
+                logging.debug(f"{instance_name}: heartbeat stale in state {heartbeat.get('state')}")
+
+    def summary(self):
+        """State, heartbeat age (seconds) and stale flag per instance."""
+        now = time.monotonic()
+        return {
+            instance_name: {
+                "state": heartbeat.get("state"),
+                "age": now - heartbeat["received"],
+                "stale": instance_name in self.stale,
+            }
+            for instance_name, heartbeat in self.heartbeats.items()
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
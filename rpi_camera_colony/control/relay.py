@@ -0,0 +1,232 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import io
+import logging
+import math
+import time
+import urllib.request
+from threading import Event, Thread
+
+import numpy as np
+
+from rpi_camera_colony.acquisition.streaming import AsyncStreamingServer, StreamingOutput
+
+MOSAIC_STREAM_NAME = "mosaic"
+
+
+class MJPEGStreamReceiver(Thread):
+    """Receive the MJPEG stream of one camera into a StreamingOutput.
+
+    Reconnects every `reconnect_interval` seconds while the camera is not streaming.
+    """
+
+    daemon = True
+
+    reconnect_interval = 2.0
+    timeout = 5.0
+
+    def __init__(self, url=None, output=None, reconnect_interval=None):
+        super().__init__()
+
+        self.url = url
+        self.output = output or StreamingOutput()
+        self.reconnect_interval = reconnect_interval or self.reconnect_interval
+        self.connected = False
+        self.frames_received = 0
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                    self.connected = True
+                    logging.debug(f"Relay connected to {self.url}")
+                    self._receive_frames(response)
+            except (OSError, ValueError) as e:
+                if self.connected:
+                    logging.debug(f"Relay lost {self.url}: {e}")
+            self.connected = False
+            self._stop_event.wait(self.reconnect_interval)
+
+    def _receive_frames(self, response):
+        content_length = None
+        while not self._stop_event.is_set():
+            line = response.readline()
+            if not line:
+                return  # stream ended
+
+            line = line.strip()
+            if line.lower().startswith(b"content-length:"):
+                content_length = int(line.split(b":", 1)[1])
+            elif not line and content_length is not None:
+                # End of part headers
+                self.output.write(response.read(content_length))
+                self.frames_received += 1
+                content_length = None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class MosaicCompositor(Thread):
+    """Composite the latest frames of many StreamingOutputs into one downscaled mosaic stream.
+
+    Frames are decoded at reduced size (JPEG draft mode) into one tile array, which is
+    rearranged into the mosaic image in one NumPy operation and encoded `framerate` times
+    per second, if any tile changed. Requires Pillow.
+    """
+
+    daemon = True
+
+    framerate = 2.0
+    tile_size = (320, 240)
+    columns = 0  # 0 for a square grid
+    quality = 75
+
+    def __init__(
+        self, outputs=None, output=None, framerate=None, tile_size=None, columns=None, quality=None
+    ):
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            raise ImportError("The mosaic stream requires Pillow.")
+        super().__init__()
+
+        self._image = Image
+        self._draw = ImageDraw
+        self.outputs = outputs
+        self.output = output or StreamingOutput()
+        self.framerate = framerate or self.framerate
+        self.tile_size = tuple(tile_size or self.tile_size)
+        self.columns = columns or self.columns or math.ceil(math.sqrt(len(outputs) or 1))
+        self.quality = quality or self.quality
+        self.rows = math.ceil(len(outputs) / self.columns)
+
+        width, height = self.tile_size
+        self.tiles = np.zeros((self.rows * self.columns, height, width, 3), dtype=np.uint8)
+        self._tile_generations = [0] * len(outputs)
+        self._stop_event = Event()
+
+    def _decode_tile(self, name, jpeg):
+        image = self._image.open(io.BytesIO(jpeg))
+        image.draft("RGB", self.tile_size)  # decode at reduced size
+        image = image.convert("RGB").resize(self.tile_size)
+        self._draw.Draw(image).text((4, 4), name)
+        return np.asarray(image)
+
+    def update_tiles(self):
+        """Decode the tiles with new frames. Returns the number of updated tiles."""
+        updated = 0
+        for i, (name, output) in enumerate(self.outputs.items()):
+            generation = output.generation
+            if generation == self._tile_generations[i]:
+                continue
+
+            frame = output.get_frame(generation)
+            if frame is None:
+                continue
+            jpeg = bytes(frame)
+            if not output.frame_valid(generation):
+                continue  # overwritten while copying
+
+            try:
+                self.tiles[i] = self._decode_tile(name, jpeg)
+            except (OSError, ValueError) as e:
+                logging.debug(f"Could not decode frame of {name}: {e}")
+            self._tile_generations[i] = generation
+            updated += 1
+        return updated
+
+    def compose(self):
+        """Mosaic image array (rows * tile height, columns * tile width, 3)."""
+        width, height = self.tile_size
+        return (
+            self.tiles.reshape(self.rows, self.columns, height, width, 3)
+            .swapaxes(1, 2)
+            .reshape(self.rows * height, self.columns * width, 3)
+        )
+
+    def encode(self):
+        jpeg = io.BytesIO()
+        self._image.fromarray(self.compose()).save(jpeg, format="JPEG", quality=self.quality)
+        return jpeg.getvalue()
+
+    def run(self):
+        interval = 1.0 / self.framerate
+        next_time = time.monotonic()
+        while not self._stop_event.wait(max(0.0, next_time - time.monotonic())):
+            next_time += interval
+            if self.update_tiles() or not self.output.generation:
+                self.output.write(self.encode())
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class StreamRelay:
+    """Relay the streams of all cameras from one server on the Conductor.
+
+    Each camera stream is received once and served at `/[instance_name]/`, the mosaic of all
+    cameras at `/mosaic/` (if `mosaic_framerate` > 0 and Pillow is installed).
+    """
+
+    address = ""
+    port = 8000
+    mosaic_framerate = 2.0
+    mosaic_tile_size = (320, 240)
+    mosaic_columns = 0
+    mosaic_quality = 75
+
+    def __init__(self, stream_urls=None, **kwargs):
+        """
+        :param stream_urls: dict of camera stream URLs by instance name
+        """
+        for attr, value in kwargs.items():
+            if hasattr(self, attr):
+                setattr(self, attr, value)
+
+        self.receivers = {
+            name: MJPEGStreamReceiver(url=url) for name, url in (stream_urls or {}).items()
+        }
+        outputs = {name: receiver.output for name, receiver in self.receivers.items()}
+
+        self.compositor = None
+        if self.mosaic_framerate and outputs:
+            try:
+                self.compositor = MosaicCompositor(
+                    outputs=dict(outputs),
+                    framerate=self.mosaic_framerate,
+                    tile_size=self.mosaic_tile_size,
+                    columns=self.mosaic_columns,
+                    quality=self.mosaic_quality,
+                )
+                outputs[MOSAIC_STREAM_NAME] = self.compositor.output
+            except ImportError as e:
+                logging.warning(f"Relay without mosaic: {e}")
+
+        self.server = AsyncStreamingServer(address=self.address, port=self.port, outputs=outputs)
+
+    def start(self):
+        for receiver in self.receivers.values():
+            receiver.start()
+        if self.compositor is not None:
+            self.compositor.start()
+        self.server.start()
+        logging.info(f"Relaying {len(self.receivers)} camera streams on port {self.server.port}")
+
+    def stop(self):
+        for receiver in self.receivers.values():
+            receiver.stop()
+        if self.compositor is not None:
+            self.compositor.stop()
+        self.server.shutdown()
+
+    def stats(self):
+        return {
+            "cameras": {
+                name: {"connected": receiver.connected, "frames": receiver.frames_received}
+                for name, receiver in self.receivers.items()
+            },
+            **self.server.stats(),
+        }
@@ -0,0 +1,130 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import base64
+import html
+import io
+import logging
+import math
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+IMAGE_SUFFIXES = [".jpg", ".jpeg", ".png"]
+
+
+def get_stream_urls(config_data=None, path="/"):
+    """URL of `path` on the stream server of each streaming controller, by instance name."""
+    urls = {}
+    for instance_name, settings in config_data["controllers"].items():
+        if not settings.get("stream_video"):
+            continue
+        address = settings.get("stream_address") or settings.get("address")
+        urls[instance_name] = f"http://{address}:{settings['stream_port']}{path}"
+    return urls
+
+
+def get_snapshot_urls(config_data=None):
+    """Snapshot URL of each streaming controller in the config, by instance name."""
+    return get_stream_urls(config_data=config_data, path="/snapshot.jpg")
+
+
+class SnapshotFetcher:
+    """Fetch the latest stream frame of many cameras concurrently.
+
+    Snapshots are cached with their ETag, so that unchanged frames are not sent again.
+    A camera that does not respond in `timeout` seconds gets a None snapshot.
+    """
+
+    timeout = 2.0
+    max_workers = 32
+
+    def __init__(self, timeout=None, max_workers=None):
+        self.timeout = timeout or self.timeout
+        self.max_workers = max_workers or self.max_workers
+        self._cache = {}  # url: (etag, jpeg)
+
+    def fetch(self, url):
+        request = urllib.request.Request(url)
+        etag, cached_jpeg = self._cache.get(url, (None, None))
+        if etag is not None:
+            request.add_header("If-None-Match", etag)
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                jpeg = response.read()
+                self._cache[url] = (response.headers.get("ETag"), jpeg)
+                return jpeg
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return cached_jpeg
+            logging.warning(f"Snapshot from {url} failed: HTTP {e.code}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Snapshot from {url} failed: {e}")
+        return None
+
+    def fetch_all(self, urls=None):
+        """JPEG bytes (or None) for each name in the `urls` dict."""
+        if not urls:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            futures = {name: executor.submit(self.fetch, url) for name, url in urls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def make_contact_sheet_html(snapshots=None, columns=None, tile_width=320):
+    """HTML page with the snapshots in a grid, images embedded. Needs no image library."""
+    columns = columns or math.ceil(math.sqrt(len(snapshots) or 1))
+    tiles = []
+    for name, jpeg in snapshots.items():
+        if jpeg is None:
+            image = f'<div style="width:{tile_width}px">no snapshot</div>'
+        else:
+            data = base64.b64encode(jpeg).decode()
+            image = f'<img src="data:image/jpeg;base64,{data}" width="{tile_width}">'
+        tiles.append(f"<figure>{image}<figcaption>{html.escape(name)}</figcaption></figure>")
+
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Contact sheet</title></head>"
+        f"<body><div style='display:grid;grid-template-columns:repeat({columns},auto)'>"
+        + "".join(tiles)
+        + "</div></body></html>"
+    )
+
+
+def make_contact_sheet_image(snapshots=None, columns=None, tile_size=(320, 240)):
+    """Snapshots tiled into one PIL image with camera names. Requires Pillow."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        raise ImportError("Contact sheet images require Pillow. Save as .html instead.")
+
+    columns = columns or math.ceil(math.sqrt(len(snapshots) or 1))
+    rows = math.ceil(len(snapshots) / columns)
+    tile_width, tile_height = tile_size
+    sheet = Image.new("RGB", (columns * tile_width, rows * tile_height))
+    draw = ImageDraw.Draw(sheet)
+
+    for i, (name, jpeg) in enumerate(snapshots.items()):
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        if jpeg is not None:
+            try:
+                tile = Image.open(io.BytesIO(jpeg)).convert("RGB")
+                tile.thumbnail(tile_size)
+                sheet.paste(tile, (x, y))
+            except OSError as e:
+                logging.warning(f"Could not decode snapshot of {name}: {e}")
+        draw.text((x + 4, y + 4), name if jpeg is not None else f"{name}: no snapshot")
+    return sheet
+
+
+def save_contact_sheet(snapshots=None, path=None, columns=None):
+    """Save as image (.jpg/.png, requires Pillow) or as HTML page (any other suffix)."""
+    path = Path(path)
+    if path.suffix.lower() in IMAGE_SUFFIXES:
+        make_contact_sheet_image(snapshots=snapshots, columns=columns).save(str(path))
+    else:
+        path.write_text(make_contact_sheet_html(snapshots=snapshots, columns=columns))
+    return path
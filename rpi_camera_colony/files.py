@@ -1,21 +1,52 @@
 #
 # Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
 # License: BSD 3-Clause
+import json
 import logging
 import os
+import struct
 from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+TIMESTAMP_FIELDS = {
+    "ttl.out": [
+        ("timestamp_frame", "<i8"),
+        ("timestamp_ttl", "<i8"),
+        ("sys_time", "<f8"),
+    ],
+    "ttl.in": [
+        ("timestamp_frame", "<i8"),
+        ("sys_time", "<f8"),
+    ],
+}
+
+# Binary timestamp file: fixed size header followed by append-only rows of a structured dtype
+# Header: magic (8 bytes), version (uint32), header size (uint32), JSON field spec (space padded)
+BINARY_TIMESTAMP_MAGIC = b"RCCTSBIN"
+BINARY_TIMESTAMP_VERSION = 1
+BINARY_TIMESTAMP_HEADER_SIZE = 256
 
 
 def get_datestr():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
-def make_recording_file_names(path=None, package_id="rcc", ext_sep=".", video_ext="h264"):
+def make_recording_file_names(
+    path=None, package_id="rcc", ext_sep=".", video_ext="h264", segment_index=None, dt=None
+):
+    """Recording file names [base].[dt].rcc.[name].
+
+    With `segment_index`, video and timestamp files are named per segment,
+    e.g. [base].[dt].rcc.segment_0001.video.h264, while metadata and index files are shared.
+    """
     # basepath, _ = os.path.splitext(str(path))
     basepath = str(path)
-    dt = get_datestr()
+    dt = dt or get_datestr()
     name_ttl_out = ".".join(["timestamps", "ttl", "out"])
     name_ttl_in = ".".join(["timestamps", "ttl", "in"])
+    segment = [] if segment_index is None else [f"segment_{segment_index:04d}"]
 
     return {
         "video": ext_sep.join(
@@ -23,13 +54,34 @@ def make_recording_file_names(path=None, package_id="rcc", ext_sep=".", video_ex
                 basepath,
                 dt,
                 package_id,
+                *segment,
                 "video",
                 str(video_ext).replace(".", ""),
             ]
         ),
-        "ttl.out": ext_sep.join([basepath, dt, package_id, name_ttl_out, "csv"]),
-        "ttl.in": ext_sep.join([basepath, dt, package_id, name_ttl_in, "csv"]),
+        "ttl.out": ext_sep.join([basepath, dt, package_id, *segment, name_ttl_out, "csv"]),
+        "ttl.in": ext_sep.join([basepath, dt, package_id, *segment, name_ttl_in, "csv"]),
+        "ttl.out.bin": ext_sep.join([basepath, dt, package_id, *segment, name_ttl_out, "bin"]),
+        "ttl.in.bin": ext_sep.join([basepath, dt, package_id, *segment, name_ttl_in, "bin"]),
         "metadata": ext_sep.join([basepath, dt, package_id, "metadata", "json"]),
+        "clips": ext_sep.join([basepath, dt, package_id, "clips", "csv"]),
+        "segments": ext_sep.join([basepath, dt, package_id, "segments", "csv"]),
+        "clock": ext_sep.join([basepath, dt, package_id, "clock", "csv"]),
+    }
+
+
+def make_clip_file_names(recording_files=None, clip_index=0, package_id="rcc", ext_sep="."):
+    """Clip file names derived from the recording's video file name, e.g.
+    [base].[dt].rcc.clip_0001.video.h264 and [base].[dt].rcc.clip_0001.timestamps.csv
+    """
+    namespace = ext_sep + package_id + ext_sep
+    video_file = str(recording_files["video"])
+    base, video_name = video_file.split(namespace, 1)
+    clip_base = namespace.join([base, f"clip_{clip_index:04d}"])
+
+    return {
+        "video": ext_sep.join([clip_base, video_name]),
+        "timestamps": ext_sep.join([clip_base, "timestamps", "csv"]),
     }
 
 
@@ -51,6 +103,51 @@ def close_file_safe(file_handle):
         logging.debug(f"FAILED TO CLOSE FILE:{name}")
 
 
+def write_binary_timestamp_header(file_handle, fields):
+    spec = json.dumps({"fields": [list(f) for f in fields]}).encode("utf-8")
+    header = BINARY_TIMESTAMP_MAGIC + struct.pack(
+        "<II", BINARY_TIMESTAMP_VERSION, BINARY_TIMESTAMP_HEADER_SIZE
+    )
+    if len(header) + len(spec) > BINARY_TIMESTAMP_HEADER_SIZE:
+        raise ValueError(f"Field spec too long for binary timestamp header: {fields}")
+
+    file_handle.write(header + spec.ljust(BINARY_TIMESTAMP_HEADER_SIZE - len(header), b" "))
+
+
+def read_binary_timestamp_header(path):
+    """Return (numpy dtype, header size) of a binary timestamp file."""
+    with Path(path).open("rb") as f:
+        header = f.read(16)
+        if len(header) < 16 or header[:8] != BINARY_TIMESTAMP_MAGIC:
+            raise ValueError(f"Not an RCC binary timestamp file: {path}")
+
+        version, header_size = struct.unpack("<II", header[8:16])
+        if version > BINARY_TIMESTAMP_VERSION:
+            raise ValueError(f"Unsupported binary timestamp version {version}: {path}")
+        spec = json.loads(f.read(header_size - 16).decode("utf-8"))
+
+    return np.dtype([tuple(field) for field in spec["fields"]]), header_size
+
+
+def open_binary_timestamps(path, mode="r"):
+    """Memory-map binary timestamps as structured array. Incomplete trailing rows are ignored."""
+    dtype, header_size = read_binary_timestamp_header(path)
+    n_rows = (Path(path).stat().st_size - header_size) // dtype.itemsize
+    if n_rows <= 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode=mode, offset=header_size, shape=(n_rows,))
+
+
+def write_binary_timestamps(path, rows, fields=None):
+    """Write a complete binary timestamp file from a structured array or record list."""
+    dtype = np.dtype(fields) if fields is not None else rows.dtype
+    rows = np.asarray(rows).astype(dtype, copy=False)
+    with Path(path).open("wb") as f:
+        write_binary_timestamp_header(file_handle=f, fields=dtype.descr)
+        rows.tofile(f)
+
+
 class DummyFileObject:
     def __init__(self, *args, **kwargs):
         pass
@@ -0,0 +1,35 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import numpy as np
+
+
+class LatencyRecorder:
+    """Fixed-size ring of latency samples (seconds) with percentile summary.
+
+    `add` is cheap enough for the encoder callback thread.
+    """
+
+    size = 4096
+
+    def __init__(self, size=None):
+        self.size = int(size or self.size)
+        self._samples = np.zeros(self.size, dtype=np.float64)
+        self.count = 0
+
+    def add(self, value):
+        self._samples[self.count % self.size] = value
+        self.count += 1
+
+    def percentiles(self):
+        samples = self._samples[: min(self.count, self.size)]
+        if not len(samples):
+            return {}
+
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99]) * 1e3
+        return {
+            "p50_ms": float(p50),
+            "p90_ms": float(p90),
+            "p99_ms": float(p99),
+            "max_ms": float(samples.max() * 1e3),
+        }
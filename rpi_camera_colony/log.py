@@ -1,7 +1,18 @@
+import copy
 import logging
+import queue
+import time
+import zlib
+from logging.handlers import QueueHandler
+from threading import Event, Thread
 
+import zmq
 from rich.logging import RichHandler
 
+from rpi_camera_colony.serialization import decode_message, encode_message
+
+LOG_BATCH_TOPIC = "LOGBATCH"
+
 
 def log_level_name_to_value(name=None, default=20):
     """Translate log level name to corresponding value. Default is INFO==20"""
@@ -29,3 +40,131 @@ def setup_logging_control(level=None):
         logging_handler.setFormatter(formatter)
         logger.addHandler(logging_handler)
         logging.info(f"Set up logging for rcc with level {level}")
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Put log records on a bounded queue without blocking. Full queue: count and drop."""
+
+    def __init__(self, queue=None, sender=None):
+        super().__init__(queue)
+        self.sender = sender
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Format at the log call, so %-args are rendered with their state at that time."""
+        try:
+            message = self.format(record)
+        except Exception as e:
+            message = f"Failed to format log record {record.msg!r}: {e}"
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.sender is not None:
+            self.sender.stop()
+        super().close()
+
+
+class LogBatchSender(Thread):
+    """Send queued log records in zlib-compressed batches from one thread.
+
+    Each batch is sent as `[root_topic].LOGBATCH` with records `[level name, text]` and the
+    number of records dropped so far. At most `max_batch_rate` batches per second are sent,
+    records arriving in between are collected in the next batch (up to `batch_size`).
+    """
+
+    daemon = True
+
+    queue_size = 10000
+    batch_size = 500
+    max_batch_rate = 10.0  # batches per second
+    compression_level = 1
+
+    def __init__(self, socket=None, root_topic="", formatter=None, **kwargs):
+        """
+        :param socket: PUB socket, only used by this thread once started
+        """
+        super().__init__()
+
+        for key, value in kwargs.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+
+        self.socket = socket
+        self.topic = f"{root_topic}.{LOG_BATCH_TOPIC}".encode()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.handler = DroppingQueueHandler(queue=self.queue, sender=self)
+        self.handler.setFormatter(formatter or logging.Formatter())
+
+        self.batches_sent = 0
+        self.records_sent = 0
+        self.bytes_sent = 0
+        self._stop_event = Event()
+
+    def run(self):
+        min_interval = 1.0 / self.max_batch_rate
+        while not self._stop_event.is_set():
+            try:
+                first = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.monotonic()
+            self._send_batch([first] + self._get_queued(self.batch_size - 1))
+            self._stop_event.wait(min_interval - (time.monotonic() - start))
+
+        while not self.queue.empty():  # flush
+            self._send_batch(self._get_queued(self.batch_size))
+
+    def _get_queued(self, n):
+        records = []
+        while len(records) < n:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _send_batch(self, records):
+        batch = {"records": [[record.levelname, record.msg] for record in records]}
+        batch["dropped"] = self.handler.dropped
+        data = zlib.compress(encode_message(batch), self.compression_level)
+        try:
+            self.socket.send_multipart([self.topic, data], zmq.NOBLOCK)
+        except zmq.ZMQError:
+            self.handler.dropped += len(records)
+            return
+        self.batches_sent += 1
+        self.records_sent += len(records)
+        self.bytes_sent += len(data)
+
+    def stats(self):
+        return {
+            "batches_sent": self.batches_sent,
+            "records_sent": self.records_sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.handler.dropped,
+            "queued": self.queue.qsize(),
+        }
+
+    def stop(self):
+        """Send queued records and stop."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def unpack_log_batch(data=None):
+    """Records `[level name, text]` and dropped count of a LogBatchSender batch."""
+    batch = decode_message(zlib.decompress(data))
+    return batch["records"], batch.get("dropped", 0)
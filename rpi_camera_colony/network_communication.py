@@ -1,23 +1,115 @@
 #
 # Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
 # License: BSD 3-Clause
+import atexit
 import logging
-from threading import Thread
+import socket
+import time
+from threading import Event, Lock, Thread, current_thread
 
 import numpy as np
 import zmq
-from tornado import ioloop
-from zmq.eventloop.zmqstream import ZMQStream
 from zmq.utils.strtypes import b
 
+from rpi_camera_colony.latency import LatencyRecorder
+from rpi_camera_colony.serialization import decode_message, encode_message
+
 allowed_zmq_patterns = {
     "REQ": zmq.REQ,
     "REP": zmq.REP,
     "PUB": zmq.PUB,
     "SUB": zmq.SUB,
+    "ROUTER": zmq.ROUTER,
+    "DEALER": zmq.DEALER,
 }
 
 
+class ContextManager:
+    """Process-wide ZMQ context and registry of the open SocketCommunication sockets.
+
+    One context (with `io_threads` I/O threads) is shared by all sockets of the process.
+    Sockets register on open and unregister on close. `close_all` closes the remaining
+    sockets and destroys the context, also at interpreter exit.
+    """
+
+    io_threads = 1
+    linger = 1000  # milliseconds, default for sockets closed with unsent messages
+
+    def __init__(self):
+        self._context = None
+        self._sockets = []
+        self._lock = Lock()
+
+    def configure(self, io_threads=None, linger=None):
+        """Set before the first socket is opened. Changes apply to a new context only."""
+        self.io_threads = int(io_threads or self.io_threads)
+        self.linger = self.linger if linger is None else int(linger)
+        if self._context is not None and self.io_threads != self._context.IO_THREADS:
+            logging.warning(
+                f"ZMQ context already running with {self._context.IO_THREADS} I/O threads."
+            )
+
+    @property
+    def context(self):
+        with self._lock:
+            if self._context is None or self._context.closed:
+                self._context = zmq.Context(io_threads=self.io_threads)
+                self._context.setsockopt(zmq.LINGER, self.linger)
+                logging.debug(f"ZMQ context with {self.io_threads} I/O threads.")
+            return self._context
+
+    def register(self, socket_wrapper):
+        with self._lock:
+            if socket_wrapper not in self._sockets:
+                self._sockets.append(socket_wrapper)
+
+    def unregister(self, socket_wrapper):
+        with self._lock:
+            if socket_wrapper in self._sockets:
+                self._sockets.remove(socket_wrapper)
+
+    def find(self, socket_handle):
+        """SocketCommunication of a ZMQ socket, or None."""
+        for socket_wrapper in self.sockets:
+            if socket_wrapper.socket is socket_handle:
+                return socket_wrapper
+
+    @property
+    def sockets(self):
+        with self._lock:
+            return list(self._sockets)
+
+    def stats(self):
+        """Address, pattern and message counters of each open socket."""
+        return [socket_wrapper.stats() for socket_wrapper in self.sockets]
+
+    def close_all(self):
+        for socket_wrapper in self.sockets:
+            socket_wrapper.close()
+
+        with self._lock:
+            if self._context is not None:
+                # Also closes sockets not in the registry (e.g. inproc wake-up sockets, sockets
+                # of daemon threads), which would block term()
+                self._context.destroy(linger=self.linger)
+                self._context = None
+                logging.debug("ZMQ context terminated.")
+
+
+zmq_context = ContextManager()
+atexit.register(zmq_context.close_all)
+
+
+def _tcp_port_available(ip_address=None, port=None):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # like ZMQ
+        try:
+            s.bind(("" if ip_address == "*" else ip_address, port))
+        except OSError:
+            return False
+    return True
+
+
 def find_available_port(
     start_port=None,
     ip_address=None,
@@ -27,21 +119,24 @@ def find_available_port(
 ):
     """Check safely if chosen port range is available."""
     start_port = int(start_port)
-    c = zmq.Context()
 
-    available_port = None
-    while available_port is None and start_port <= start_port + allowed_port_range:
+    for port in range(start_port, start_port + allowed_port_range + 1):
+        if protocol == "tcp":
+            # Closing a ZMQ socket releases the port asynchronously in the shared context
+            if _tcp_port_available(ip_address=ip_address, port=port):
+                return port
+            continue
+
+        s = zmq_context.context.socket(allowed_zmq_patterns[pattern])
         try:
-            s = c.socket(allowed_zmq_patterns[pattern])
-            s.bind(f"{protocol}://{ip_address}:{start_port}")
-            available_port = start_port
-            s.close()
+            s.bind(f"{protocol}://{ip_address}:{port}")
+            return port
         except zmq.ZMQError:
-            start_port += 1
             continue
+        finally:
+            s.close(linger=0)
 
-    c.term()
-    return available_port
+    return None
 
 
 class SocketCommunication:
@@ -49,13 +144,16 @@ class SocketCommunication:
     and high-level interfaces to message serialisation.
     """
 
-    context = None
     socket = None
 
     full_address = None
+    messages_sent = 0
+    messages_received = 0
     pattern = "PUB"
     bind_bool = True
     subscribe_to = ""
+    identity = None
+    codec = "json"
 
     def __init__(
         self,
@@ -65,16 +163,20 @@ class SocketCommunication:
         pattern="PUB",
         bind=True,
         subscribe_to="",
+        identity=None,
+        codec=None,
         auto_open=True,
     ):
         """
         :param protocol: protocols accepted by ZMQ, e.g. TCP
         :param address: IP address
         :param port: Port number
-        :param pattern: Allowed values are: REQ, REP, PUB, SUB
+        :param pattern: Allowed values are: REQ, REP, PUB, SUB, ROUTER, DEALER
         :param bind: If true, binds to address, else connects it
         :param subscribe_to: Subscription string for topic. If is list,
         subscribes to topics iteratively.
+        :param identity: Socket identity, e.g. for a DEALER addressed by a ROUTER
+        :param codec: Message encoding of send_message & send_array, e.g. json or msgpack
         """
         protocol = protocol.split(":")[
             0
@@ -87,6 +189,8 @@ class SocketCommunication:
         self.pattern = pattern.upper()
         self.bind_bool = bind
         self.subscribe_to = subscribe_to
+        self.identity = identity
+        self.codec = codec or self.codec
 
         if auto_open:
             self.open()
@@ -97,7 +201,7 @@ class SocketCommunication:
             f"on {self.full_address}."
         )
 
-        if self.context is not None and not self.socket.closed:
+        if self.socket is not None and not self.socket.closed:
             if not force_open:
                 logging.debug(
                     "Already open. Not allowed to close and re-open. "
@@ -109,12 +213,20 @@ class SocketCommunication:
                 logging.debug(f"Trying to re-open connection on {self.full_address}")
 
         # OPENING
-        self.context = zmq.Context()
-        self.socket = self.context.socket(allowed_zmq_patterns.get(self.pattern))
-        if self.bind_bool:
-            self.socket.bind(self.full_address)
-        else:
-            self.socket.connect(self.full_address)
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.socket = zmq_context.context.socket(allowed_zmq_patterns.get(self.pattern))
+        zmq_context.register(self)
+        if self.identity:
+            self.socket.setsockopt(zmq.IDENTITY, self.identity.encode())
+        try:
+            if self.bind_bool:
+                self.socket.bind(self.full_address)
+            else:
+                self.socket.connect(self.full_address)
+        except zmq.ZMQError:
+            self.close()
+            raise
 
         if "SUB" in self.pattern:
             logging.debug(f"Subscribing to: '{self.subscribe_to}' on {self.full_address}")
@@ -125,16 +237,22 @@ class SocketCommunication:
                     self.socket.subscribe(b(topic))
 
     def send_json(self, object=None):
+        self.messages_sent += 1
         self.socket.send_json(obj=dict(object))
 
     def recv_json(self, *args, **kwargs):
-        return self.socket.recv_json(*args, **kwargs)
+        message = self.socket.recv_json(*args, **kwargs)
+        self.messages_received += 1
+        return message
 
     def recv_multipart(self):
-        return self.socket.recv_multipart()
+        message = self.socket.recv_multipart()
+        self.messages_received += 1
+        return message
 
     def send_multipart(self, topic="", message=""):
         msg_parts = [b(part) for part in [topic, message]]
+        self.messages_sent += 1
         return self.socket.send_multipart(msg_parts=msg_parts)
 
     def send_multipart_json(self, recipient="", message=None, flags=0):
@@ -142,9 +260,15 @@ class SocketCommunication:
             logging.warning(f"Message is type {type(message)}, but has to be dict.")
             return False
 
+        self.messages_sent += 1
         self.socket.send(b(recipient), flags=flags | zmq.SNDMORE)
         return self.socket.send_json(obj=message, flags=flags)
 
+    def send_message(self, topic="", message=None, flags=0):
+        """Send topic & message (dict) encoded with the codec of this socket."""
+        self.messages_sent += 1
+        return self.socket.send_multipart([b(topic), encode_message(message, self.codec)], flags)
+
     def send_array(self, array=None, metadata=None, flags=0, copy=True, track=False):
         """send a numpy array with metadata"""
         metadata_to_send = dict(
@@ -154,95 +278,216 @@ class SocketCommunication:
         if isinstance(metadata, dict):
             metadata_to_send.update(metadata)
 
-        self.socket.send_json(metadata_to_send, flags | zmq.SNDMORE)
-        return self.socket.send(array, flags, copy=copy, track=track)
+        self.socket.send(encode_message(metadata_to_send, self.codec), flags | zmq.SNDMORE)
+        tracker = self.socket.send(array, flags, copy=copy, track=track)
+        self.messages_sent += 1
+        return tracker
 
     def recv_array(self, flags=0, copy=True, track=False):
         """recv a numpy array"""
-        received_metadata = self.socket.recv_json(flags=flags)
-        data_segment = self.socket.recv(flags=flags, copy=copy, track=track)
-        buf = memoryview(data_segment)
-        received_array = np.frombuffer(buf, dtype=received_metadata["dtype"])
-        return received_array.reshape(received_metadata["shape"])
+        return self.recv_array_with_metadata(flags=flags, copy=copy, track=track)[1]
 
     def recv_array_with_metadata(self, flags=0, copy=True, track=False):
         """recv a numpy array, plus additional metadata"""
-        received_metadata = self.socket.recv_json(flags=flags)
+        received_metadata = decode_message(self.socket.recv(flags=flags))
         data_segment = self.socket.recv(flags=flags, copy=copy, track=track)
+        self.messages_received += 1
         buf = memoryview(data_segment)
         received_array = np.frombuffer(buf, dtype=received_metadata["dtype"])
         return received_metadata, received_array.reshape(received_metadata["shape"])
 
+    def stats(self):
+        return {
+            "address": self.full_address,
+            "pattern": self.pattern,
+            "codec": self.codec,
+            "bind": self.bind_bool,
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+        }
+
     def close(self):
         if self.socket is not None and not self.socket.closed:
             self.socket.close()
-            self.socket = None
             logging.debug(f"Socket closed for {self.full_address}")
+        self.socket = None
+        zmq_context.unregister(self)
 
-        if self.context is not None:
-            self.context.term()
-            self.context = None
-            logging.debug(f"Context closed for {self.full_address}")
+    def __enter__(self):
+        return self
 
-    def __del__(self):
-        try:
-            self.close()
-        except zmq.ZMQBaseError:
-            logging.warning(
-                f"ZMQBaseError on closing of command_socket/context of " f"{self.full_address}"
-            )
-        except BaseException:
-            logging.warning(f"Unknown error on del of {self.full_address}")
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
-class ListenerStream(Thread):
-    """Bundle ZMQ sockets and streams with shared event loop
-    in thread for non-blocking callback."""
+class SocketPoller(Thread):
+    """Receive on many ZMQ sockets in one thread with a `zmq.Poller` and call per-socket callbacks.
+
+    All state is per instance. Sockets can be added and removed while running (applied in
+    the poller thread, sockets are only used by that thread while registered). Other threads
+    send on a registered socket with `call_soon`.
+    `stats()` reports per-socket receive rates and callback latency.
+    """
 
-    socket_dict = {}
-    stream_dict = {}
-    recv_callback_input = None
-    recv_callback_dict = {}
-    ioloop = None
     daemon = True
 
-    def __init__(self, socket_dict: dict, recv_callback_dict: (dict, None)):
+    poll_timeout = 100  # milliseconds, also the maximum delay of stop and socket changes
+    max_messages_per_poll = 100  # per socket, so that a busy socket does not starve the others
+
+    def __init__(self, socket_dict=None, recv_callback_dict=None):
         """
-        :param socket_dict: dict of ZMQ command_socket objects
-        :param recv_callback_dict: dict of functions to call on event on the sockets
-        or a single function handle that will be used for each command_socket
-        like the dict would be.
+        :param socket_dict: dict of ZMQ sockets by name
+        :param recv_callback_dict: dict of functions by socket name, called with the received
+            multipart message (list of bytes), or a single function for all sockets
         """
         super().__init__()
 
-        self.socket_dict = socket_dict
-        self.recv_callback_input = recv_callback_dict
-
-        if self.recv_callback_input is None:
-            logging.warning("No stream recv_callbacks defined! Settings all callbacks to None")
-            for socket_name, _ in socket_dict.items():
-                self.recv_callback_dict[socket_name] = None
+        self.sockets = {}
+        self.callbacks = {}
+        self._socket_wrappers = {}
+        self._socket_stats = {}
+        self._poller = zmq.Poller()
+        self._changes = []
+        self._calls = []
+        self._changes_lock = Lock()
+        self._stop_event = Event()
+
+        for socket_name, socket_handle in (socket_dict or {}).items():
+            if callable(recv_callback_dict) or recv_callback_dict is None:
+                callback = recv_callback_dict
+            else:
+                callback = recv_callback_dict.get(socket_name)
+            self.add_socket(socket_name, socket_handle, callback)
+
+    def add_socket(self, socket_name, socket_handle, callback=None):
+        if callback is None:
+            logging.warning(f"No recv callback for socket {socket_name}. Messages are dropped.")
+        with self._changes_lock:
+            self._changes.append((socket_name, socket_handle, callback))
+
+    def remove_socket(self, socket_name):
+        with self._changes_lock:
+            self._changes.append((socket_name, None, None))
+
+    def _apply_changes(self):
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+
+        for socket_name, socket_handle, callback in changes:
+            if socket_name in self.sockets:
+                self._poller.unregister(self.sockets.pop(socket_name))
+                self.callbacks.pop(socket_name)
+                self._socket_wrappers.pop(socket_name)
+            if socket_handle is not None:
+                self.sockets[socket_name] = socket_handle
+                self.callbacks[socket_name] = callback
+                self._socket_wrappers[socket_name] = zmq_context.find(socket_handle)
+                self._socket_stats.setdefault(socket_name, SocketStats())
+                self._poller.register(socket_handle, zmq.POLLIN)
+
+    def call_soon(self, function):
+        """Call `function()` in the poller thread (within `poll_timeout`), from any thread."""
+        with self._changes_lock:
+            self._calls.append(function)
+
+    def _run_calls(self):
+        with self._changes_lock:
+            calls, self._calls = self._calls, []
+
+        for function in calls:
+            try:
+                function()
+            except BaseException as e:
+                logging.error(f"Call in socket poller failed: {e}")
 
-        if callable(self.recv_callback_input):
-            logging.debug(f"Only one callback defined. Setting to same: {recv_callback_dict}")
-            for socket_name, _ in socket_dict.items():
-                self.recv_callback_dict[socket_name] = self.recv_callback_input
+    def run(self):
+        while not self._stop_event.is_set():
+            self._apply_changes()
+            self._run_calls()
+            if not self.sockets:
+                self._stop_event.wait(self.poll_timeout / 1000)
+                continue
+
+            try:
+                ready = dict(self._poller.poll(self.poll_timeout))
+            except zmq.ZMQError as e:
+                logging.debug(f"Socket poller stopped: {e}")  # sockets closed at exit
+                break
+            for socket_name, socket_handle in self.sockets.items():
+                if socket_handle in ready:
+                    self._receive(socket_name, socket_handle)
+
+        self._run_calls()
+        self._apply_changes()
+        for socket_handle in self.sockets.values():
+            self._poller.unregister(socket_handle)
+        self.sockets = {}
+
+    def _receive(self, socket_name, socket_handle):
+        callback = self.callbacks[socket_name]
+        socket_wrapper = self._socket_wrappers[socket_name]
+        socket_stats = self._socket_stats[socket_name]
+        for _ in range(self.max_messages_per_poll):
+            try:
+                message = socket_handle.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
 
-        for socket_name, socket_handle in socket_dict.items():
-            new_stream = ZMQStream(socket=socket_handle)
-            new_stream.on_recv(callback=self.recv_callback_dict[socket_name])
-            self.stream_dict[socket_name] = new_stream
+            callback_start = time.perf_counter()
+            if callback is not None:
+                try:
+                    callback(message)
+                except BaseException as e:
+                    logging.error(f"Receive callback of socket {socket_name} failed: {e}")
+            socket_stats.add(message, time.perf_counter() - callback_start)
+            if socket_wrapper is not None:
+                socket_wrapper.messages_received += 1
 
-        self.ioloop = ioloop.IOLoop.instance()
+    def stats(self, reset=False):
+        """Messages, bytes, receive rate and callback latency per socket.
 
-    def run(self):
-        self.ioloop.start()
+        The rate is averaged since the start or the last call with `reset`.
+        """
+        return {
+            name: socket_stats.snapshot(reset=reset)
+            for name, socket_stats in self._socket_stats.items()
+        }
 
     def stop(self):
-        for s, h in self.stream_dict.items():
-            h.on_recv = None
-            h.close(0)
-
-        # self.ioloop.stop()
-        # self.ioloop.clear_current()
-        # self.ioloop = None
+        self._stop_event.set()
+        if self.is_alive() and current_thread() is not self:
+            self.join()
+
+
+class SocketStats:
+    """Receive counters and callback latency of one socket."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.callback_latency = LatencyRecorder(size=1024)
+        self._last_time = time.monotonic()
+        self._last_messages = 0
+
+    def add(self, message, callback_duration):
+        self.messages += 1
+        self.bytes += sum(len(part) for part in message)
+        self.callback_latency.add(callback_duration)
+
+    def snapshot(self, reset=False):
+        """Counters with the rate since the last reset, then reset the rate window if `reset`."""
+        now = time.monotonic()
+        rate = (self.messages - self._last_messages) / max(now - self._last_time, 1e-9)
+        if reset:
+            self._last_time = now
+            self._last_messages = self.messages
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "rate_hz": rate,
+            "callback_latency": self.callback_latency.percentiles(),
+        }
+
+
+# Previous name, the tornado IOLoop based listener was replaced by SocketPoller
+ListenerStream = SocketPoller
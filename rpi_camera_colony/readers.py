@@ -1,3 +1,4 @@
+import argparse
 import json
 import logging
 from pathlib import Path
@@ -5,6 +6,13 @@ from pathlib import Path
 import pandas as pd
 import pandas.errors
 
+from rpi_camera_colony.clock import ClockDriftModel
+from rpi_camera_colony.files import (
+    TIMESTAMP_FIELDS,
+    open_binary_timestamps,
+    write_binary_timestamps,
+)
+
 
 def __read_json(file=None):
     with Path(file).open("r") as f:
@@ -20,7 +28,7 @@ def __read_json(file=None):
 def __exclude_files_by_pattern(file_list=None):
     exclusions_contains = ["DLC_resnet"]
     for excl in exclusions_contains:
-        file_list = [f for f in file_list if excl not in f]
+        file_list = [f for f in file_list if excl not in str(f)]
     return file_list
 
 
@@ -31,7 +39,35 @@ def __get_file_type_identifier(file=None, namespace_divider=None):
     return str(file.split(namespace_divider)[-1].replace("_", "."))
 
 
-def read_session_data(session_dir=None, namespace_signature=".rcc."):
+def __read_timestamps_csv(file=None):
+    # Expect TTL to be empty if not connected.
+    try:
+        csv_data = pd.read_csv(file)
+
+        # Assert that matches TTL-in (shape[1]=1)
+        # or TTL-out (shape[1]=2) column layout
+        assert csv_data.shape[1] <= 3
+
+        # Remove leading hash and whitespace from column names (legacy naming)
+        for c in csv_data.columns:
+            csv_data = csv_data.rename(columns={c: c.strip("#").strip(" ")})
+
+    except (pandas.errors.EmptyDataError, AssertionError):
+        csv_data = pd.DataFrame()
+
+    return csv_data
+
+
+def __read_timestamps_bin(file=None):
+    # Truncated or corrupt files are skipped, not fatal for the session
+    try:
+        return open_binary_timestamps(file)
+    except ValueError as e:
+        logging.debug(f"Failed to read binary timestamps: {e}")
+        return None
+
+
+def read_session_data(session_dir=None, namespace_signature=".rcc.", prefer_binary=False):
     """Read RCC session metadata & video paths (not video data itself).
 
     File name pattern:
@@ -42,9 +78,16 @@ def read_session_data(session_dir=None, namespace_signature=".rcc."):
         - .rcc.metadata.json
         - .rcc.timestamps_ttl_in.csv    : frame timestamps + input timestamps
         - .rcc.timestamps_ttl_out.csv   : frame timestamps == output timestamps
+        - .rcc.timestamps.ttl.[in|out].bin [optional binary timestamps]
+        - .rcc.clock.csv                : camera vs. system clock samples
         - .rcc.video.h264
         - .rcc.video.h264.mp4 [only there is run MSW post acquisition tasks]
+        - .rcc.segments.csv + .rcc.segment_[index].[video.h264|timestamps...] [segmented]
+        - .rcc.clips.csv + .rcc.clip_[index].[video.h264|timestamps.csv] [triggered recording]
 
+    CSV timestamps are returned as DataFrames. Binary timestamps are returned as memory-mapped
+    numpy structured arrays (same column names as the CSV files), if there is no CSV file or
+    `prefer_binary` is True. Then the CSV file is not parsed.
     """
     session_dir = Path(session_dir)
     assert session_dir.exists()
@@ -74,23 +117,60 @@ def read_session_data(session_dir=None, namespace_signature=".rcc."):
 
             session_data[cam][ftype.replace(".json", "")] = metadata
 
-        elif ftype.endswith(".csv"):
-            # Expect TTL to be empty if not connected.
-            try:
-                csv_data = pd.read_csv(filepath)
-
-                # Assert that matches TTL-in (shape[1]=1)
-                # or TTL-out (shape[1]=2) column layout
-                assert csv_data.shape[1] <= 3
-
-                # Remove leading hash and whitespace from column names (legacy naming)
-                for c in csv_data.columns:
-                    csv_data = csv_data.rename(columns={c: c.strip("#").strip(" ")})
-
-            except (pandas.errors.EmptyDataError, AssertionError):
-                csv_data = pd.DataFrame()
-
-            session_data[cam][ftype.replace(".csv", "")] = csv_data
+        elif ftype == "clips.csv":
+            session_data[cam]["clips"] = pd.read_csv(filepath)
+
+        elif ftype.startswith("clip."):
+            # Triggered recording clips: clip.[index].video.h264 / clip.[index].timestamps.csv
+            clip_index = int(ftype.split(".")[1])
+            clip_files = session_data[cam].setdefault("clip_files", {}).setdefault(clip_index, {})
+            if ftype.endswith(".csv"):
+                clip_files["timestamps"] = __read_timestamps_csv(file=filepath)
+            else:
+                clip_files["video_file_h264"] = str(Path(filepath).relative_to(session_dir))
+
+        elif ftype == "segments.csv":
+            session_data[cam]["segments"] = pd.read_csv(filepath)
+
+        elif ftype.startswith("segment."):
+            # Segmented recording: segment.[index].video.h264 / segment.[index].timestamps...
+            _, segment_index, segment_ftype = ftype.split(".", 2)
+            segment_files = (
+                session_data[cam].setdefault("segment_files", {}).setdefault(int(segment_index), {})
+            )
+            if segment_ftype == "video.h264":
+                session_data[cam]["has_h264"] = True
+                segment_files["video_file_h264"] = str(Path(filepath).relative_to(session_dir))
+            elif segment_ftype.endswith(".csv"):
+                if prefer_binary and Path(filepath).with_suffix(".bin").exists():
+                    continue
+                segment_files[segment_ftype.replace(".csv", "")] = __read_timestamps_csv(
+                    file=filepath
+                )
+            elif segment_ftype.endswith(".bin"):
+                if not prefer_binary and Path(filepath).with_suffix(".csv").exists():
+                    continue
+                timestamps = __read_timestamps_bin(file=filepath)
+                if timestamps is not None:
+                    segment_files[segment_ftype.replace(".bin", "")] = timestamps
+
+        elif ftype == "clock.csv":
+            # Clock sampler (camera vs. system clock samples), not frame timestamps
+            session_data[cam]["clock"] = pd.read_csv(filepath)
+
+        elif ftype.startswith("timestamps.") and ftype.endswith(".csv"):
+            if prefer_binary and Path(filepath).with_suffix(".bin").exists():
+                continue
+
+            session_data[cam][ftype.replace(".csv", "")] = __read_timestamps_csv(file=filepath)
+
+        elif ftype.startswith("timestamps.") and ftype.endswith(".bin"):
+            if not prefer_binary and Path(filepath).with_suffix(".csv").exists():
+                continue
+
+            timestamps = __read_timestamps_bin(file=filepath)
+            if timestamps is not None:
+                session_data[cam][ftype.replace(".bin", "")] = timestamps
 
         elif ftype == "video.h264":
             session_data[cam]["has_h264"] = True
@@ -101,3 +181,61 @@ def read_session_data(session_dir=None, namespace_signature=".rcc."):
             session_data[cam]["video_file_mp4"] = str(Path(filepath).relative_to(session_dir))
 
     return session_data
+
+
+def camera_time_to_system_time(camera_time=None, clock_models=None, clock="realtime"):
+    """Convert camera clock timestamps (microseconds) to system time (seconds) in bulk.
+
+    :param camera_time: Array-like of camera timestamps, e.g. the `timestamp_frame` column
+    :param clock_models: `clock_models` entry of the session metadata
+    :param clock: "realtime" (CLOCK_REALTIME, like `sys_time`) or "monotonic"
+    """
+    return ClockDriftModel.from_dict(clock_models[clock]).predict(camera_time)
+
+
+def convert_timestamps_to_binary(session_dir=None, namespace_signature=".rcc.", overwrite=False):
+    """Write binary timestamp files next to the CSV timestamp files of an existing session."""
+    converted = []
+    timestamp_files = [
+        *Path(session_dir).glob(f"*{namespace_signature}timestamps*.csv"),
+        *Path(session_dir).glob(f"*{namespace_signature}segment_*.timestamps*.csv"),
+    ]
+    for filepath in sorted(timestamp_files):
+        binary_path = filepath.with_suffix(".bin")
+        if binary_path.exists() and not overwrite:
+            logging.debug(f"Skipping existing binary timestamps: {binary_path}")
+            continue
+
+        file_key = "ttl.in" if ".ttl.in." in filepath.name else "ttl.out"
+        fields = TIMESTAMP_FIELDS[file_key]
+        csv_data = __read_timestamps_csv(file=filepath)
+        if csv_data.empty:
+            csv_data = pd.DataFrame(columns=[name for name, _ in fields])
+
+        write_binary_timestamps(
+            path=binary_path,
+            rows=csv_data[[name for name, _ in fields]].to_records(index=False),
+            fields=fields,
+        )
+        converted.append(str(binary_path))
+        logging.info(f"Converted {filepath.name} -> {binary_path.name} ({len(csv_data)} rows)")
+
+    return converted
+
+
+def convert_timestamps_main():
+    parser = argparse.ArgumentParser(
+        description="RPi Camera Colony: Convert CSV timestamps to binary format",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("session_dirs", nargs="+", type=str, help="Session directories")
+    parser.add_argument("--overwrite", default=False, action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for session_dir in args.session_dirs:
+        convert_timestamps_to_binary(session_dir=session_dir, overwrite=args.overwrite)
+
+
+if __name__ == "__main__":
+    convert_timestamps_main()
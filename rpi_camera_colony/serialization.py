@@ -0,0 +1,97 @@
+#
+# Author: Lars B. Rollik <L.B.Rollik@protonmail.com>
+# License: BSD 3-Clause
+import json
+import logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Encoded messages start with a 2-byte header: format version & codec id.
+# Messages without header (first byte "{" or "[") are read as plain JSON.
+HEADER_VERSION = 1
+HEADER_SIZE = 2
+
+
+class JSONCodec:
+    name = "json"
+    codec_id = 1
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    @staticmethod
+    def decode(data):
+        return json.loads(bytes(data))
+
+
+class MsgpackCodec:
+    """Binary encoding, requires msgpack. Tuples are decoded as lists, like JSON."""
+
+    name = "msgpack"
+    codec_id = 2
+
+    @staticmethod
+    def encode(message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def decode(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+_codecs = {codec.name: codec for codec in [JSONCodec, MsgpackCodec]}
+_codecs_by_id = {codec.codec_id: codec for codec in _codecs.values()}
+
+
+def available_codecs():
+    """Names of the codecs usable in this process, preferred first."""
+    return [name for name in ["msgpack", "json"] if name != "msgpack" or msgpack is not None]
+
+
+def get_codec(name=None):
+    """Codec by name, JSON if unknown or not installed."""
+    if name not in available_codecs():
+        if name not in (None, JSONCodec.name):
+            logging.debug(f"Message codec {name} not available, using JSON.")
+        return JSONCodec
+    return _codecs[name]
+
+
+def negotiate_codec(remote_codecs=None, preferred=None):
+    """First codec of `preferred` (or of the local codecs) that the remote also supports."""
+    for name in preferred or available_codecs():
+        if name in (remote_codecs or []) and name in available_codecs():
+            return name
+    return JSONCodec.name
+
+
+def encode_message(message=None, codec=None):
+    """Message (dict) to bytes with header, `codec` by name."""
+    codec = get_codec(codec)
+    return bytes([HEADER_VERSION, codec.codec_id]) + codec.encode(message)
+
+
+def get_message_codec(data=None):
+    """Name of the codec of an encoded message."""
+    if data[0] in b"{[":
+        return JSONCodec.name
+
+    version, codec_id = data[0], data[1]
+    if version != HEADER_VERSION or codec_id not in _codecs_by_id:
+        raise ValueError(f"Unknown message header: version {version}, codec {codec_id}")
+    return _codecs_by_id[codec_id].name
+
+
+def decode_message(data=None):
+    """Bytes with header (or plain JSON) to message."""
+    data = memoryview(data)
+    codec = _codecs[get_message_codec(data)]
+    if data[0] in b"{[":
+        return codec.decode(data)
+    if codec is MsgpackCodec and msgpack is None:
+        raise ValueError("Received msgpack message, but msgpack is not installed.")
+    return codec.decode(data[HEADER_SIZE:])
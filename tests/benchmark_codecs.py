@@ -0,0 +1,99 @@
+"""Compare the message codecs on the messages sent between acquisition instances and Conductor.
+
+Example:
+    python tests/benchmark_codecs.py --repeats 20000
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+from rpi_camera_colony.acquisition.frame_monitor import FrameGapMonitor
+from rpi_camera_colony.config.config import load_config
+from rpi_camera_colony.latency import LatencyRecorder
+from rpi_camera_colony.serialization import (
+    available_codecs,
+    decode_message,
+    encode_message,
+)
+
+EXAMPLE_CONFIG = Path(__file__).parents[1] / "example_configs" / "example.config"
+
+
+def make_messages():
+    monitor = FrameGapMonitor(framerate=90)
+    for frame_index in range(1000):
+        monitor.update(pts=int(frame_index * 1e6 / 90) + (20000 if frame_index == 500 else 0))
+    frame_stats = dict(monitor.snapshot(), recording=True)
+
+    latency = LatencyRecorder(size=256)
+    for i in range(256):
+        latency.add(0.0001 * (1 + i % 7))
+    telemetry = {
+        "recording": True,
+        "fps": 89.97,
+        "framerate": 90.0,
+        "frame_count": 123456,
+        "ttl_count": 1234,
+        "bytes_written": 987654321,
+        "ttl_in": {"edges": 1234, "debounced": 0, "recorded": 1234},
+        "callback_latency": latency.percentiles(),
+        "disk_free_bytes": 12345678901,
+        "cpu_temperature": 54.2,
+        "load_average": list(os.getloadavg()),
+        "time": time.time(),
+    }
+
+    config = load_config(config_path=EXAMPLE_CONFIG)
+    instance_name = next(iter(config["controllers"]))
+    config_push = dict(config["controllers"][instance_name].dict(), type="config", id="17f-1")
+
+    raw_frame_metadata = {
+        "dtype": "uint8",
+        "shape": [240, 320],
+        "frame_index": 4567,
+        "frame_count": 4567,
+        "timestamp_camera": 50744444,
+        "sys_time": time.time(),
+        "format": "grey",
+        "resolution": [320, 240],
+    }
+
+    return {
+        "frame_stats": frame_stats,
+        "telemetry": telemetry,
+        "heartbeat": {"state": "recording", "sys_time": time.time()},
+        "config_push": config_push,
+        "raw_frame_metadata": raw_frame_metadata,
+    }
+
+
+def benchmark(message, codec, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        data = encode_message(message, codec)
+    encode_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decode_message(data)
+    decode_time = (time.perf_counter() - start) / repeats
+    return len(data), encode_time, decode_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", "-n", default=10000, type=int)
+    args = parser.parse_args()
+
+    codecs = available_codecs()
+    if "msgpack" not in codecs:
+        print("msgpack not installed: pip install rpi_camera_colony[msgpack]")
+
+    print(f"{'message':<20}{'codec':<10}{'bytes':>8}{'encode [us]':>14}{'decode [us]':>14}")
+    for name, message in make_messages().items():
+        for codec in codecs:
+            size, encode_time, decode_time = benchmark(message, codec, args.repeats)
+            print(f"{name:<20}{codec:<10}{size:>8}", end="")
+            print(f"{encode_time * 1e6:>14.2f}{decode_time * 1e6:>14.2f}")
@@ -0,0 +1,90 @@
+"""Run PiAcquisitionControl on the simulated camera & GPIO and report frame/timestamp throughput.
+
+Example:
+    python tests/benchmark_simulated_acquisition.py --framerate 90 --duration 10 --ttl-in-rate 5
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from rpi_camera_colony.acquisition.simulation import enable_simulation
+
+enable_simulation()
+
+from rpi_camera_colony.acquisition.acquisition_control import PiAcquisitionControl  # noqa: E402
+from rpi_camera_colony.acquisition.simulation import gpio  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--framerate", "-fps", default=90, type=int)
+    parser.add_argument("--resolution", "-res", nargs=2, default=(640, 480), type=int)
+    parser.add_argument("--duration", "-t", default=10.0, type=float)
+    parser.add_argument("--ttl-in-rate", default=1.0, type=float, help="TTL-in pulses/s")
+    parser.add_argument("--ttl-in-debounce", default=0, type=int, help="microseconds")
+    parser.add_argument("--ttl-in-every-nth", default=1, type=int)
+    parser.add_argument("--stream-video", "-s", default=False, action="store_true")
+    parser.add_argument("--stream-port", default=8001, type=int)
+    parser.add_argument("--data-path", default=None, type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    data_path = args.data_path or tempfile.mkdtemp(prefix="rcc_benchmark_")
+
+    with PiAcquisitionControl(
+        instance_name="simulated_camera",
+        data_path=data_path,
+        acquisition_name="benchmark",
+        control_stream_ip="127.0.0.1",
+        control_stream_port=54545,
+        framerate=args.framerate,
+        resolution=tuple(args.resolution),
+        stream_video=args.stream_video,
+        stream_ip="127.0.0.1",
+        stream_port=args.stream_port,
+        ttl_in_debounce=args.ttl_in_debounce,
+        ttl_in_every_nth=args.ttl_in_every_nth,
+    ) as control:
+        edge_source = gpio.EdgeSource(channel=control.camera.ttl_in_pin, rate=args.ttl_in_rate)
+
+        control._update_camera_status(new_status="start")
+        edge_source.start()
+        time.sleep(args.duration)
+        edge_source.stop()
+        ttl_in_filter = control.camera.ttl_in_filter
+        control._update_camera_status(new_status="stop")
+        files = control.acquisition_files
+
+    ttl_out = pd.read_csv(files["ttl.out"])
+    ttl_in = pd.read_csv(files["ttl.in"])
+    pts_delta_ms = np.diff(ttl_out["timestamp_frame"].values) / 1000.0
+    expected_ms = 1000.0 / args.framerate
+
+    print(f"Data: {Path(files['video']).parent}")
+    print(f"Video bytes: {Path(files['video']).stat().st_size}")
+    print(
+        f"Frames: {len(ttl_out)} ({len(ttl_out) / args.duration:.2f} fps, target {args.framerate})"
+    )
+    print(
+        f"TTL-in edges: {len(ttl_in)} (sent {edge_source.pulse_count}, "
+        f"filter: {ttl_in_filter.stats()})"
+    )
+    if len(pts_delta_ms):
+        print(
+            f"Frame interval [ms]: expected={expected_ms:.3f} "
+            f"median={np.median(pts_delta_ms):.3f} p99={np.percentile(pts_delta_ms, 99):.3f} "
+            f"max={pts_delta_ms.max():.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark MJPEG stream fan-out to many concurrent viewers (runs on any Linux machine).
+
+The server process feeds synthetic JPEG frames into a StreamingOutput at the target fps and
+serves them with the asyncio or the threading server. Viewers run in a separate process.
+Reports received fps per viewer and the server process CPU load.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+from threading import Thread
+
+from rpi_camera_colony.acquisition.streaming import (
+    AsyncStreamingServer,
+    StreamingHandler,
+    StreamingOutput,
+    StreamingServer,
+    make_multipart_chunk,
+)
+
+
+def feed_frames(output, framerate, frame_size, duration):
+    frame = b"\xff\xd8" + bytes(frame_size - 4) + b"\xff\xd9"
+    frame_interval = 1.0 / framerate
+    next_frame = time.perf_counter()
+    end = next_frame + duration
+    while next_frame < end:
+        next_frame += frame_interval
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+        output.write(frame)
+
+
+async def _view(port, duration, chunk_size, results):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET / HTTP/1.1\r\nHost: benchmark\r\n\r\n")
+    received = 0
+    first_time = last_time = None
+    end = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < end:
+            data = await asyncio.wait_for(reader.read(1 << 20), timeout=end - time.perf_counter())
+            if not data:
+                break
+            last_time = time.perf_counter()
+            if first_time is None:
+                if b"--FRAME" not in data:
+                    continue  # response header only
+                first_time = last_time
+            received += len(data)
+    except asyncio.TimeoutError:
+        pass
+    writer.close()
+    if first_time is None or last_time == first_time:
+        results.append(0.0)
+    else:
+        results.append((received / chunk_size - 1) / (last_time - first_time))
+
+
+def run_viewers(port, n_viewers, duration, chunk_size, queue):
+    async def main():
+        results = []
+        await asyncio.gather(
+            *[_view(port, duration, chunk_size, results) for _ in range(n_viewers)]
+        )
+        return results
+
+    queue.put(asyncio.run(main()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", default="asyncio", choices=["asyncio", "threading"])
+    parser.add_argument("--viewers", "-n", default=20, type=int)
+    parser.add_argument("--framerate", "-fps", default=30, type=int)
+    parser.add_argument("--frame-kb", default=50, type=int, help="JPEG frame size in kB")
+    parser.add_argument("--duration", "-t", default=5.0, type=float)
+    parser.add_argument("--port", default=8990, type=int)
+    parser.add_argument("--pin-cpu", default=False, action="store_true", help="Server on CPU 0")
+    args = parser.parse_args()
+
+    if args.pin_cpu:
+        os.sched_setaffinity(0, {0})
+
+    frame_size = args.frame_kb * 1000
+    output = StreamingOutput()
+    if args.server == "asyncio":
+        server = AsyncStreamingServer(output=output, address="127.0.0.1", port=args.port)
+        server.start()
+    else:
+        StreamingHandler.output_from_camera = output
+        server = StreamingServer(("127.0.0.1", args.port), StreamingHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+    queue = multiprocessing.Queue()
+    chunk_size = len(make_multipart_chunk(bytes(frame_size)))
+    viewers = multiprocessing.Process(
+        target=run_viewers, args=(args.port, args.viewers, args.duration, chunk_size, queue)
+    )
+    viewers.start()
+    time.sleep(1.0)
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    feed_frames(output, args.framerate, frame_size, args.duration - 1.5)
+    wall = time.perf_counter() - wall_start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    received_fps = queue.get()
+    viewers.join()
+    server.shutdown()
+
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    sustained = sum(fps >= 0.9 * args.framerate for fps in received_fps)
+    print(
+        f"Server: {args.server}, viewers: {args.viewers}, "
+        f"target: {args.framerate} fps x {args.frame_kb} kB"
+    )
+    print(
+        f"Received fps per viewer: median={statistics.median(received_fps):.1f} "
+        f"min={min(received_fps):.1f}"
+    )
+    print(f"Viewers sustaining >= 90% of target fps: {sustained}/{args.viewers}")
+    print(f"Server process CPU: {100 * cpu / wall:.1f}% of one core")
@@ -0,0 +1,39 @@
+"""Benchmark TTL-out scheduling with the simulated GPIO module (runs on any Linux machine)."""
+
+import argparse
+import time
+
+from rpi_camera_colony.acquisition.simulation import gpio
+from rpi_camera_colony.acquisition.ttl import RPiGPIOBackend, TTLPulseGenerator
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--framerate", "-fps", default=90, type=int)
+    parser.add_argument("--duration", "-t", default=5.0, type=float)
+    parser.add_argument("--pulse-duration", default=0.001, type=float)
+    args = parser.parse_args()
+
+    generator = TTLPulseGenerator(
+        pin=8, backend=RPiGPIOBackend(gpio_module=gpio), pulse_duration=args.pulse_duration
+    )
+    generator.start()
+
+    frame_interval = 1.0 / args.framerate
+    n_frames = int(args.duration * args.framerate)
+    trigger_cost = []
+    next_frame = time.perf_counter()
+    for _ in range(n_frames):
+        next_frame += frame_interval
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+        t0 = time.perf_counter()
+        generator.trigger()
+        trigger_cost.append(time.perf_counter() - t0)
+
+    generator.close()
+    trigger_cost.sort()
+    print(f"Frames: {n_frames} at {args.framerate} fps")
+    print(
+        f"trigger() cost [us]: median={trigger_cost[len(trigger_cost) // 2] * 1e6:.2f} "
+        f"max={trigger_cost[-1] * 1e6:.2f}"
+    )
+    print(f"Trigger-to-edge latency [s]: {generator.latency_stats()}")
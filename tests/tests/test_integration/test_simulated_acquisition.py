@@ -0,0 +1,230 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from rpi_camera_colony.acquisition.simulation import enable_simulation
+
+enable_simulation()
+
+from rpi_camera_colony.acquisition.acquisition_control import PiAcquisitionControl  # noqa: E402
+from rpi_camera_colony.acquisition.camera import Camera  # noqa: E402
+from rpi_camera_colony.acquisition.simulation import gpio  # noqa: E402
+from rpi_camera_colony.command_channel import CommandRouter  # noqa: E402
+from rpi_camera_colony.control import presence  # noqa: E402
+from rpi_camera_colony.control.presence import PresenceTracker  # noqa: E402
+from rpi_camera_colony.files import make_recording_file_names  # noqa: E402
+from rpi_camera_colony.network_communication import (  # noqa: E402
+    SocketCommunication,
+    SocketPoller,
+)
+from rpi_camera_colony.serialization import decode_message  # noqa: E402
+
+
+def test_simulated_acquisition(tmp_path):
+    with PiAcquisitionControl(
+        instance_name="simulated_camera",
+        data_path=str(tmp_path),
+        acquisition_name="test_simulated",
+        control_stream_ip="127.0.0.1",
+        control_stream_port=54599,
+        framerate=30,
+        resolution=(320, 240),
+    ) as control:
+        control._update_camera_status(new_status="start")
+        time.sleep(0.5)
+        gpio.simulate_edge(control.camera.ttl_in_pin, gpio.HIGH)
+        gpio.simulate_edge(control.camera.ttl_in_pin, gpio.LOW)
+        time.sleep(0.5)
+        control._update_camera_status(new_status="stop")
+        files = control.acquisition_files
+
+    ttl_out = pd.read_csv(files["ttl.out"])
+    ttl_in = pd.read_csv(files["ttl.in"])
+    assert 20 <= len(ttl_out) <= 40
+    assert ttl_out["timestamp_frame"].is_monotonic_increasing
+    assert len(ttl_in) == 1
+
+
+def test_simulated_camera_preview_stream(tmp_path):
+    camera = Camera(
+        framerate=30,
+        resolution=(640, 480),
+        stream_video=True,
+        stream_resolution=(160, 120),
+        stream_framerate=10,
+    )
+    files = make_recording_file_names(path=tmp_path / "preview")
+    camera.start_recording(output_files=files, format="h264")
+    time.sleep(1.0)
+    stream_frame = camera.streaming_output.frame
+    frame_count = camera.video_encoder.frame_count
+    camera.stop_recording()
+
+    assert len(stream_frame) == 160 * 120 // 4
+    assert 2 <= camera.streaming_output.generation <= frame_count // 3 + 1
+    assert 20 <= len(pd.read_csv(files["ttl.out"])) <= 40
+
+    # Width only: height from the recording aspect ratio
+    camera = Camera(
+        framerate=30, resolution=(1280, 720), stream_video=True, stream_resolution=[320]
+    )
+    assert camera._stream_resize() == (320, 180)
+    camera.stream_resolution = []
+    assert camera._stream_resize() is None  # recording resolution
+    camera.close()
+
+
+def test_simulated_acquisition_raw_frames(tmp_path):
+    with PiAcquisitionControl(
+        instance_name="simulated_camera",
+        data_path=str(tmp_path),
+        acquisition_name="test_simulated_raw_frames",
+        control_stream_ip="127.0.0.1",
+        control_stream_port=54597,
+        framerate=30,
+        resolution=(640, 480),
+        raw_frames=True,
+        raw_frames_ip="127.0.0.1",
+        raw_frames_port=54596,
+        raw_frames_resolution=(100, 60),
+        raw_frames_framerate=10,
+        raw_frames_hwm=100,
+    ) as control:
+        subscriber = SocketCommunication(
+            address="127.0.0.1", port=54596, pattern="SUB", bind=False, subscribe_to=""
+        )
+        control._update_camera_status(new_status="start")
+        frames = []
+        while len(frames) < 5:
+            assert subscriber.socket.poll(timeout=2000)
+            frames.append(subscriber.recv_array_with_metadata(copy=False))
+        control._update_camera_status(new_status="stop")
+        subscriber.close()
+        ttl_out = pd.read_csv(control.acquisition_files["ttl.out"])
+
+    metadata, array = frames[-1]
+    assert array.shape == (60, 100)
+    assert array.dtype == np.uint8
+    assert metadata["resolution"] == [100, 60]
+    frame_indices = [metadata["frame_index"] for metadata, _ in frames]
+    assert all(index % 3 == 0 for index in frame_indices)
+    timestamps = [metadata["timestamp_camera"] for metadata, _ in frames]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[0] >= ttl_out["timestamp_frame"].iloc[0]
+
+
+def test_simulated_camera_h264_stream(tmp_path):
+    camera = Camera(framerate=30, resolution=(320, 240), stream_video=True, stream_mode="h264")
+    frames = []
+    camera.start_recording(
+        output_files=make_recording_file_names(path=tmp_path / "h264"),
+        format="h264",
+        intra_period=10,
+    )
+    camera.h264_stream_output.add_frame_callback(lambda frame, key: frames.append((frame, key)))
+    time.sleep(1.0)
+    camera.stop_recording()
+
+    assert camera.streaming_output is None  # no MJPEG encoder on splitter port 2
+    assert 20 <= len(frames) <= camera.video_encoder.frame_count
+    key_frames = [frame for frame, key_frame in frames if key_frame]
+    assert len(key_frames) >= 2
+    assert all(frame.startswith(camera.h264_stream_output.config) for frame in key_frames)
+
+
+def test_simulated_acquisition_acknowledged_commands(tmp_path):
+    router_socket = SocketCommunication(address="127.0.0.1", port=54613, pattern="ROUTER")
+    router = CommandRouter(socket_wrapper=router_socket)
+    router.start()
+
+    with PiAcquisitionControl(
+        instance_name="simulated_camera",
+        data_path=str(tmp_path),
+        acquisition_name="test_simulated_commands",
+        control_stream_ip="127.0.0.1",
+        control_stream_port=54613,
+        framerate=30,
+        resolution=(320, 240),
+    ) as control:
+        assert router.wait_for_peers(["simulated_camera"], timeout=2) == []
+        config_ack = router.send(
+            "simulated_camera", {"type": "config", "video_quality": 30, "framerate": 20}
+        )
+        assert config_ack["ok"]
+        assert control.video_quality == 30 and control.camera.framerate == 20
+
+        start_at = time.time() + 0.5
+        pending_start = router.send(
+            "simulated_camera",
+            {"type": "command", "status": "start", "start_at": start_at},
+            wait=False,
+        )
+        # Handled while the start is scheduled
+        metadata = {"type": "metadata", "start_skew": {"skew": 0.0}}
+        assert router.send("simulated_camera", metadata)["ok"]
+        assert control.session_metadata == {"start_skew": {"skew": 0.0}}
+        assert not control.camera.recording
+
+        start_ack = pending_start.wait(timeout=3)
+        assert start_ack["ok"]
+        assert control.camera.recording  # acknowledged after the command was handled
+        assert 0 <= start_ack["result"]["start_offset"] < 0.2  # first frame at 20 fps
+        assert control.start_offset == control.camera.first_frame_time - start_at
+        assert control.start_at == start_at
+        time.sleep(0.5)
+        assert router.send("simulated_camera", {"type": "command", "status": "stop"})["ok"]
+        assert router.send("simulated_camera", {"type": "command", "status": "close"})["ok"]
+        assert not control.active
+        files = control.acquisition_files
+
+    router.stop()
+    router_socket.close()
+    assert router.stats()["simulated_camera"]["acknowledged"] == 5
+    assert 5 <= len(pd.read_csv(files["ttl.out"])) <= 15
+
+
+def test_simulated_acquisition_heartbeats(tmp_path):
+    log_socket = SocketCommunication(
+        address="127.0.0.1", port=54615, pattern="SUB", subscribe_to=""
+    )
+    tracker = PresenceTracker()
+    states = []
+
+    def receive(message):
+        topic, heartbeat = message[0].decode(), decode_message(message[1])
+        if topic.endswith(".HEARTBEAT"):
+            states.append(heartbeat["state"])
+            tracker.update(instance_name=topic.rsplit(".", 1)[0], heartbeat=heartbeat)
+
+    poller = SocketPoller(socket_dict={"log": log_socket.socket}, recv_callback_dict=receive)
+    poller.start()
+
+    with PiAcquisitionControl(
+        instance_name="simulated_camera",
+        data_path=str(tmp_path),
+        acquisition_name="test_simulated_heartbeats",
+        control_stream_ip="127.0.0.1",
+        control_stream_port=54616,
+        log_ip="127.0.0.1",
+        log_port=54615,
+        heartbeat_interval=0.1,
+        framerate=30,
+        resolution=(320, 240),
+    ) as control:
+        assert tracker.wait_until_ready(["simulated_camera"], timeout=2) == []
+        control._update_camera_status(new_status="start")
+        time.sleep(0.3)
+        assert tracker.heartbeats["simulated_camera"]["state"] == presence.RECORDING
+        control._update_camera_status(new_status="stop")
+        time.sleep(0.3)
+
+    poller.stop()
+    log_socket.close()
+    assert states[0] in (presence.BOOTED, presence.CAMERA_WARMED)  # first may be lost
+    assert [s for i, s in enumerate(states) if i == 0 or s != states[i - 1]][-4:] == [
+        presence.PREVIEW_DONE,
+        presence.RECORDING,
+        presence.STOPPED,
+        presence.CLOSING,
+    ]
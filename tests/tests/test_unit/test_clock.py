@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+import pytest
+
+from rpi_camera_colony.clock import ClockDriftModel, summarise_start_offsets, wait_until
+from rpi_camera_colony.readers import camera_time_to_system_time
+
+
+def test_clock_drift_model_fit_and_roundtrip():
+    rng = np.random.default_rng(0)
+    camera_time = np.arange(0, 3600 * 10**6, 10**6, dtype=np.int64) + 123456
+    realtime = 1.7e9 + 0.25 + (camera_time - 123456) * 1e-6 * (1 + 20e-6)
+    realtime += rng.normal(0, 20e-6, len(camera_time))
+
+    model = ClockDriftModel()
+    for cam, real in zip(camera_time, realtime):
+        model.add_sample(cam, real)
+
+    assert abs(model.drift_ppm - 20) < 0.1
+    assert model.residual_std < 40e-6
+
+    query = np.array([123456, 1800 * 10**6, 3599 * 10**6])
+    expected = 1.7e9 + 0.25 + (query - 123456) * 1e-6 * (1 + 20e-6)
+    assert np.abs(model.predict(query) - expected).max() < 10e-6
+
+    clock_models = {"realtime": model.to_dict()}
+    restored = camera_time_to_system_time(query, clock_models=clock_models)
+    assert np.abs(restored - model.predict(query)).max() < 1e-6
+
+    restored_model = ClockDriftModel.from_dict(model.to_dict())
+    assert restored_model.to_dict() == pytest.approx(model.to_dict())
+
+
+def test_wait_until_and_start_skew():
+    start_at = time.time() + 0.05
+    lateness = wait_until(start_at)
+    assert 0 <= time.time() - start_at < 0.01
+    assert 0 <= lateness < 0.005
+    assert wait_until(start_at) > 0  # already passed: returns at once
+
+    summary = summarise_start_offsets(
+        start_at=start_at, offsets={"camera_a": 0.001, "camera_b": 0.004, "camera_c": None}
+    )
+    assert summary["missing"] == ["camera_c"]
+    assert abs(summary["skew"] - 0.003) < 1e-9
+    assert summary["first"] == "camera_a" and summary["last"] == "camera_b"
+    assert "skew" not in summarise_start_offsets(start_at=start_at, offsets={"camera_a": None})
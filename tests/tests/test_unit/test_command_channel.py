@@ -0,0 +1,121 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from rpi_camera_colony.command_channel import CommandReceiver, CommandRouter
+from rpi_camera_colony.network_communication import (
+    SocketCommunication,
+    SocketPoller,
+    find_available_port,
+)
+
+
+def _make_remote(port, instance_name, handler):
+    socket_wrapper = SocketCommunication(
+        address="127.0.0.1", port=port, pattern="DEALER", bind=False, identity=instance_name
+    )
+    receiver = CommandReceiver(socket_wrapper=socket_wrapper, handler=handler)
+    receiver.say_hello()
+    poller = SocketPoller(
+        socket_dict={"control": socket_wrapper.socket}, recv_callback_dict=receiver.receive
+    )
+    receiver.call_soon = poller.call_soon
+    poller.start()
+    return socket_wrapper, poller
+
+
+def test_command_router_acks_retries_and_late_remote():
+    port = find_available_port(start_port=54611, ip_address="127.0.0.1")
+    router_socket = SocketCommunication(address="127.0.0.1", port=port, pattern="ROUTER")
+    router = CommandRouter(socket_wrapper=router_socket, ack_timeout=0.2, retries=2)
+    router.start()
+
+    # Sent before the remote connects: delivered on hello
+    early = router.send("camera_a", {"type": "command", "status": "reset"}, wait=False)
+
+    handled = []
+
+    def handler(message):
+        if message.get("status") == "fail":
+            raise ValueError("test")
+        if message.get("status") == "slow" and not handled.count(message):
+            time.sleep(0.5)  # longer than ack_timeout: received, so not re-sent
+        handled.append(message)
+
+    remote_socket, remote_poller = _make_remote(port, "camera_a", handler)
+    assert router.wait_for_peers(["camera_a", "camera_b"], timeout=0.5) == ["camera_b"]
+    assert early.wait(timeout=2)["ok"]
+    assert router.peer_codecs["camera_a"] == "json"  # no codecs in hello
+
+    assert router.send("camera_a", {"type": "command", "status": "slow"})["ok"]
+    assert handled.count({"type": "command", "status": "slow"}) == 1
+
+    ack = router.send("camera_a", {"type": "command", "status": "fail"})
+    assert ack["ok"] is False and ack["error"] == "test"
+
+    start = time.monotonic()
+    assert router.send("camera_b", {"type": "command", "status": "start"}) is None
+    assert 0.5 <= time.monotonic() - start < 2.0
+
+    stats = router.stats()
+    assert stats["camera_a"]["acknowledged"] == 3
+    assert stats["camera_a"]["retries"] >= 1
+    assert stats["camera_a"]["latency"]["p50_ms"] > 0
+    assert stats["camera_b"] == {
+        "sent": 1,
+        "acknowledged": 0,
+        "retries": 2,
+        "failed": 1,
+        "connected": False,
+        "latency": {},
+    }
+
+    remote_poller.stop()
+    remote_socket.close()
+    router.stop()
+    assert not router.is_alive()
+    assert router.send("camera_a", {"type": "command", "status": "stop"}) is None
+    router_socket.close()
+
+
+def test_command_receiver_deferred_ack():
+    port = find_available_port(start_port=54631, ip_address="127.0.0.1")
+    router_socket = SocketCommunication(address="127.0.0.1", port=port, pattern="ROUTER")
+    router = CommandRouter(socket_wrapper=router_socket, ack_timeout=0.2, retries=2)
+    router.start()
+
+    handled = []
+
+    def handler(message):
+        handled.append(message["status"])
+        if message["status"] == "start":
+            result = Future()
+            threading.Timer(0.5, result.set_result, args=({"start_offset": 0.001},)).start()
+            return result
+        if message["status"] == "fail":
+            result = Future()
+            threading.Timer(0.1, result.set_exception, args=(ValueError("test"),)).start()
+            return result
+
+    remote_socket, remote_poller = _make_remote(port, "camera_a", handler)
+    assert router.wait_for_peers(["camera_a"], timeout=2) == []
+
+    start = router.send("camera_a", {"type": "command", "status": "start"}, wait=False)
+    # Not blocked by the pending start
+    assert router.send("camera_a", {"type": "command", "status": "preview"})["ok"]
+    assert not start.done.is_set()
+
+    assert start.wait(timeout=2) == {
+        "type": "ack",
+        "id": start.command_id,
+        "ok": True,
+        "result": {"start_offset": 0.001},
+    }
+    ack = router.send("camera_a", {"type": "command", "status": "fail"})
+    assert ack["ok"] is False and ack["error"] == "test"
+    assert handled == ["start", "preview", "fail"]
+
+    remote_poller.stop()
+    remote_socket.close()
+    router.stop()
+    router_socket.close()
@@ -0,0 +1,15 @@
+from rpi_camera_colony.acquisition.frame_monitor import FrameGapMonitor
+
+
+def test_frame_gap_monitor_counts_drops_and_late_frames():
+    monitor = FrameGapMonitor(framerate=100)  # 10000 us interval
+    pts = [0, 10000, 20000, 33000, 43000, 73000, 83000]
+    for p in [-(2**63)] + pts:
+        monitor.update(p)
+
+    stats = monitor.snapshot()
+    assert stats["frame_count"] == len(pts)
+    assert stats["late_frames"] == 1  # 13000 us gap
+    assert stats["dropped_frames"] == 2  # 30000 us gap
+    assert stats["max_gap_us"] == 30000
+    assert sum(stats["gap_histogram"]) == len(pts) - 1
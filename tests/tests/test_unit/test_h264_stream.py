@@ -0,0 +1,56 @@
+import socket
+import time
+
+from rpi_camera_colony.acquisition.h264_stream import H264StreamOutput, H264StreamServer
+
+SPS_PPS = b"\x00\x00\x00\x01\x27sps\x00\x00\x00\x01\x28pps"
+
+
+def _write_frame(output, i, key_frame=False):
+    if key_frame:
+        output.write_buffer(SPS_PPS, config=True)
+    nal = b"\x00\x00\x00\x01" + (b"\x25" if key_frame else b"\x21") + bytes([i]) * 50
+    output.write_buffer(nal[:20], key_frame=key_frame)
+    output.write_buffer(nal[20:], key_frame=key_frame, frame_end=True)
+    return nal
+
+
+def test_h264_stream_output():
+    output = H264StreamOutput()
+    frames = []
+    output.add_frame_callback(lambda frame, key_frame: frames.append((frame, key_frame)))
+
+    nal = _write_frame(output, 0, key_frame=True)
+    assert frames[-1] == (SPS_PPS + nal, True)
+    nal = _write_frame(output, 1)
+    assert frames[-1] == (nal, False)
+    assert output.config == SPS_PPS
+    assert output.frame_count == 2
+
+
+def test_h264_stream_server_joins_at_key_frame():
+    output = H264StreamOutput()
+    server = H264StreamServer(output=output, address="127.0.0.1", port=0)
+    server.start()
+
+    _write_frame(output, 0, key_frame=True)
+    viewer = socket.create_connection(("127.0.0.1", server.port))
+    while not server.clients:
+        time.sleep(0.01)
+
+    _write_frame(output, 1)  # not sent: viewer waits for the next key frame
+    expected = b""
+    for i in range(2, 6):
+        expected += _write_frame(output, i, key_frame=i == 2)
+        time.sleep(0.01)
+
+    viewer.settimeout(2)
+    received = b""
+    while len(received) < len(SPS_PPS) + len(expected):
+        received += viewer.recv(65536)
+    assert received == SPS_PPS + expected
+
+    client = next(iter(server.clients))
+    assert (client.frames_delivered, client.frames_skipped) == (4, 1)
+    viewer.close()
+    server.shutdown()
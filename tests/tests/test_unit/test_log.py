@@ -0,0 +1,66 @@
+import logging
+
+import zmq
+
+from rpi_camera_colony.log import LogBatchSender, unpack_log_batch
+
+
+def _receive_batches(pull):
+    batches = []
+    while pull.poll(500):
+        topic, data = pull.recv_multipart()
+        assert topic == b"camera_a.LOGBATCH"
+        batches.append(unpack_log_batch(data))
+    return batches
+
+
+def test_log_batch_sender_batches_and_drops():
+    context = zmq.Context()
+    pull = context.socket(zmq.PULL)
+    pull.bind("inproc://log-batches")
+    push = context.socket(zmq.PUSH)
+    push.connect("inproc://log-batches")
+
+    sender = LogBatchSender(
+        socket=push,
+        root_topic="camera_a",
+        formatter=logging.Formatter("%(levelname)s - %(message)s"),
+        queue_size=100,
+        batch_size=40,
+        max_batch_rate=5.0,
+    )
+    logger = logging.getLogger("test_log_batch_sender")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(sender.handler)
+
+    # Queue full before the sender runs: records are dropped, not blocking
+    for i in range(120):
+        logger.debug(f"message {i}")
+    assert sender.handler.dropped == 20
+
+    sender.start()
+    state = ["before"]
+    logger.info("state %s", state)
+    state[0] = "after"
+    logger.warning("last")
+    sender.handler.close()
+    assert not sender.is_alive()
+
+    batches = _receive_batches(pull)
+    records = [record for batch_records, _ in batches for record in batch_records]
+    assert len(batches) == 3 and all(len(batch_records) <= 40 for batch_records, _ in batches)
+    assert records[0] == ["DEBUG", "DEBUG - message 0"]
+    assert records[-1] == ["WARNING", "WARNING - last"]
+    assert records[-2] == ["INFO", "INFO - state ['before']"]
+    assert len(records) == 102
+    assert batches[-1][1] == 20
+
+    stats = sender.stats()
+    assert stats["records_sent"] == 102 and stats["batches_sent"] == 3
+    assert stats["queued"] == 0
+
+    logger.removeHandler(sender.handler)
+    push.close()
+    pull.close()
+    context.term()
@@ -0,0 +1,138 @@
+import time
+
+import zmq
+
+from rpi_camera_colony.network_communication import (
+    SocketCommunication,
+    SocketPoller,
+    find_available_port,
+    zmq_context,
+)
+
+
+def _wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def _push_pull_pair(context, name):
+    pull = context.socket(zmq.PULL)
+    pull.bind(f"inproc://{name}")
+    push = context.socket(zmq.PUSH)
+    push.connect(f"inproc://{name}")
+    return push, pull
+
+
+def test_socket_poller_many_sockets_and_instances():
+    context = zmq.Context()
+    pairs = {f"socket{i}": _push_pull_pair(context, f"poller-{i}") for i in range(20)}
+    other_push, other_pull = _push_pull_pair(context, "poller-other")
+
+    received = {}
+    poller = SocketPoller(
+        socket_dict={name: pull for name, (_, pull) in pairs.items()},
+        recv_callback_dict={
+            name: (lambda message, name=name: received.setdefault(name, []).append(message))
+            for name in pairs
+        },
+    )
+    other_received = []
+    other_poller = SocketPoller(
+        socket_dict={"other": other_pull}, recv_callback_dict=other_received.append
+    )
+    poller.start()
+    other_poller.start()
+
+    for name, (push, _) in pairs.items():
+        for i in range(5):
+            push.send_multipart([name.encode(), str(i).encode()])
+    other_push.send_multipart([b"other", b"0"])
+
+    assert _wait_for(lambda: sum(len(messages) for messages in received.values()) == 100)
+    assert _wait_for(lambda: len(other_received) == 1)
+    assert received["socket3"][-1] == [b"socket3", b"4"]
+    assert set(other_poller.sockets) == {"other"}  # no state shared between instances
+
+    stats = poller.stats()
+    assert stats["socket0"]["messages"] == 5
+    assert stats["socket0"]["bytes"] == 5 * (len(b"socket0") + 1)
+    assert stats["socket0"]["rate_hz"] > 0
+    assert poller.stats()["socket0"]["rate_hz"] > 0  # reading does not reset the rate window
+    poller.stats(reset=True)
+    assert poller.stats()["socket0"]["rate_hz"] == 0
+    assert "p50_ms" in stats["socket0"]["callback_latency"]
+
+    poller.stop()
+    assert not poller.is_alive()
+    assert other_poller.is_alive()
+
+    other_push.send_multipart([b"other", b"1"])
+    assert _wait_for(lambda: len(other_received) == 2)
+    other_poller.stop()
+    assert not other_poller.is_alive()
+
+    for push, pull in list(pairs.values()) + [(other_push, other_pull)]:
+        push.close()
+        pull.close()
+    context.term()
+
+
+def test_socket_poller_add_remove_and_failing_callback():
+    context = zmq.Context()
+    push, pull = _push_pull_pair(context, "poller-add")
+    received = []
+
+    def callback(message):
+        if message == [b"fail"]:
+            raise ValueError("test")
+        received.append(message)
+
+    poller = SocketPoller()
+    poller.start()
+    poller.add_socket("added", pull, callback)
+
+    push.send_multipart([b"fail"])
+    push.send_multipart([b"ok"])
+    assert _wait_for(lambda: received == [[b"ok"]])
+
+    poller.remove_socket("added")
+    assert _wait_for(lambda: not poller.sockets)
+    poller.stop()
+    assert not poller.is_alive()
+
+    push.close()
+    pull.close()
+    context.term()
+
+
+def test_shared_context_and_socket_registry():
+    port = find_available_port(start_port=54601, ip_address="127.0.0.1")
+    publisher = SocketCommunication(address="127.0.0.1", port=port, pattern="PUB")
+    subscriber = SocketCommunication(
+        address="127.0.0.1", port=port, pattern="SUB", bind=False, subscribe_to="topic"
+    )
+    assert publisher.socket.context is subscriber.socket.context is zmq_context.context
+    assert {publisher, subscriber} <= set(zmq_context.sockets)
+
+    received = []
+    poller = SocketPoller(
+        socket_dict={"sub": subscriber.socket}, recv_callback_dict=received.append
+    )
+    poller.start()
+    # Re-send until the subscription is connected
+    assert _wait_for(lambda: publisher.send_multipart("topic", "message") or received)
+    poller.stop()
+
+    stats = {entry["address"]: entry for entry in zmq_context.stats()}
+    entry = stats[f"tcp://127.0.0.1:{port}"]
+    assert entry["pattern"] in ("PUB", "SUB")
+    assert publisher.stats()["messages_sent"] >= 1
+    assert subscriber.stats()["messages_received"] == len(received)
+
+    with subscriber:
+        pass
+    publisher.close()
+    assert subscriber.socket is None
+    assert publisher not in zmq_context.sockets and subscriber not in zmq_context.sockets
@@ -0,0 +1,40 @@
+import logging
+import time
+from threading import Timer
+
+from rpi_camera_colony.control import presence
+from rpi_camera_colony.control.presence import PresenceTracker
+
+
+def test_presence_ready_and_stale(caplog):
+    tracker = PresenceTracker(timeout=0.2, check_interval=0.05)
+    tracker.update("camera_a", {"state": presence.BOOTED})
+    tracker.update("camera_b", {"state": presence.PREVIEW_DONE})
+
+    start = time.monotonic()
+    assert tracker.wait_until_ready(["camera_a", "camera_b"], timeout=0.2) == ["camera_a"]
+    assert time.monotonic() - start >= 0.2
+
+    Timer(0.1, tracker.update, args=("camera_a", {"state": presence.PREVIEW_DONE})).start()
+    start = time.monotonic()
+    assert tracker.wait_until_ready(["camera_a", "camera_b"], timeout=2) == []
+    assert time.monotonic() - start < 1.0
+    assert tracker.wait_until_ready(["camera_a"], timeout=0.1, condition=lambda name: False)
+
+    tracker.start()
+    with caplog.at_level(logging.INFO):
+        tracker.update("camera_a", {"state": presence.RECORDING})
+        tracker.update("camera_b", {"state": presence.STOPPED})
+        time.sleep(0.4)
+        assert tracker.stale == {"camera_a", "camera_b"}
+        warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+        assert len(warnings) == 1 and "camera_a" in warnings[0].getMessage()
+
+        tracker.update("camera_a", {"state": presence.RECORDING})
+        assert "camera_a" not in tracker.stale
+    tracker.stop()
+
+    summary = tracker.summary()
+    assert summary["camera_a"]["state"] == presence.RECORDING
+    assert summary["camera_a"]["age"] < summary["camera_b"]["age"]
+    assert summary["camera_b"]["stale"]
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pandas as pd
+
+from rpi_camera_colony.acquisition.pretrigger import ClipWriter, PreTriggerBuffer
+from rpi_camera_colony.files import make_clip_file_names, make_recording_file_names
+
+
+def _fill_buffer(buffer, n_frames, interval=10000, intra_period=10):
+    for i in range(n_frames):
+        if i % intra_period == 0:
+            buffer.write(b"C")
+            buffer.end_frame(pts=None, config=True)
+        buffer.write(f"{i};".encode())
+        buffer.end_frame(pts=i * interval, key_frame=i % intra_period == 0)
+
+
+def test_pretrigger_buffer_starts_at_key_frame_and_drops_old_frames():
+    buffer = PreTriggerBuffer(seconds=0.5)
+    _fill_buffer(buffer, n_frames=100)
+
+    frames = buffer.get_frames(start_pts=0, end_pts=10**9)
+    assert frames[0][0] == 500000  # oldest buffered key frame
+    assert frames[-1][0] == 990000
+
+    frames = buffer.get_frames(start_pts=735000, end_pts=800000)
+    assert [f[0] for f in frames][0] == 700000
+    assert frames[-1][0] == 800000
+    assert frames[0][2] == b"C70;"  # config is prepended to key frame
+
+
+def test_clip_writer_merges_overlapping_triggers(tmp_path):
+    recording_files = make_recording_file_names(path=tmp_path / "test.cam1")
+    buffer = PreTriggerBuffer(seconds=10)
+    _fill_buffer(buffer, n_frames=300)
+
+    writer = ClipWriter(
+        buffer=buffer, recording_files=recording_files, pre_seconds=0.2, post_seconds=0.2
+    )
+    writer.trigger(trigger_pts=1000000, source="ttl")
+    writer.trigger(trigger_pts=1100000, source="ttl")  # extends first clip
+    writer.trigger(trigger_pts=2500000, source="command")
+    writer.close()
+
+    assert writer.trigger_count == 3
+    assert writer.clip_count == 2
+
+    clips = pd.read_csv(recording_files["clips"])
+    assert clips["trigger_source"].tolist() == ["ttl", "command"]
+    assert clips["first_frame_timestamp"].tolist() == [800000, 2300000]
+    assert clips["last_frame_timestamp"].tolist() == [1300000, 2700000]
+
+    clip_files = make_clip_file_names(recording_files=recording_files, clip_index=0)
+    timestamps = pd.read_csv(clip_files["timestamps"])
+    assert len(timestamps) == clips["n_frames"][0]
+    assert Path(clip_files["video"]).read_bytes().startswith(b"C80;")
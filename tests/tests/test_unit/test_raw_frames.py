@@ -0,0 +1,42 @@
+import numpy as np
+
+from rpi_camera_colony.acquisition.raw_frames import RawFrameOutput
+
+
+def _frame(value, frame_size):
+    return np.full(frame_size, value, dtype=np.uint8).tobytes()
+
+
+def test_raw_frame_output_carries_overflow_and_realigns():
+    output = RawFrameOutput(resolution=(32, 16), format="yuv")
+    frame_size = output.frame_size
+    received = []
+    output.add_frame_callback(lambda array, metadata: received.append((array, metadata)))
+
+    # Frame 0 split into two buffers, frames 1 & 2 in one buffer with frame 3 started
+    data = _frame(0, frame_size) + _frame(1, frame_size) + _frame(2, frame_size)
+    data += _frame(3, frame_size)
+    output.set_frame_info(frame_index=0, pts=100)
+    output.write(data[:100])
+    output.write(data[100:frame_size])
+    output.end_frame()
+    output.set_frame_info(frame_index=1, pts=200)
+    output.write(data[frame_size : 3 * frame_size + 10])
+    output.set_frame_info(frame_index=3, pts=400)
+    output.write(data[3 * frame_size + 10 :])
+    output.end_frame()
+
+    assert [int(array[0, 0]) for array, _ in received] == [0, 1, 2, 3]
+    assert all((array == i).all() for i, (array, _) in enumerate(received))
+    assert received[0][1]["frame_index"] == 0 and received[0][1]["timestamp_camera"] == 100
+    # Frames that start within a buffer get the info of that buffer
+    assert [metadata["frame_index"] for _, metadata in received] == [0, 1, 1, 1]
+    assert [metadata["frame_count"] for _, metadata in received] == [0, 1, 2, 3]
+
+    # Short frame is discarded at its end, the next frame is aligned again
+    output.write(_frame(9, frame_size)[:50])
+    output.end_frame()
+    output.write(_frame(4, frame_size))
+    output.end_frame()
+    assert output.incomplete_frames == 1
+    assert (received[-1][0] == 4).all()
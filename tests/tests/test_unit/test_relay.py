@@ -0,0 +1,74 @@
+import io
+import time
+
+import numpy as np
+import pytest
+
+from rpi_camera_colony.acquisition.streaming import AsyncStreamingServer, StreamingOutput
+from rpi_camera_colony.control.relay import MosaicCompositor, StreamRelay
+
+
+def _wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_stream_relay():
+    cameras = {}
+    for name in ["cam_a", "cam_b"]:
+        output = StreamingOutput()
+        cameras[name] = (output, AsyncStreamingServer(output=output, address="127.0.0.1", port=0))
+        cameras[name][1].start()
+
+    relay = StreamRelay(
+        stream_urls={name: f"http://127.0.0.1:{s.port}/" for name, (_, s) in cameras.items()},
+        address="127.0.0.1",
+        port=0,
+        mosaic_framerate=0,
+    )
+    relay.start()
+    assert _wait_for(lambda: all(r.connected for r in relay.receivers.values()))
+
+    for i in range(5):
+        for j, (output, _) in enumerate(cameras.values()):
+            output.write(b"\xff\xd8" + bytes([10 * j + i]) * 100 + b"\xff\xd9")
+        time.sleep(0.05)
+
+    relayed = relay.server.outputs
+    assert _wait_for(lambda: relayed["cam_b"].generation == 5)
+    assert relayed["cam_a"].frame == b"\xff\xd8" + bytes([4]) * 100 + b"\xff\xd9"
+    assert relayed["cam_b"].frame == b"\xff\xd8" + bytes([14]) * 100 + b"\xff\xd9"
+    assert "mosaic" not in relayed
+    assert relay.stats()["cameras"]["cam_a"] == {"connected": True, "frames": 5}
+
+    relay.stop()
+    for _, server in cameras.values():
+        server.shutdown()
+
+
+def test_mosaic_compositor():
+    Image = pytest.importorskip("PIL.Image")
+
+    outputs = {}
+    for i, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+        jpeg = io.BytesIO()
+        Image.new("RGB", (640, 480), color).save(jpeg, format="JPEG")
+        outputs[f"cam_{i}"] = StreamingOutput()
+        outputs[f"cam_{i}"].write(jpeg.getvalue())
+
+    compositor = MosaicCompositor(outputs=outputs, tile_size=(160, 120))
+    assert (compositor.rows, compositor.columns) == (2, 2)
+    assert compositor.update_tiles() == 3
+    assert compositor.update_tiles() == 0  # no new frames
+
+    mosaic = compositor.compose()
+    assert mosaic.shape == (240, 320, 3)
+    assert np.allclose(mosaic[100, 80], [255, 0, 0], atol=8)  # lower part of tile, below label
+    assert np.allclose(mosaic[100, 240], [0, 255, 0], atol=8)
+    assert np.allclose(mosaic[220, 80], [0, 0, 255], atol=8)
+    assert not mosaic[120:, 160:].any()  # empty tile
+
+    compositor.output.write(compositor.encode())
+    assert Image.open(io.BytesIO(compositor.output.frame)).size == (320, 240)
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from rpi_camera_colony import serialization
+from rpi_camera_colony.serialization import (
+    HEADER_VERSION,
+    decode_message,
+    encode_message,
+    get_message_codec,
+    negotiate_codec,
+)
+
+MESSAGE = {"state": "recording", "sys_time": 1634567890.123, "shape": [480, 640], "ok": None}
+
+
+def test_json_round_trip_and_plain_json():
+    data = encode_message(MESSAGE, "json")
+    assert data[:2] == bytes([HEADER_VERSION, 1])
+    assert get_message_codec(data) == "json"
+    assert decode_message(data) == MESSAGE
+
+    # Messages of senders without header
+    plain = json.dumps(MESSAGE).encode()
+    assert get_message_codec(plain) == "json"
+    assert decode_message(plain) == MESSAGE
+
+    # Unknown codecs fall back to JSON
+    assert get_message_codec(encode_message(MESSAGE, "pickle")) == "json"
+
+    with pytest.raises(ValueError):
+        decode_message(bytes([HEADER_VERSION + 1, 1]) + b"{}")
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    data = encode_message(MESSAGE, "msgpack")
+    assert get_message_codec(data) == "msgpack"
+    assert decode_message(data) == MESSAGE
+    assert len(data) < len(encode_message(MESSAGE, "json"))
+
+
+def test_negotiate_codec(monkeypatch):
+    assert negotiate_codec(remote_codecs=["json"]) == "json"
+    assert negotiate_codec(remote_codecs=None) == "json"
+    assert negotiate_codec(remote_codecs=["msgpack", "json"], preferred=["json"]) == "json"
+
+    monkeypatch.setattr(serialization, "msgpack", None)
+    assert serialization.available_codecs() == ["json"]
+    assert negotiate_codec(remote_codecs=["msgpack", "json"]) == "json"
+    assert get_message_codec(encode_message(MESSAGE, "msgpack")) == "json"
@@ -0,0 +1,54 @@
+from rpi_camera_colony.acquisition.streaming import AsyncStreamingServer, StreamingOutput
+from rpi_camera_colony.control.snapshots import (
+    SnapshotFetcher,
+    get_snapshot_urls,
+    save_contact_sheet,
+)
+
+
+def test_get_snapshot_urls():
+    config_data = {
+        "controllers": {
+            "cam_a": {"address": "10.0.0.1", "stream_video": True, "stream_port": 8001},
+            "cam_b": {
+                "address": "10.0.0.2",
+                "stream_video": True,
+                "stream_address": "10.0.1.2",
+                "stream_port": 8002,
+            },
+            "cam_c": {"address": "10.0.0.3", "stream_video": False, "stream_port": 8001},
+        }
+    }
+    assert get_snapshot_urls(config_data) == {
+        "cam_a": "http://10.0.0.1:8001/snapshot.jpg",
+        "cam_b": "http://10.0.1.2:8002/snapshot.jpg",
+    }
+
+
+def test_snapshot_fetcher_and_contact_sheet(tmp_path):
+    servers = {}
+    for i, name in enumerate(["cam_a", "cam_b"]):
+        output = StreamingOutput()
+        output.write(b"\xff\xd8" + bytes([i]) * 100 + b"\xff\xd9")
+        servers[name] = AsyncStreamingServer(output=output, address="127.0.0.1", port=0)
+        servers[name].start()
+
+    urls = {name: f"http://127.0.0.1:{s.port}/snapshot.jpg" for name, s in servers.items()}
+    urls["cam_offline"] = "http://127.0.0.1:1/snapshot.jpg"
+
+    fetcher = SnapshotFetcher(timeout=1.0)
+    snapshots = fetcher.fetch_all(urls)
+    assert snapshots["cam_a"] == b"\xff\xd8" + bytes([0]) * 100 + b"\xff\xd9"
+    assert snapshots["cam_b"] == b"\xff\xd8" + bytes([1]) * 100 + b"\xff\xd9"
+    assert snapshots["cam_offline"] is None
+
+    # Unchanged frames: 304 responses, served from the fetcher cache
+    assert fetcher.fetch_all(urls) == snapshots
+
+    path = save_contact_sheet(snapshots=snapshots, path=tmp_path / "sheet.html")
+    sheet = path.read_text()
+    assert sheet.count("<img") == 2
+    assert "cam_offline" in sheet
+
+    for server in servers.values():
+        server.shutdown()
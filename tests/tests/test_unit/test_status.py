@@ -0,0 +1,40 @@
+import threading
+import time
+
+from rpi_camera_colony.acquisition.status import StatusPublisher
+
+
+class _RecordingSocket:
+    def __init__(self):
+        self.messages = []
+        self.threads = set()
+
+    def send_message(self, topic="", message=None, flags=0):
+        self.threads.add(threading.get_ident())
+        self.messages.append((topic, message))
+
+
+def test_status_publisher_topics_on_one_socket():
+    socket_wrapper = _RecordingSocket()
+    publisher = StatusPublisher(socket_wrapper=socket_wrapper, instance_name="camera_a")
+    publisher.add_topic(
+        topic="HEARTBEAT", status_callback=lambda: {"state": "booted"}, interval=0.05
+    )
+    publisher.start()
+
+    # Added while running, skipped intervals (None) are not sent
+    publisher.add_topic(topic="FRAMESTATS", status_callback=lambda: None, interval=0.05)
+    publisher.add_topic(topic="TELEMETRY", status_callback=lambda: {"fps": 30.0}, interval=0.2)
+    time.sleep(0.5)
+    publisher.set_interval(topic="TELEMETRY", interval=10.0)
+    publisher.stop()
+    assert not publisher.is_alive()
+
+    topics = [topic for topic, _ in socket_wrapper.messages]
+    assert topics.count("camera_a.TELEMETRY") in (2, 3)
+    assert topics.count("camera_a.HEARTBEAT") >= 6
+    assert "camera_a.FRAMESTATS" not in topics
+    assert socket_wrapper.threads == {publisher.ident}
+
+    publisher.publish(topic="HEARTBEAT")
+    assert socket_wrapper.messages[-1] == ("camera_a.HEARTBEAT", {"state": "booted"})
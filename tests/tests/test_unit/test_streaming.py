@@ -0,0 +1,221 @@
+import json
+import socket
+import threading
+import time
+
+from rpi_camera_colony.acquisition.streaming import (
+    STREAM_RESPONSE_HEADER,
+    AsyncStreamingServer,
+    StreamingHandler,
+    StreamingOutput,
+    make_multipart_chunk,
+)
+
+
+def _jpeg(i, size=100):
+    return b"\xff\xd8" + bytes([i % 256]) * size + b"\xff\xd9"
+
+
+def test_streaming_output_frame_ring():
+    output = StreamingOutput(n_slots=4, slot_size=64)
+    reader = output.reader()
+    assert reader.next_frame(timeout=0.01) is None
+
+    frame = _jpeg(1)
+    output.write(frame[:50])  # frames arrive in chunks, slot grows past 64 bytes
+    output.write(frame[50:])
+    view = reader.next_frame(timeout=0.01)
+    assert isinstance(view, memoryview)
+    assert view == frame
+    assert output.generation == 1
+
+    for i in range(2, 5):
+        output.write(_jpeg(i))
+    assert reader.next_frame(timeout=0.01) == _jpeg(4)
+    assert reader.stats()["skipped"] == 2
+    assert reader.frame_valid()
+
+    for i in range(5, 8):  # slot of frame 4 is being rewritten
+        output.write(_jpeg(i))
+    assert not reader.frame_valid()
+    assert reader.stats() == {"generation": 4, "delivered": 2, "skipped": 2, "torn": 1}
+    assert output.frame == _jpeg(7)
+
+
+def _http_get(port, path="/"):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=2)
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+    return sock
+
+
+def test_async_streaming_server_fan_out():
+    output = StreamingOutput()
+    server = AsyncStreamingServer(output=output, address="127.0.0.1", port=0)
+    server.start()
+
+    assert _http_get(server.port, "/missing").recv(1024).startswith(b"HTTP/1.0 404")
+
+    viewers = [_http_get(server.port) for _ in range(3)]
+    while len(server.clients) < 3:
+        time.sleep(0.01)
+    output.write(_jpeg(1))
+
+    expected = STREAM_RESPONSE_HEADER + make_multipart_chunk(_jpeg(1))
+    for viewer in viewers:
+        data = b""
+        while len(data) < len(expected):
+            data += viewer.recv(4096)
+        assert data == expected
+        viewer.close()
+    server.shutdown()
+
+
+def test_async_streaming_server_slow_client_and_fps_limit():
+    output = StreamingOutput()
+    server = AsyncStreamingServer(output=output, address="127.0.0.1", port=0)
+    server.start()
+
+    slow_viewer = socket.socket()
+    slow_viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow_viewer.connect(("127.0.0.1", server.port))
+    slow_viewer.sendall(b"GET / HTTP/1.1\r\n\r\n")
+    limited_viewer = _http_get(server.port, "/?fps=5")
+    while len(server.clients) < 2:
+        time.sleep(0.01)
+
+    for i in range(50):  # 1 s at 50 fps, slow viewer does not read
+        output.write(_jpeg(i, size=200000))
+        time.sleep(0.02)
+
+    clients = {client.max_fps: client for client in server.clients}
+    assert clients[None].frames_skipped > 0
+    assert (
+        48 <= clients[None].frames_delivered + clients[None].frames_skipped <= 50
+    )  # 1 pending, 1 sending
+    assert clients[None].writer.transport.get_write_buffer_size() <= len(
+        make_multipart_chunk(_jpeg(0, size=200000))
+    )
+    assert 4 <= clients[5.0].frames_delivered <= 7
+
+    stats = json.loads(_http_get(server.port, "/stats").makefile("rb").read().split(b"\r\n\r\n")[1])
+    assert stats["generations"] == {"": 50}
+    assert sorted(c["max_fps"] or 0 for c in stats["clients"]) == [0, 5.0]
+
+    slow_viewer.close()
+    limited_viewer.close()
+    server.shutdown()
+
+
+def test_async_streaming_server_snapshot():
+    output = StreamingOutput()
+    server = AsyncStreamingServer(output=output, address="127.0.0.1", port=0)
+    server.start()
+
+    def get_snapshot(etag=None):
+        viewer = socket.create_connection(("127.0.0.1", server.port))
+        request = "GET /snapshot.jpg HTTP/1.1\r\n"
+        if etag is not None:
+            request += f"If-None-Match: {etag}\r\n"
+        viewer.sendall(request.encode() + b"\r\n")
+        header, _, body = viewer.makefile("rb").read().partition(b"\r\n\r\n")
+        viewer.close()
+        lines = header.decode().split("\r\n")
+        headers = dict(line.split(": ", 1) for line in lines[1:])
+        return lines[0], headers, body
+
+    assert get_snapshot()[0].endswith("503 Service Unavailable")
+
+    output.write(_jpeg(1))
+    status, headers, body = get_snapshot()
+    assert status.endswith("200 OK")
+    assert body == _jpeg(1)
+    assert get_snapshot(etag=headers["ETag"])[0].endswith("304 Not Modified")
+
+    output.write(_jpeg(2))
+    status, new_headers, body = get_snapshot(etag=headers["ETag"])
+    assert status.endswith("200 OK")
+    assert body == _jpeg(2)
+    assert new_headers["ETag"] != headers["ETag"]
+    server.shutdown()
+
+
+class _SlowClientFile:
+    """wfile of a client that is so slow that the encoder writes new frames during each send."""
+
+    def __init__(self, output, n_frames):
+        self.output = output
+        self.n_frames = n_frames
+        self.frames = []
+
+    def write(self, data):
+        if len(data) > 1000:  # JPEG body
+            for _ in range(self.output.n_slots):
+                generation = self.output.generation + 1
+                self.output.write(_jpeg(generation, size=2000 + 500 * (generation % 2)))
+            self.frames.append(bytes(data))
+            if len(self.frames) == self.n_frames:
+                raise ConnectionResetError("client closed")
+
+
+def test_threaded_streaming_handler_sends_intact_frames():
+    output = StreamingOutput(n_slots=3)
+    output.write(_jpeg(1, size=2000))
+
+    handler = StreamingHandler.__new__(StreamingHandler)  # without connection
+    handler.output_from_camera = output
+    handler.path = "/"
+    handler.command = "GET"
+    handler.request_version = "HTTP/1.0"
+    handler.requestline = "GET / HTTP/1.0"
+    handler.client_address = ("127.0.0.1", 0)
+    handler.log_message = lambda *args: None
+    handler.wfile = _SlowClientFile(output=output, n_frames=5)
+    handler.do_GET()
+
+    assert len(handler.wfile.frames) == 5
+    for frame in handler.wfile.frames:
+        assert frame == _jpeg(frame[2], size=len(frame) - 4)  # not overwritten by a later frame
+
+
+class _TimedClientFile:
+    def __init__(self, n_frames):
+        self.n_frames = n_frames
+        self.frames = []
+
+    def write(self, data):
+        if len(data) > 1000:
+            self.frames.append((time.monotonic(), data[2]))
+            if len(self.frames) == self.n_frames:
+                raise ConnectionResetError("client closed")
+
+
+def test_threaded_streaming_handler_fps_limit():
+    output = StreamingOutput()
+    stop = threading.Event()
+
+    def encoder():
+        generation = 0
+        while not stop.wait(0.005):  # 200 fps
+            generation += 1
+            output.write(_jpeg(generation, size=2000))
+
+    encoder_thread = threading.Thread(target=encoder)
+    encoder_thread.start()
+
+    handler = StreamingHandler.__new__(StreamingHandler)
+    handler.output_from_camera = output
+    handler.path = "/?fps=20"
+    handler.command = "GET"
+    handler.request_version = "HTTP/1.0"
+    handler.requestline = "GET /?fps=20 HTTP/1.0"
+    handler.client_address = ("127.0.0.1", 0)
+    handler.log_message = lambda *args: None
+    handler.wfile = _TimedClientFile(n_frames=6)
+    handler.do_GET()
+    stop.set()
+    encoder_thread.join()
+
+    send_times = [send_time for send_time, _ in handler.wfile.frames]
+    assert min(b - a for a, b in zip(send_times, send_times[1:])) >= 0.045
+    generations = [generation for _, generation in handler.wfile.frames]
+    assert all(b - a > 1 for a, b in zip(generations, generations[1:]))  # frames skipped
@@ -0,0 +1,19 @@
+from rpi_camera_colony.acquisition.telemetry import get_free_disk_space
+from rpi_camera_colony.latency import LatencyRecorder
+
+
+def test_latency_recorder_percentiles():
+    recorder = LatencyRecorder(size=100)
+    assert recorder.percentiles() == {}
+
+    for i in range(250):
+        recorder.add((i % 100) / 1000.0)  # ring keeps the last 100 samples: 0-99 ms
+
+    stats = recorder.percentiles()
+    assert recorder.count == 250
+    assert abs(stats["p50_ms"] - 49.5) < 1e-6
+    assert abs(stats["max_ms"] - 99.0) < 1e-6
+
+
+def test_free_disk_space_of_missing_path(tmp_path):
+    assert get_free_disk_space(tmp_path / "not" / "yet" / "created") > 0
@@ -0,0 +1,168 @@
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from rpi_camera_colony.acquisition.timestamps import (
+    TTL_IN_FIELDS,
+    TTL_OUT_FIELDS,
+    TimestampWriter,
+)
+from rpi_camera_colony.files import (
+    make_recording_file_names,
+    open_binary_timestamps,
+    write_binary_timestamps,
+)
+from rpi_camera_colony.readers import convert_timestamps_to_binary, read_session_data
+
+
+def test_timestamp_writer_csv(tmp_path):
+    path = tmp_path / "ttl.out.csv"
+    writer = TimestampWriter(path=path, fields=TTL_OUT_FIELDS, buffer_size=8, flush_interval=0.01)
+    writer.start()
+    for i in range(5):
+        assert writer.push(i * 1000, i * 1000 + 5, 1.5 + i)
+    writer.close()
+
+    lines = path.read_text().splitlines()
+    assert lines[0] == "timestamp_frame,timestamp_ttl,sys_time"
+    assert lines[1] == "0,5,1.5"
+    assert len(lines) == 6
+    assert writer.rows_written == 5
+
+
+def test_timestamp_writer_overflow(tmp_path):
+    path = tmp_path / "ttl.in.csv"
+    writer = TimestampWriter(path=path, fields=TTL_IN_FIELDS, buffer_size=4)
+    results = [writer.push(i, float(i)) for i in range(6)]
+    writer.close()
+
+    assert results == [True] * 4 + [False] * 2
+    assert writer.overflow_count == 2
+    assert writer.high_water_mark == 4
+    assert len(path.read_text().splitlines()) == 5
+
+
+def test_timestamp_writer_flush_interval_zero(tmp_path):
+    path = tmp_path / "ttl.out.csv"
+    writer = TimestampWriter(path=path, fields=TTL_OUT_FIELDS, flush_interval=0)
+    assert writer.flush_interval == 0
+    writer.start()
+    writer.push(1000, 1005, 1.5)
+
+    deadline = time.monotonic() + 2
+    while writer.rows_written < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert path.read_text().splitlines()[1] == "1000,1005,1.5"
+    writer.close()
+    assert not writer.is_alive()
+
+
+def test_binary_timestamps_roundtrip(tmp_path):
+    files = make_recording_file_names(path=tmp_path / "session.camera_1")
+    writer = TimestampWriter(
+        path=files["ttl.out"], binary_path=files["ttl.out.bin"], fields=TTL_OUT_FIELDS
+    )
+    for i in range(3):
+        writer.push(i * 1000, i * 1000 + 5, 100.25 + i)
+    writer.close()
+
+    binary = open_binary_timestamps(files["ttl.out.bin"])
+    assert binary.dtype.names == ("timestamp_frame", "timestamp_ttl", "sys_time")
+    assert binary["timestamp_frame"].tolist() == [0, 1000, 2000]
+    assert binary["sys_time"][-1] == 102.25
+
+    session = read_session_data(session_dir=tmp_path)
+    assert isinstance(session["camera_1"]["timestamps.ttl.out"], pd.DataFrame)
+    assert session["camera_1"]["timestamps.ttl.out"]["timestamp_ttl"].tolist() == [5, 1005, 2005]
+    session = read_session_data(session_dir=tmp_path, prefer_binary=True)
+    assert isinstance(session["camera_1"]["timestamps.ttl.out"], np.ndarray)
+
+
+def test_corrupt_segment_binary_timestamps_skipped(tmp_path):
+    files = [
+        make_recording_file_names(path=tmp_path / "session.camera_1", segment_index=i, dt="dt")
+        for i in range(2)
+    ]
+    write_binary_timestamps(files[0]["ttl.in.bin"], np.array([(10, 1.5)], dtype=TTL_IN_FIELDS))
+    write_binary_timestamps(files[1]["ttl.in.bin"], np.array([(20, 2.5)], dtype=TTL_IN_FIELDS))
+    Path(files[1]["ttl.in.bin"]).write_bytes(Path(files[1]["ttl.in.bin"]).read_bytes()[:20])
+
+    segment_files = read_session_data(session_dir=tmp_path, prefer_binary=True)["camera_1"][
+        "segment_files"
+    ]
+    assert segment_files[0]["timestamps.ttl.in"]["timestamp_frame"].tolist() == [10]
+    assert "timestamps.ttl.in" not in segment_files[1]
+
+
+def test_convert_csv_timestamps_to_binary(tmp_path):
+    files = make_recording_file_names(path=tmp_path / "session.camera_1")
+    Path(files["ttl.in"]).write_text("timestamp_frame,sys_time\n10,1.5\n20,2.5\n")
+
+    converted = convert_timestamps_to_binary(session_dir=tmp_path)
+
+    assert converted == [files["ttl.in.bin"]]
+    binary = open_binary_timestamps(files["ttl.in.bin"])
+    assert binary["timestamp_frame"].tolist() == [10, 20]
+    assert binary["sys_time"].tolist() == [1.5, 2.5]
+
+
+def test_clock_samples_not_read_as_timestamps(tmp_path):
+    files = make_recording_file_names(path=tmp_path / "session.camera_1")
+    Path(files["ttl.in"]).write_text("timestamp_frame,sys_time\n10,1.5\n")
+    Path(files["clock"]).write_text(
+        "camera_time,realtime,monotonic,query_duration\n1000,1.5,0.5,0.0001\n"
+    )
+
+    session = read_session_data(session_dir=tmp_path, prefer_binary=False)
+    assert list(session["camera_1"]["clock"].columns) == [
+        "camera_time",
+        "realtime",
+        "monotonic",
+        "query_duration",
+    ]
+    assert session["camera_1"]["timestamps.ttl.in"]["timestamp_frame"].tolist() == [10]
+    assert convert_timestamps_to_binary(session_dir=tmp_path) == [files["ttl.in.bin"]]
+
+
+def test_timestamp_writer_rollover(tmp_path):
+    files = [make_recording_file_names(path=tmp_path / "s.c", segment_index=i) for i in range(2)]
+    writer = TimestampWriter(path=files[0]["ttl.in"], fields=TTL_IN_FIELDS)
+    writer.push(1, 1.0)
+    writer.push(2, 2.0)
+    writer.rollover(path=files[1]["ttl.in"])
+    writer.push(3, 3.0)
+    writer.close()
+
+    assert Path(files[0]["ttl.in"]).read_text().splitlines()[1:] == ["1,1.0", "2,2.0"]
+    assert Path(files[1]["ttl.in"]).read_text().splitlines() == [
+        "timestamp_frame,sys_time",
+        "3,3.0",
+    ]
+
+
+def test_timestamp_writer_rollover_from_other_thread(tmp_path):
+    files = [make_recording_file_names(path=tmp_path / "s.c", segment_index=i) for i in range(5)]
+    writer = TimestampWriter(path=files[0]["ttl.in"], fields=TTL_IN_FIELDS, flush_interval=0.001)
+    writer.start()
+
+    def push_rows():
+        for i in range(20000):
+            writer.push(i, float(i))
+
+    producer = threading.Thread(target=push_rows)
+    producer.start()
+    for segment_files in files[1:]:
+        time.sleep(0.002)
+        writer.rollover(path=segment_files["ttl.in"])
+    producer.join()
+    writer.close()
+
+    rows = [
+        int(line.split(",")[0])
+        for segment_files in files
+        for line in Path(segment_files["ttl.in"]).read_text().splitlines()[1:]
+    ]
+    assert rows == list(range(20000))
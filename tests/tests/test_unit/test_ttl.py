@@ -0,0 +1,67 @@
+import logging
+import time
+
+from rpi_camera_colony.acquisition.simulation import gpio
+from rpi_camera_colony.acquisition.ttl import (
+    RPiGPIOBackend,
+    TTLEdgeFilter,
+    TTLPulseGenerator,
+)
+
+
+def test_pulse_generator_every_nth_and_trains():
+    edges_before = gpio.edge_count(8)
+    generator = TTLPulseGenerator(
+        pin=8,
+        backend=RPiGPIOBackend(gpio_module=gpio),
+        pulse_duration=0.0005,
+        pulses_per_trigger=2,
+        pulse_interval=0.001,
+        every_nth=3,
+        max_backlog=3,  # all triggers below are sent at once
+    )
+    generator.start()
+
+    scheduled = [generator.trigger() for _ in range(7)]
+    time.sleep(0.05)
+    generator.close()
+
+    assert scheduled == [True, False, False, True, False, False, True]
+    assert generator.pulse_count == 3
+    assert gpio.edge_count(8) - edges_before == 3 * 2 * 2  # rising & falling edges
+    assert generator.latency_stats()["count"] == 3
+    assert gpio.input(8) == gpio.LOW
+    assert generator.dropped_count == 0
+
+
+def test_pulse_generator_drops_triggers_with_full_backlog(caplog):
+    # Pulse trains (3 x 10 ms) longer than the trigger interval (5 ms)
+    generator = TTLPulseGenerator(
+        pin=9,
+        backend=RPiGPIOBackend(gpio_module=gpio),
+        pulse_duration=0,
+        pulses_per_trigger=3,
+        pulse_interval=0.01,
+        max_backlog=2,
+    )
+    assert generator.pulse_duration == 0
+    generator.start()
+
+    with caplog.at_level(logging.WARNING):
+        for _ in range(20):
+            generator.trigger()
+            time.sleep(0.005)
+        generator.close()
+
+    assert generator.dropped_count > 0
+    assert generator.pulse_count == 20 - generator.dropped_count
+    assert generator.backlog_high_water_mark <= 2
+    assert len([r for r in caplog.records if "dropping triggers" in r.getMessage()]) == 1
+
+
+def test_edge_filter_debounce_and_every_nth():
+    edge_filter = TTLEdgeFilter(debounce=100, every_nth=2)
+    recorded = [edge_filter.accept(t) for t in [0, 50, 200, 250, 400, 600, 800]]
+
+    assert recorded == [True, False, False, False, True, False, True]
+    assert edge_filter.stats() == {"edges": 7, "debounced": 2, "recorded": 3}